@@ -23,6 +23,7 @@ class BregmanDivergenceQuantizer(object):
                  use_constant_term=False,
                  solver_type='linear_hessian',
                  learning_rate=0.1,
+                 solver_cache=None,
                  ):
 
         ############
@@ -43,6 +44,8 @@ class BregmanDivergenceQuantizer(object):
         self.use_constant_term = use_constant_term
         self.solver_type = solver_type
         self.learning_rate = learning_rate
+        # optional solver_cache.SolverCache shared across fits
+        self.solver_cache = solver_cache
         ################
         ## END Inputs ##
         ################
@@ -146,19 +149,17 @@ class BregmanDivergenceQuantizer(object):
             loss wins.
         '''
 
-        results = (solverSWIG_DP.OptimizerSWIG(num_partitions, g, h)(),)
+        results = (solverSWIG_DP.OptimizerSWIG(num_partitions, g, h, compact=True, cache=self.solver_cache)(),)
 
         for rind, result in enumerate(results):
-            leaf_values = np.zeros((self.L, 1))
-            subsets = result[0]
-            for subset in subsets:
-                s = list(subset)
-                min_val = -1 * np.sum(g[s])/np.sum(h[s])
-                # XXX
-                # impliedSolverKwargs = dict(max_depth=max([int(len(s)/2), 2]))
-                # impliedSolverKwargs = dict(max_depth=int(np.log2(num_partitions)))
-                impliedSolverKwargs = dict(max_depth=None)
-                leaf_values[s] = self.learning_rate * min_val
+            min_vals = -1 * np.divide(result.a_sums, result.b_sums,
+                                      out=np.zeros_like(result.a_sums),
+                                      where=result.b_sums != 0)
+            leaf_values = self.learning_rate * min_vals[result.labels].astype(np.float64).reshape(-1, 1)
+            # XXX
+            # impliedSolverKwargs = dict(max_depth=max([int(len(s)/2), 2]))
+            # impliedSolverKwargs = dict(max_depth=int(np.log2(num_partitions)))
+            impliedSolverKwargs = dict(max_depth=None)
 
         print('leaf_values:    {!r}'.format([(round(val,8), np.sum(leaf_values==val))
                                             for val in np.unique(leaf_values)]))
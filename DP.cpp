@@ -8,6 +8,7 @@
 #include <cmath>
 #include <string>
 #include <exception>
+#include <stdexcept>
 
 #include "DP.hpp"
 
@@ -118,6 +119,9 @@ DPSolver::create_multiple_clustering_case() {
   nextStart_sec_ = std::vector<std::vector<int>>(n_, std::vector<int>(T_+1, -1));
   subsets_ = std::vector<std::vector<int>>(T_, std::vector<int>());
   score_by_subset_ = std::vector<float>(T_, 0.);
+  a_by_subset_ = std::vector<float>(T_, 0.);
+  b_by_subset_ = std::vector<float>(T_, 0.);
+  breakpoints_ = std::vector<int>();
 
   // Fill in first,second columns corresponding to T = 0,1
   for(int j=0; j<2; ++j) {
@@ -131,6 +135,10 @@ DPSolver::create_multiple_clustering_case() {
 
   std::vector<float> a_atten, b_atten;
   for (int i=0; i<n_; ++i) {
+    if (solve_interrupted(token_)) {
+      truncate_(1);
+      return;
+    }
     std::copy(a_.begin()+i, a_.end(), std::back_inserter(a_atten));
     std::copy(b_.begin()+i, b_.end(), std::back_inserter(b_atten));	      
     LTSSSolver_.reset(new LTSSSolver(n_-i, a_atten, b_atten, parametric_dist_));
@@ -149,6 +157,10 @@ DPSolver::create_multiple_clustering_case() {
   std::vector<std::vector<float>> partialSums;
   partialSums = std::vector<std::vector<float>>(n_, std::vector<float>(n_, 0.));
   for (int i=0; i<n_; ++i) {
+    if (solve_interrupted(token_)) {
+      truncate_(std::min(T_, 2));
+      return;
+    }
     for (int j=i; j<n_; ++j) {
       partialSums[i][j] = compute_score(i, j);
     }
@@ -159,9 +171,14 @@ DPSolver::create_multiple_clustering_case() {
   float maxScore, maxScore_sec;
   int maxNextStart = -1, maxNextStart_sec = -1;
   for(int j=2; j<=T_; ++j) {
+    // Columns 1, 2 and all before j are complete, column 2 from the LTSS step
+    if (solve_interrupted(token_)) {
+      truncate_(std::max(std::min(T_, 2), j-1));
+      return;
+    }
     for (int i=0; i<n_; ++i) {
-      maxScore = std::numeric_limits<float>::min();
-      maxScore_sec = std::numeric_limits<float>::min();
+      maxScore = std::numeric_limits<float>::lowest();
+      maxScore_sec = std::numeric_limits<float>::lowest();
       for (int k=i+1; k<=(n_-(j-1)); ++k) {
 	score_sec = partialSums[i][k] + maxScore_sec_[k][j-1];
 	score = std::max(partialSums[i][k] + maxScore_[k][j-1], maxScore_sec_[k][j-1]);
@@ -230,6 +247,9 @@ DPSolver::create() {
   nextStart_ = std::vector<std::vector<int>>(n_, std::vector<int>(T_+1, -1));
   subsets_ = std::vector<std::vector<int>>(T_, std::vector<int>());
   score_by_subset_ = std::vector<float>(T_, 0.);
+  a_by_subset_ = std::vector<float>(T_, 0.);
+  b_by_subset_ = std::vector<float>(T_, 0.);
+  breakpoints_ = std::vector<int>();
 
   // Fill in first,second columns corresponding to T = 0,1
   for(int j=0; j<2; ++j) {
@@ -243,6 +263,10 @@ DPSolver::create() {
   std::vector<std::vector<float>> partialSums;
   partialSums = std::vector<std::vector<float>>(n_, std::vector<float>(n_, 0.));
   for (int i=0; i<n_; ++i) {
+    if (solve_interrupted(token_)) {
+      truncate_(1);
+      return;
+    }
     for (int j=i; j<n_; ++j) {
       partialSums[i][j] = compute_score(i, j);
     }
@@ -253,8 +277,12 @@ DPSolver::create() {
   float maxScore;
   int maxNextStart = -1;
   for(int j=2; j<=T_; ++j) {
+    if (solve_interrupted(token_)) {
+      truncate_(j-1);
+      return;
+    }
     for (int i=0; i<n_; ++i) {
-      maxScore = std::numeric_limits<float>::min();
+      maxScore = std::numeric_limits<float>::lowest();
       for (int k=i+1; k<=(n_-(j-1)); ++k) {
 	score = partialSums[i][k] + maxScore_[k][j-1];
 	if (score > maxScore) {
@@ -272,10 +300,32 @@ DPSolver::create() {
 }
 
 void
-DPSolver::optimize_multiple_clustering_case() {
+DPSolver::truncate_(int t) {
+  // Interrupted with columns 0..t complete, backtrack the optimal
+  // t-subset partition instead
+  interrupted_ = true;
+  T_ = t;
+  subsets_.resize(T_);
+  score_by_subset_.resize(T_);
+  a_by_subset_.resize(T_);
+  b_by_subset_.resize(T_);
+}
+
+void
+DPSolver::reset_subsets_(int t) {
+  optimal_score_ = 0.;
+  subsets_ = std::vector<std::vector<int>>(t, std::vector<int>());
+  score_by_subset_ = std::vector<float>(t, 0.);
+  a_by_subset_ = std::vector<float>(t, 0.);
+  b_by_subset_ = std::vector<float>(t, 0.);
+  breakpoints_ = std::vector<int>();
+}
+
+void
+DPSolver::optimize_multiple_clustering_case(int T) {
   // Pick out associated maxScores element
   int currentInd = 0, nextInd = 0, nextInd1 = 0;
-  for (int t=T_; t>0; --t) {
+  for (int t=T; t>0; --t) {
     float score_num1 = 0., score_den1 = 0.;
     std::vector<int> subset;
     nextInd1 = nextStart_[currentInd][t];
@@ -284,10 +334,13 @@ DPSolver::optimize_multiple_clustering_case() {
       score_den1 += b_[i];
       subset.push_back(priority_sortind_[i]);
     }
-    subsets_[T_-t] = subset;
-    score_by_subset_[T_-t] = compute_ambient_score(score_num1, score_den1);
+    subsets_[T-t] = subset;
+    score_by_subset_[T-t] = compute_ambient_score(score_num1, score_den1);
+    a_by_subset_[T-t] = score_num1;
+    b_by_subset_[T-t] = score_den1;
+    breakpoints_.push_back(nextInd1);
     nextInd = nextInd1;
-    optimal_score_ += score_by_subset_[T_-t];
+    optimal_score_ += score_by_subset_[T-t];
     currentInd = nextInd;
     
     // Early stopping, this could correspond to an optimal single subset being
@@ -298,13 +351,15 @@ DPSolver::optimize_multiple_clustering_case() {
   }
 
   // reorder subsets
-  reorder_subsets(subsets_, score_by_subset_);
+  reorder_subsets(subsets_, score_by_subset_, a_by_subset_, b_by_subset_);
 
 }
 
 void
 DPSolver::reorder_subsets(std::vector<std::vector<int>>& subsets, 
-			  std::vector<float>& score_by_subsets) {
+			  std::vector<float>& score_by_subsets,
+			  std::vector<float>& a_by_subsets,
+			  std::vector<float>& b_by_subsets) {
   std::vector<int> ind(subsets.size(), 0);
   std::iota(ind.begin(), ind.end(), 0.);
 
@@ -315,35 +370,45 @@ DPSolver::reorder_subsets(std::vector<std::vector<int>>& subsets,
 
   // Inefficient reordering
   std::vector<std::vector<int>> subsets_s;
-  std::vector<float> score_by_subsets_s;
+  std::vector<float> score_by_subsets_s, a_by_subsets_s, b_by_subsets_s;
   subsets_s = std::vector<std::vector<int>>(subsets.size(), std::vector<int>());
   score_by_subsets_s = std::vector<float>(subsets.size(), 0.);
+  a_by_subsets_s = std::vector<float>(subsets.size(), 0.);
+  b_by_subsets_s = std::vector<float>(subsets.size(), 0.);
 
   for (size_t i=0; i<subsets.size(); ++i) {
     subsets_s[i] = subsets[ind[i]];
     score_by_subsets_s[i] = score_by_subsets[ind[i]];
+    a_by_subsets_s[i] = a_by_subsets[ind[i]];
+    b_by_subsets_s[i] = b_by_subsets[ind[i]];
   }
 
   std::copy(subsets_s.begin(), subsets_s.end(), subsets.begin());
   std::copy(score_by_subsets_s.begin(), score_by_subsets_s.end(), score_by_subsets.begin());
+  std::copy(a_by_subsets_s.begin(), a_by_subsets_s.end(), a_by_subsets.begin());
+  std::copy(b_by_subsets_s.begin(), b_by_subsets_s.end(), b_by_subsets.begin());
 		   
   
 }
 
 void
-DPSolver::optimize() {
+DPSolver::optimize(int T) {
   // Pick out associated maxScores element
   int currentInd = 0, nextInd = 0;
-  for (int t=T_; t>0; --t) {
+  for (int t=T; t>0; --t) {
     float score_num = 0., score_den = 0.;
     nextInd = nextStart_[currentInd][t];
     for (int i=currentInd; i<nextInd; ++i) {
-      subsets_[T_-t].push_back(priority_sortind_[i]);
-      score_num += a_[priority_sortind_[i]];
-      score_den += b_[priority_sortind_[i]];
+      subsets_[T-t].push_back(priority_sortind_[i]);
+      // a_, b_ are already in priority order
+      score_num += a_[i];
+      score_den += b_[i];
     }
-    score_by_subset_[T_-t] = compute_ambient_score(score_num, score_den);
-    optimal_score_ += score_by_subset_[T_-t];
+    score_by_subset_[T-t] = compute_ambient_score(score_num, score_den);
+    a_by_subset_[T-t] = score_num;
+    b_by_subset_[T-t] = score_den;
+    breakpoints_.push_back(nextInd);
+    optimal_score_ += score_by_subset_[T-t];
     currentInd = nextInd;
   }
 }
@@ -362,3 +427,42 @@ std::vector<float>
 DPSolver::get_score_by_subset_extern() const {
   return score_by_subset_;
 }
+
+bool
+DPSolver::interrupted_extern() const {
+  return interrupted_;
+}
+
+PartitionResult
+DPSolver::get_partition_result_extern() const {
+  PartitionResult result;
+  result.labels = std::vector<int>(n_, 0);
+  for (size_t i=0; i<subsets_.size(); ++i) {
+    for (auto el : subsets_[i]) {
+      result.labels[el] = static_cast<int>(i);
+    }
+  }
+  result.breakpoints = breakpoints_;
+  result.a_sums = a_by_subset_;
+  result.b_sums = b_by_subset_;
+  result.scores = score_by_subset_;
+  result.score = optimal_score_;
+  return result;
+}
+
+PartitionResult
+DPSolver::get_partition_result_extern(int t) {
+  // Columns 0..T_ of the table are complete, so the optimal partition
+  // into any t <= T_ subsets is read off by backtracking from column t.
+  // For an interrupted solve T_ is the last complete column and larger t
+  // are clamped to it. The other accessors then refer to this partition.
+  if (t < 1)
+    throw std::invalid_argument("DPSolver: number of subsets must be positive");
+  t = std::min(t, T_);
+  reset_subsets_(t);
+  if (risk_partitioning_objective_)
+    optimize(t);
+  else
+    optimize_multiple_clustering_case(t);
+  return get_partition_result_extern();
+}
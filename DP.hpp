@@ -13,6 +13,8 @@
 
 #include "score.hpp"
 #include "LTSS.hpp"
+#include "partition_result.hpp"
+#include "cancellation.hpp"
 
 #define UNUSED(expr) do { (void)(expr); } while (0)
 
@@ -26,22 +28,28 @@ public:
 	   std::vector<float> b,
 	   objective_fn parametric_dist=objective_fn::Gaussian,
 	   bool risk_partitioning_objective=false,
-	   bool use_rational_optimization=false
+	   bool use_rational_optimization=false,
+	   const CancellationToken* token=nullptr
 	   ) :
     n_{n},
     T_{T},
-    a_{a},
-    b_{b},
+    a_{std::move(a)},
+    b_{std::move(b)},
     optimal_score_{0.},
     parametric_dist_{parametric_dist},
     risk_partitioning_objective_{risk_partitioning_objective},
-    use_rational_optimization_{use_rational_optimization}
+    use_rational_optimization_{use_rational_optimization},
+    token_{token},
+    interrupted_{false}
     
   { _init(); }
 
   std::vector<std::vector<int>> get_optimal_subsets_extern() const;
   float get_optimal_score_extern() const;
   std::vector<float> get_score_by_subset_extern() const;
+  PartitionResult get_partition_result_extern() const;
+  PartitionResult get_partition_result_extern(int);
+  bool interrupted_extern() const;
   void print_maxScore_();
   void print_nextStart_();
     
@@ -56,29 +64,39 @@ private:
   float optimal_score_;
   std::vector<std::vector<int>> subsets_;
   std::vector<float> score_by_subset_;
+  std::vector<float> a_by_subset_;
+  std::vector<float> b_by_subset_;
+  std::vector<int> breakpoints_;
   objective_fn parametric_dist_;
   bool risk_partitioning_objective_;
   bool use_rational_optimization_;
+  const CancellationToken* token_;
+  bool interrupted_;
   std::unique_ptr<ParametricContext> context_;
   std::unique_ptr<LTSSSolver> LTSSSolver_;
 
   void _init() { 
     if (risk_partitioning_objective_) {
       create();
-      optimize();
+      optimize(T_);
     }
     else {
       create_multiple_clustering_case();
-      optimize_multiple_clustering_case();
+      optimize_multiple_clustering_case(T_);
     }
   }
   void create();
   void create_multiple_clustering_case();
-  void optimize();
-  void optimize_multiple_clustering_case();
+  void optimize(int);
+  void optimize_multiple_clustering_case(int);
+  void truncate_(int);
+  void reset_subsets_(int);
 
   void sort_by_priority(std::vector<float>&, std::vector<float>&);
-  void reorder_subsets(std::vector<std::vector<int>>&, std::vector<float>&);
+  void reorder_subsets(std::vector<std::vector<int>>&, 
+		       std::vector<float>&, 
+		       std::vector<float>&, 
+		       std::vector<float>&);
   float compute_score(int, int);
   float compute_ambient_score(float, float);
 };
@@ -22,8 +22,8 @@ public:
 	     objective_fn parametric_dist=objective_fn::Gaussian
 	     ) :
     n_{n},
-    a_{a},
-    b_{b},
+    a_{std::move(a)},
+    b_{std::move(b)},
     parametric_dist_{parametric_dist}
   { _init(); }
 
@@ -0,0 +1,109 @@
+import numpy as np
+
+# Separable boosting losses L(y_hat) = sum_i l(y_hat_i, y_i), in NumPy.
+# The Hessian of a separable loss is diagonal, so grad_hess only ever
+# produces the two N-vectors the solvers take, written in place into
+# caller-owned (typically float32) buffers g and h without temporaries.
+# y_hat and y are 1-d of equal length.
+
+class Loss(object):
+    name = None
+
+    def coordinatewise(self, y_hat, y):
+        raise NotImplementedError
+
+    def value(self, y_hat, y):
+        return float(np.sum(self.coordinatewise(y_hat, y), dtype=np.float64))
+
+    def grad_hess(self, y_hat, y, g, h):
+        ''' First and second derivatives of l in y_hat, into g and h '''
+        raise NotImplementedError
+
+class ExpLoss(Loss):
+    ''' exp(-(2y_hat-1)(2y-1)), labels in {0, 1} '''
+    name = 'exp'
+
+    def coordinatewise(self, y_hat, y):
+        return np.exp(-(2*y_hat-1)*(2*y-1))
+
+    def grad_hess(self, y_hat, y, g, h):
+        # h = s = 2y-1, g = e = exp(-(2y_hat-1)s); g = -2se, h = 4s^2e
+        np.multiply(y, 2, out=h)
+        np.subtract(h, 1, out=h)
+        np.multiply(y_hat, 2, out=g)
+        np.subtract(g, 1, out=g)
+        np.multiply(g, h, out=g)
+        np.negative(g, out=g)
+        np.exp(g, out=g)
+        np.multiply(g, h, out=g)
+        np.multiply(h, g, out=h)
+        np.multiply(g, -2, out=g)
+        np.multiply(h, 4, out=h)
+
+class LogisticLoss(Loss):
+    ''' log(1 + exp(-y_hat y)), labels in {-1, 1} '''
+    name = 'logistic'
+
+    def coordinatewise(self, y_hat, y):
+        return np.logaddexp(0, -y_hat*y)
+
+    def grad_hess(self, y_hat, y, g, h):
+        # g = p = 1/(1+exp(y_hat y)); g = -yp, h = y^2p(1-p)
+        np.multiply(y_hat, y, out=g)
+        with np.errstate(over='ignore'):
+            np.exp(g, out=g)
+        np.add(g, 1, out=g)
+        np.reciprocal(g, out=g)
+        np.subtract(1, g, out=h)
+        np.multiply(h, g, out=h)
+        np.multiply(h, y, out=h)
+        np.multiply(h, y, out=h)
+        np.multiply(g, y, out=g)
+        np.negative(g, out=g)
+
+class CoshLoss(Loss):
+    ''' log(cosh(y_hat-y)) '''
+    name = 'cosh'
+
+    def coordinatewise(self, y_hat, y):
+        # Stable for large residuals
+        d = np.abs(y_hat-y)
+        return d + np.log1p(np.exp(-2*d)) - np.log(2)
+
+    def grad_hess(self, y_hat, y, g, h):
+        np.subtract(y_hat, y, out=g)
+        np.tanh(g, out=g)
+        np.multiply(g, g, out=h)
+        np.subtract(1, h, out=h)
+
+class HingeLoss(Loss):
+    ''' |y_hat-y|; the Hessian vanishes almost everywhere '''
+    name = 'hinge'
+
+    def coordinatewise(self, y_hat, y):
+        return np.abs(y_hat-y)
+
+    def grad_hess(self, y_hat, y, g, h):
+        np.subtract(y_hat, y, out=g)
+        np.sign(g, out=g)
+        h.fill(0)
+
+class MSELoss(Loss):
+    ''' (y_hat-y)^2 '''
+    name = 'mse'
+
+    def coordinatewise(self, y_hat, y):
+        return (y-y_hat)**2
+
+    def grad_hess(self, y_hat, y, g, h):
+        np.subtract(y_hat, y, out=g)
+        np.multiply(g, 2, out=g)
+        h.fill(2)
+
+LOSSES = {loss.name: loss for loss in (ExpLoss(), LogisticLoss(), CoshLoss(), HingeLoss(), MSELoss())}
+
+def get_loss(name):
+    try:
+        return LOSSES[name]
+    except KeyError:
+        raise ValueError('Unknown loss {!r}, expected one of {}'.format(name, sorted(LOSSES)))
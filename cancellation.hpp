@@ -0,0 +1,84 @@
+#ifndef __CANCELLATION_HPP__
+#define __CANCELLATION_HPP__
+
+#include <atomic>
+#include <chrono>
+#include <cstdint>
+#include <stdexcept>
+
+//
+// Cooperative cancellation of long solves. The caller keeps the token and
+// may cancel() it, or give it a wall-clock deadline, from any thread. The
+// solvers poll it once per DP layer (PartitionTest once per chunk of
+// partitions). An expired token makes the solve throw SolveCancelled, or,
+// if the token was created with return_partial=true, stop early and
+// return the best feasible partition found so far: for DPSolver and
+// PartitionGraph the optimal partition into fewer subsets than asked
+// for, for PartitionTest the best of the partitions scored.
+//
+
+class SolveCancelled : public std::runtime_error {
+public:
+  explicit SolveCancelled(bool timed_out) :
+    std::runtime_error(timed_out ? "solve deadline exceeded" : "solve cancelled"),
+    timed_out_{timed_out}
+  {}
+
+  bool timed_out() const { return timed_out_; }
+
+private:
+  bool timed_out_;
+};
+
+class CancellationToken {
+public:
+  explicit CancellationToken(bool return_partial=false) :
+    return_partial_{return_partial}
+  {}
+
+  CancellationToken(const CancellationToken&) = delete;
+  CancellationToken& operator=(const CancellationToken&) = delete;
+
+  void cancel() { cancelled_.store(true); }
+  bool cancelled() const { return cancelled_.load(); }
+
+  // Deadline in seconds from now, a nonpositive value removes it
+  void set_deadline(double seconds) {
+    deadline_.store((seconds > 0.) ? now_() + static_cast<std::int64_t>(seconds*1e9) : 0);
+  }
+
+  bool timed_out() const {
+    const std::int64_t deadline = deadline_.load(std::memory_order_relaxed);
+    return (deadline > 0) && (now_() >= deadline);
+  }
+
+  bool expired() const { return cancelled() || timed_out(); }
+
+  bool return_partial() const { return return_partial_; }
+
+  // True if the solve should stop with what it has; throws SolveCancelled
+  // instead unless partial results were asked for
+  bool check() const {
+    if (!expired())
+      return false;
+    if (!return_partial_)
+      throw SolveCancelled(!cancelled());
+    return true;
+  }
+
+private:
+  std::atomic<bool> cancelled_{false};
+  std::atomic<std::int64_t> deadline_{0};
+  bool return_partial_;
+
+  static std::int64_t now_() {
+    return std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::steady_clock::now().time_since_epoch()).count();
+  }
+};
+
+// Null-safe poll for solvers taking an optional token
+inline bool solve_interrupted(const CancellationToken* token) {
+  return (token != nullptr) && token->check();
+}
+
+#endif
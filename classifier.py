@@ -9,8 +9,12 @@ import theano
 import theano.tensor as T
 
 class InductiveBase(BaseEstimator):
-    def __init__(self, classifier, X, y, **solverKwargs):
-        self.X = X
+    ''' features, if given, are the columns of X the classifier is fitted
+        on and predicts from.
+    '''
+    def __init__(self, classifier, X, y, features=None, **solverKwargs):
+        self.features = features
+        self.X = X if features is None else X[:, features]
         self.y = y
         self.classifier_ = clone(classifier)
         for attr_,val_ in solverKwargs.items():
@@ -20,18 +24,25 @@ class InductiveBase(BaseEstimator):
             
     def fit(self, **fitKwargs):
         self.classifier_.fit(self.X, self.y, **fitKwargs)
+        # The training data, a column selection of X if features is given,
+        # is only needed to fit; don't keep it alive, nor pickle it
+        self.X = self.y = None
+
+    def _features(self, X):
+        X0 = X.get_value(borrow=True)
+        return X0 if self.features is None else X0[:, self.features]
 
 class InductiveRegressor(InductiveBase):
     ''' Decorator class to turn transductive regressor
         into an inductive one.
     '''
-    def __init__(self, classifier, X, y, **solverKwargs):
-        super(InductiveRegressor, self).__init__(classifier, X, y, **solverKwargs)
+    def __init__(self, classifier, X, y, features=None, **solverKwargs):
+        super(InductiveRegressor, self).__init__(classifier, X, y, features, **solverKwargs)
         self.fit()
 
     @if_delegate_has_method(delegate='classifier_')
     def predict(self, X):
-        yhat0 = self.classifier_.predict(X.get_value())
+        yhat0 = self.classifier_.predict(self._features(X))
         yhat = T.as_tensor(yhat0.reshape(-1,1).astype(theano.config.floatX))
         return yhat
 
@@ -40,8 +51,8 @@ class InductiveClassifier(InductiveBase):
         into an inductive one.
     '''
     
-    def __init__(self, classifier, X, y, **solverKwargs):
-        super(InductiveClassifier, self).__init__(classifier, X, y, **solverKwargs)
+    def __init__(self, classifier, X, y, features=None, **solverKwargs):
+        super(InductiveClassifier, self).__init__(classifier, X, y, features, **solverKwargs)
         
         unique_vals = np.unique(y)
         self.val_to_class = dict(zip(unique_vals, range(len(unique_vals))))
@@ -53,23 +64,25 @@ class InductiveClassifier(InductiveBase):
 
     @if_delegate_has_method(delegate='classifier_')
     def predict(self, X):
-        yhat0 = self.classifier_.predict(X.get_value())
+        yhat0 = self.classifier_.predict(self._features(X))
         yhat = T.as_tensor(np.array([self.class_to_val[x]
                                      for x in yhat0]).reshape(-1, 1).astype(theano.config.floatX))            
         return yhat
 
 class CatBoostImpliedTree(CatBoostClassifier):
-    def __init__(self, X=None, y=None, max_depth=2):
+    def __init__(self, X=None, y=None, max_depth=2, features=None):
         super(CatBoostImpliedTree, self).__init__(iterations=100,
                                                   depth=2,
                                                   learning_rate=1,
                                                   loss_function='MultiClass',
                                                   verbose=False)
 
-        self.fit(X, y)
+        self.features = features
+        self.fit(X if features is None else X[:, features], y)
 
     def predict(self, X):
-        y_hat0 = super(CatBoostImpliedTree, self).predict(X.get_value())
+        X0 = X.get_value(borrow=True)
+        y_hat0 = super(CatBoostImpliedTree, self).predict(X0 if self.features is None else X0[:, self.features])
         y_hat = T.as_tensor(y_hat0.reshape(-1,1)).astype(theano.config.floatX)
         return y_hat
 
@@ -0,0 +1,180 @@
+import json
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+# Batch inference for a fitted boosted ensemble without Theano. Every
+# fitted sklearn tree is flattened into one set of node arrays, with
+# children indices offset into the shared arrays, and each node carries
+# its output directly: the regression value, or for a classifier the
+# leaf value its majority class maps to, through a lookup table. A batch
+# is evaluated a chunk of rows at a time, walking all trees for all rows
+# of the chunk together, one level per pass.
+
+class CompiledEnsemble(object):
+    ''' Flattened ensemble. roots[k] is the root node of tree k; for node i,
+        children_left[i] < 0 marks a leaf, otherwise rows with
+        X[:, feature[i]] <= threshold[i] go left. value[i] is the output
+        of leaf i. The prediction is the sum of the leaf outputs.
+    '''
+    def __init__(self, roots, children_left, children_right, feature, threshold, value, max_depth):
+        self.roots = roots
+        self.children_left = children_left
+        self.children_right = children_right
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.max_depth = int(max_depth)
+
+    @classmethod
+    def from_learners(cls, learners):
+        ''' learners are InductiveRegressor or InductiveClassifier wrappers
+            around fitted sklearn trees.
+        '''
+        roots, left, right, feature, threshold, value = [], [], [], [], [], []
+        offset, max_depth = 0, 0
+        for learner in learners:
+            tree_left, tree_right, tree_feature, tree_threshold, tree_value, depth = _flatten_learner(learner)
+            roots.append(offset)
+            left.append(np.where(tree_left >= 0, tree_left + offset, -1))
+            right.append(np.where(tree_right >= 0, tree_right + offset, -1))
+            feature.append(tree_feature)
+            threshold.append(tree_threshold)
+            value.append(tree_value)
+            offset += len(tree_left)
+            max_depth = max(max_depth, depth)
+
+        def concat(arrays, dtype):
+            return np.concatenate(arrays).astype(dtype) if arrays else np.zeros(0, dtype=dtype)
+
+        return cls(np.array(roots, dtype=np.int32),
+                   concat(left, np.int32),
+                   concat(right, np.int32),
+                   concat(feature, np.int32),
+                   concat(threshold, np.float64),
+                   concat(value, np.float64),
+                   max_depth)
+
+    @property
+    def num_trees(self):
+        return len(self.roots)
+
+    def predict(self, X, chunk_size=None):
+        ''' Sum of the tree outputs for each row of X, as an (n, 1) array,
+            evaluated chunk_size rows at a time; by default chunks hold
+            about 2**18 (row, tree) pairs.
+        '''
+        X = np.asarray(X)
+        n = X.shape[0]
+        y_hat = np.zeros((n, 1))
+        if self.num_trees == 0:
+            return y_hat
+        # Chunks are not spread over threads, the walk holds the GIL
+        chunk_size = chunk_size or max(1, 2**18 // self.num_trees)
+        for start in range(0, n, chunk_size):
+            y_hat[start:start+chunk_size, 0] = self._predict_chunk(X[start:start+chunk_size])
+        return y_hat
+
+    def _predict_chunk(self, X):
+        # sklearn compares float32 features against the thresholds
+        X = np.asarray(X, dtype=np.float32)
+        rows = np.arange(X.shape[0])[:, None]
+        node = np.repeat(self.roots[None, :], X.shape[0], axis=0)
+        for _ in range(self.max_depth):
+            left = self.children_left[node]
+            leaf = left < 0
+            if leaf.all():
+                break
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(leaf, node, np.where(go_left, left, self.children_right[node]))
+        return self.value[node].sum(axis=1)
+
+# Saved models are one file: MAGIC, the byte length of a JSON header as a
+# little-endian uint64, the header, then the arrays, each starting on an
+# ALIGN byte boundary. The header holds the metadata and, per array, its
+# dtype, shape and file offset, so that load can memory-map every array
+# in place.
+MAGIC = b'OSGBENS1'
+ALIGN = 64
+_ENSEMBLE_ARRAYS = ('roots', 'children_left', 'children_right', 'feature', 'threshold', 'value')
+
+class SavedModel(namedtuple('SavedModel', ['ensemble', 'metadata', 'tables'])):
+    ''' Model read by load: the CompiledEnsemble, the metadata dict and any
+        extra named arrays saved with it.
+    '''
+    def predict(self, X, chunk_size=None):
+        return self.ensemble.predict(X, chunk_size=chunk_size)
+
+def save(path, ensemble, metadata=None, tables=None):
+    ''' Write ensemble to path, with a JSON-serializable metadata dict and
+        tables, a dict of extra named arrays.
+    '''
+    arrays = {name: np.ascontiguousarray(getattr(ensemble, name)) for name in _ENSEMBLE_ARRAYS}
+    arrays.update({'table.' + name: np.ascontiguousarray(a) for name, a in (tables or {}).items()})
+
+    layout, offset = {}, 0
+    for name, a in arrays.items():
+        layout[name] = dict(dtype=a.dtype.str, shape=list(a.shape), offset=offset)
+        offset += -(-a.nbytes // ALIGN) * ALIGN
+    header = dict(metadata=dict(metadata or {}, max_depth=ensemble.max_depth), arrays=layout)
+
+    encoded = json.dumps(header).encode()
+    start = -(-(len(MAGIC) + 8 + len(encoded)) // ALIGN) * ALIGN
+    with open(path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(encoded)))
+        f.write(encoded)
+        for name, a in arrays.items():
+            f.seek(start + layout[name]['offset'])
+            f.write(a.tobytes())
+        f.truncate(start + offset)
+
+def load(path, mmap=True):
+    ''' SavedModel from a file written by save. The arrays are read-only
+        views of a memory map of the file unless mmap is false.
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a saved ensemble'.format(path))
+        length, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(length).decode())
+    start = -(-(len(MAGIC) + 8 + length) // ALIGN) * ALIGN
+
+    data = np.memmap(path, dtype=np.uint8, mode='r') if mmap else np.fromfile(path, dtype=np.uint8)
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape'], dtype=np.int64))
+        first = start + spec['offset']
+        arrays[name] = data[first:first + count*dtype.itemsize].view(dtype).reshape(spec['shape'])
+
+    metadata = header['metadata']
+    ensemble = CompiledEnsemble(*(arrays[name] for name in _ENSEMBLE_ARRAYS), max_depth=metadata['max_depth'])
+    tables = {name[len('table.'):]: a for name, a in arrays.items() if name.startswith('table.')}
+    return SavedModel(ensemble, metadata, tables)
+
+def _flatten_learner(learner):
+    estimator = getattr(learner, 'classifier_', None)
+    tree = getattr(estimator, 'tree_', None)
+    if tree is None:
+        raise TypeError('Cannot compile {}, only fitted sklearn trees are supported'.format(type(learner).__name__))
+
+    left = np.asarray(tree.children_left)
+    right = np.asarray(tree.children_right)
+    leaf = left < 0
+    # Leaves are never split on, any valid column will do
+    feature = np.where(leaf, 0, tree.feature)
+    features = getattr(learner, 'features', None)
+    if features is not None:
+        feature = np.asarray(features)[feature]
+
+    if hasattr(learner, 'class_to_val'):
+        # Majority class of each node, mapped back to the leaf value it
+        # stands for
+        table = np.array([learner.class_to_val[c] for c in estimator.classes_], dtype=np.float64)
+        value = table[np.argmax(tree.value[:, 0, :], axis=1)]
+    else:
+        value = tree.value[:, 0, 0].astype(np.float64)
+
+    return left, right, feature, np.asarray(tree.threshold), value, tree.max_depth
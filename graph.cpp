@@ -12,42 +12,42 @@ template<typename T>
 class TD;
 
 float
-PartitionGraph::compute_weight(int i, int j) {
-  float weight = -1. * std::pow(std::accumulate(a_.begin()+i, a_.begin()+j, 0.), 2) /
-    std::accumulate(b_.begin()+i, b_.begin()+j, 0.);
-  return weight;
+PartitionGraph::compute_weight(int i, int j) const {
+  // weight of the edge corresponding to the subset [i, j)
+  return -1. * std::pow(asum_[j]-asum_[i], 2)/(bsum_[j]-bsum_[i]);
 }
 
-float
-PartitionGraph::compute_weight(int i, int j, std::vector<float>& diffs) {
-  return diffs[i*n_+j];
+int
+PartitionGraph::num_vertices() const {
+  // source, (T-1) layers of per_level_ nodes, sink
+  return (T_-1) * per_level_ + 2;
 }
 
-void 
-PartitionGraph::add_edge_and_weight(int j, int k, std::vector<float> &&diffs)
-{
-  int curr_node = node_to_int(j, k);
-  float weight;
-
-  if (k==1) {
-    // level 1, just connect source to node
-    weight = compute_weight(0, j, diffs);
-    __attribute__((unused)) auto r = boost::add_edge(0, curr_node, EdgeWeightProperty(weight), G_);
+std::pair<int, int>
+PartitionGraph::out_edge_range(int m) const {
+  // Targets of the out-edges of node m are contiguous, [first, last)
+  int sink = num_vertices() - 1;
+  if (m == sink) {
+    return std::make_pair(sink, sink);
   }
-  else if (k==T_) {
-    // level T_, connect all nodes in previous layer to node
-    for (int i=j; i<j+per_level_-1; ++i) {
-      weight = compute_weight(i, k, diffs);
-      __attribute__((unused)) auto r = boost::add_edge(node_to_int(i, k-1), curr_node, EdgeWeightProperty(weight), G_);
-		      }
+  if (m == 0) {
+    return (T_ == 1) ? std::make_pair(sink, sink+1) : std::make_pair(1, 1+per_level_);
   }
-  else {
-    // level >= 2
-    for (int i=k-1; i<j; ++i) {
-      weight = compute_weight(i, j, diffs);
-      __attribute__((unused)) auto r = boost::add_edge(node_to_int(i, k-1), curr_node, EdgeWeightProperty(weight), G_);
-    }
+  std::pair<int, int> node = int_to_node(m);
+  int i = node.first, k = node.second;
+  if (k == T_-1) {
+    return std::make_pair(sink, sink+1);
   }
+  // (i, k) -> (j, k+1) for j in (i, k+per_level_]
+  return std::make_pair(node_to_int(i+1, k+1), node_to_int(k+per_level_, k+1)+1);
+}
+
+float
+PartitionGraph::edge_weight(int m, int l) const {
+  int sink = num_vertices() - 1;
+  int i = (m == 0) ? 0 : int_to_node(m).first;
+  int j = (l == sink) ? n_ : int_to_node(l).first;
+  return compute_weight(i, j);
 }
 
 void
@@ -79,86 +79,79 @@ PartitionGraph::create()
   // sort vectors by priority function G(x,y) = x/y
   sort_by_priority(a_, b_);
 
-  // partial sums for ease of weight calculation
-  std::vector<float> asum(n_), bsum(n_);
-  std::partial_sum(a_.begin(), a_.end(), asum.begin(), std::plus<float>());
-  std::partial_sum(b_.begin(), b_.end(), bsum.begin(), std::plus<float>());
-
-  // create sparse matrix of differences
-  int numDiff = (n_+1)*(n_);
-  float wt;
-  std::vector<float> diffs = std::vector<float>(numDiff);
-  for (int j=1; j<=n_; ++j) { diffs[j] = -1. * std::pow(asum[j-1], 2)/bsum[j-1]; }
-  for (int i=1; i<=n_; ++i) {
-    for (int j=i+1; j<=n_; ++j) {
-      wt = -1. * std::pow(asum[j-1]-asum[i-1], 2)/(bsum[j-1]-bsum[i-1]);
-      diffs[i*n_+j] = wt;
-    }
-  }
-  // std::cerr << "PRECOMPUTES COMPLETE\n";
-
-  // source added implicitly via add_edge()
-  
-  // add layers for $T \in \{1, \dots T__{-1}\}$
-  // std::cerr << "CONSTRUCTING GRAPH\n";
-  for(int k=1; k<T_; ++k) {
-    for(int j=k; j<(k+per_level_); ++j) {
-      add_edge_and_weight(j, k, std::move(diffs));
-    }
-    // std::cerr << "  LAYER " << k << " OF " << T_-1 << " COMPLETE\n";
-  }
-  
-  // add sink, must add explicitly
-  float weight;
-  int curr_node = (T_-1) * per_level_ + 1;
-  for (int j=T_-1; j<n_; ++j) {
-    weight = compute_weight(j, n_, diffs);
-    __attribute__((unused)) auto r = boost::add_edge(node_to_int(j, T_-1), curr_node, EdgeWeightProperty(weight), G_);
-  }
-  // std::cerr << "GRAPH CONSTRUCTION COMPLETE\n";
+  // partial sums for ease of weight calculation, asum_[0] = bsum_[0] = 0;
+  // edge weights are computed from these on demand
+  asum_ = std::vector<float>(n_+1, 0.);
+  bsum_ = std::vector<float>(n_+1, 0.);
+  std::partial_sum(a_.begin(), a_.end(), asum_.begin()+1, std::plus<float>());
+  std::partial_sum(b_.begin(), b_.end(), bsum_.begin()+1, std::plus<float>());
 }
 
 void
 PartitionGraph::optimize() {
-  // Glorified bellman-ford call
-  // std::cerr << "COMPUTING SHORTEST PATH\n";
-
-  int nb_vertices = boost::num_vertices(G_);
-  boost::property_map<graph_t, float EdgeWeightProperty::*>::type weight_pmap_;
-  weight_pmap_ = boost::get(&EdgeWeightProperty::weight, G_);
-  
-  // init the distance
-  std::vector<float> distance(nb_vertices, (std::numeric_limits<float>::max)());
-  distance[0] = 0.;
+  // Shortest path on the implicit layered DAG, a single Bellman-Ford pass
+  // in topological (layer) order. Only two layers of distances are live
+  // at any time; predecessors are kept for the backtrack.
+  int nb_vertices = num_vertices();
+  int sink = nb_vertices - 1;
 
   // init the predecessors (identity function)
-  std::vector<std::size_t> parent(nb_vertices);
-  for (int i = 0; i < nb_vertices; ++i)
-    parent[i] = i;
-
-  // bellman-ford
-  __attribute__((unused)) bool r = bellman_ford_shortest_paths(G_, 
-							       nb_vertices, 
-							       boost::weight_map(weight_pmap_).
-							       distance_map(&distance[0]).
-							       predecessor_map(&parent[0])
-							       );
+  std::vector<int> parent(nb_vertices);
+  std::iota(parent.begin(), parent.end(), 0);
+
+  std::vector<float> distance(1, 0.), next_distance;
+  int first = 0, last = 1;
+  while (first != sink) {
+    if (solve_interrupted(token_)) {
+      // Close the best path into the current layer with an edge to the
+      // sink; layer k gives a (k+1)-subset partition
+      interrupted_ = true;
+      float best = (std::numeric_limits<float>::max)();
+      for (int m=first; m<last; ++m) {
+	float d = distance[m-first] + edge_weight(m, sink);
+	if (d < best) {
+	  best = d;
+	  parent[sink] = m;
+	}
+      }
+      break;
+    }
+    int next_first = out_edge_range(first).first;
+    int next_last = (next_first == sink) ? sink+1 : next_first+per_level_;
+    next_distance.assign(next_last-next_first, (std::numeric_limits<float>::max)());
+
+    for (int m=first; m<last; ++m) {
+      auto range = out_edge_range(m);
+      for (int l=range.first; l<range.second; ++l) {
+	float d = distance[m-first] + edge_weight(m, l);
+	if (d < next_distance[l-next_first]) {
+	  next_distance[l-next_first] = d;
+	  parent[l] = m;
+	}
+      }
+    }
+
+    std::swap(distance, next_distance);
+    first = next_first;
+    last = next_last;
+  }
   
   // optimal paths
   std::list<int> pathlist;
-  int first=0, index = parent.back();
+  int start=0, index = parent.back();
 
   // int pathlist, in reverse order
   while (index > 0) { pathlist.push_back(index); index = parent[index]; }
   // node optimalpath
-  std::for_each(pathlist.rbegin(), pathlist.rend(), [this, &first](int a){
+  std::for_each(pathlist.rbegin(), pathlist.rend(), [this, &start](int a){
 		  std::pair<int, int> node = int_to_node(a);
 		  int last = node.first;
-		  this->optimalpath_.push_back(std::make_pair(first, last));
-		  first = last;
+		  this->optimalpath_.push_back(std::make_pair(start, last));
+		  start = last;
 		});
-  optimalpath_.push_back(std::make_pair(first, n_));
+  optimalpath_.push_back(std::make_pair(start, n_));
 
+  subsets_.resize(optimalpath_.size());
   int subset_ind = 0;
   for (auto& node : optimalpath_) {
     subsets_[subset_ind]= std::vector<int>();
@@ -171,35 +164,6 @@ PartitionGraph::optimize() {
   std::for_each(optimalpath_.begin(), optimalpath_.end(), [this](std::pair<int, int> i) {
 		  this->optimalweight_ += this->compute_weight(i.first, i.second);
 		});
-
-  // Details
-  /*
-    std::for_each(optimalpath_.begin(), optimalpath_.end(), [](std::pair<int, int> i){
-    std::cout << "[" << i.first << ", " << i.second << ") --> ";
-    });
-    std::cout << " >>SINK<< \n";
-    
-    std::cout << "SORTIND\n";
-    std::copy(priority_sortind_.begin(), priority_sortind_.end(), std::ostream_iterator<int>(std::cout, " "));
-    std::cout << "\n";
-    
-    std::cout << "WEIGHTS\n";
-    std::for_each(optimalpath_.begin(), optimalpath_.end(), [this](std::pair<int, int> i) {
-    std::cout << "[" << i.first << ", " << i.second << ") : " 
-    << this->compute_weight(i.first, i.second) << "\n";
-    });
-    
-    std::cout << "SUBSETS\n";
-    std::cout << "[\n";
-    std::for_each(subsets_.begin(), subsets_.end(), [](std::vector<int>& subset){
-    std::cout << "[";
-    std::copy(subset.begin(), subset.end(),
-    std::ostream_iterator<int>(std::cout, " "));
-    std::cout << "]\n";
-    });
-    std::cout << "]";
-  */
-    
 }
 
 std::list<std::pair<int,int>>
@@ -217,6 +181,31 @@ PartitionGraph::get_optimal_weight_extern() const {
   return optimalweight_;
 }
 
+bool
+PartitionGraph::interrupted_extern() const {
+  return interrupted_;
+}
+
+PartitionResult
+PartitionGraph::get_partition_result_extern() const {
+  // Scores are edge weights, i.e. negated rational scores
+  PartitionResult result;
+  result.labels = std::vector<int>(n_, 0);
+  int subset_ind = 0;
+  for (auto& node : optimalpath_) {
+    for (int i=node.first; i<node.second; ++i) {
+      result.labels[priority_sortind_[i]] = subset_ind;
+    }
+    result.breakpoints.push_back(node.second);
+    result.a_sums.push_back(asum_[node.second]-asum_[node.first]);
+    result.b_sums.push_back(bsum_[node.second]-bsum_[node.first]);
+    result.scores.push_back(compute_weight(node.first, node.second));
+    subset_ind++;
+  }
+  result.score = optimalweight_;
+  return result;
+}
+
 template <class NameProp>
 class name_label_writer {
 public:
@@ -243,25 +232,34 @@ private:
 
 void
 PartitionGraph::write_dot() {
+  // Materializes the implicit graph; only intended for small debug instances
+
+  int nb_vertices = num_vertices();
+  graph_t G(nb_vertices);
+  for (int m=0; m<nb_vertices; ++m) {
+    auto range = out_edge_range(m);
+    for (int l=range.first; l<range.second; ++l) {
+      __attribute__((unused)) auto r = boost::add_edge(m, l, EdgeWeightProperty(edge_weight(m, l)), G);
+    }
+  }
 
-  int nb_vertices = boost::num_vertices(G_);
   std::vector<std::string> nameProp(nb_vertices);
   for(int i=0; i<nb_vertices; ++i) {
     auto p = int_to_node(i);
     nameProp[i] = "(" + std::to_string(p.first) + ", " + std::to_string(p.second) + ")";
   }
 
-  auto weightProp = boost::get(&EdgeWeightProperty::weight, G_);
+  auto weightProp = boost::get(&EdgeWeightProperty::weight, G);
   using weightPropType = boost::adj_list_edge_property_map<boost::directed_tag, float, float&, unsigned long, EdgeWeightProperty, float EdgeWeightProperty::*>;
 
   // Full labeling
-  write_graphviz(std::cout, G_, name_label_writer<std::vector<std::string>>(nameProp), weight_label_writer<weightPropType>(weightProp));
+  write_graphviz(std::cout, G, name_label_writer<std::vector<std::string>>(nameProp), weight_label_writer<weightPropType>(weightProp));
 
   // Only node name labeling
-  // write_graphviz(std::cout, G_, name_label_writer(nameProp));
+  // write_graphviz(std::cout, G, name_label_writer(nameProp));
 
   // No labeling
-  // write_graphviz(std::cout, G_);
+  // write_graphviz(std::cout, G);
 }
 
 std::vector<int>
@@ -278,13 +276,13 @@ PartitionGraph::get_optimal_path_extern() const {
 }
     
 int
-PartitionGraph::node_to_int(int i, int j) {
+PartitionGraph::node_to_int(int i, int j) const {
   // valid for levels 1 through (T-1)
   return (j-1)*per_level_ + (i-j+1);
 }
 
 std::pair<int,int> 
-PartitionGraph::int_to_node(int m) {
+PartitionGraph::int_to_node(int m) const {
   // valid for levels 1 through (T-1)
   int a = 1 + int((m-1)/per_level_);
   int b = m - (a-1)*per_level_ + a - 1;
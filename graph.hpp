@@ -5,10 +5,11 @@
 #include <utility>
 #include <vector>
 
+#include "partition_result.hpp"
+#include "cancellation.hpp"
+
 #include <boost/graph/graph_traits.hpp>
 #include <boost/graph/adjacency_list.hpp>
-#include <boost/graph/topological_sort.hpp>
-#include <boost/graph/bellman_ford_shortest_paths.hpp>
 #include <boost/graph/graphviz.hpp>
 
 #define MON_Internal_UnusedStringify(macro_arg_string_literal) #macro_arg_string_literal
@@ -38,34 +39,49 @@ using graph_t = boost::adjacency_list<boost::listS,
 using edge_descriptor = boost::graph_traits<graph_t>::edge_descriptor;
 using edge_iterator =   boost::graph_traits<graph_t>::edge_iterator;
 
+//
+// The partition graph is a layered DAG and is never stored. Node (j, k),
+// 1 <= k < T, is the prefix [0, j) split into k subsets; node 0 is the
+// source and the last node the sink. Edge weights are computed on demand
+// from the prefix sums asum_, bsum_, and the out-edges of a node are a
+// contiguous range of node indices, generated by index arithmetic. Only
+// write_dot() materializes a graph_t, for small debug instances.
+//
+
 class PartitionGraph {
 public:
   PartitionGraph(int n, 
 		 int T,
 		 std::vector<float> a,
-		 std::vector<float> b
+		 std::vector<float> b,
+		 const CancellationToken* token=nullptr
 		 ) :
     n_{n},
     T_{T},
-    a_{a},
-    b_{b},
+    a_{std::move(a)},
+    b_{std::move(b)},
     per_level_{n-T+1},
     priority_sortind_{std::vector<int>(T_)},
     optimalweight_{0.},
-    subsets_{std::vector<std::vector<int>>(T_)}
+    subsets_{std::vector<std::vector<int>>(T_)},
+    token_{token},
+    interrupted_{false}
   { _init(); }
 
   PartitionGraph(int n,
 		 int T,
 		 float *a,
-		 float *b
+		 float *b,
+		 const CancellationToken* token=nullptr
 		 ):
     n_{n},
     T_{T},
     per_level_{n-T+1},
     priority_sortind_{std::vector<int>(T_)},
     optimalweight_{0.},
-    subsets_{std::vector<std::vector<int>>(T_)}
+    subsets_{std::vector<std::vector<int>>(T_)},
+    token_{token},
+    interrupted_{false}
   { 
     a_.assign(a, a+n);
     b_.assign(b, b+n);
@@ -80,6 +96,11 @@ public:
   std::vector<int> get_optimal_path_extern() const;
   std::vector<std::vector<int>> get_optimal_subsets_extern() const;
   float get_optimal_weight_extern() const;
+  PartitionResult get_partition_result_extern() const;
+  bool interrupted_extern() const;
+  int num_vertices() const;
+  std::pair<int, int> out_edge_range(int) const;
+  float edge_weight(int, int) const;
   void write_dot();
 
 private:
@@ -94,14 +115,15 @@ private:
   float optimalweight_;
   std::list<int> optimaledgeweights_;
   std::vector<std::vector<int>> subsets_;
-  graph_t G_;
+  std::vector<float> asum_;
+  std::vector<float> bsum_;
+  const CancellationToken* token_;
+  bool interrupted_;
 
-  inline int node_to_int(int,int);
-  inline std::pair<int, int> int_to_node(int);
+  inline int node_to_int(int,int) const;
+  inline std::pair<int, int> int_to_node(int) const;
   void sort_by_priority(std::vector<float>&, std::vector<float>&);
-  float compute_weight(int, int);
-  float compute_weight(int, int, std::vector<float>&);
-  void add_edge_and_weight(int, int, std::vector<float>&&);
+  float compute_weight(int, int) const;
 };
 
 #endif
@@ -12,6 +12,8 @@
 #include "score.hpp"
 #include "graph.hpp"
 #include "DP.hpp"
+#include "threadpool.hpp"
+#include "threadsafequeue.hpp"
 
 void sort_by_priority(std::vector<float>& a, std::vector<float>& b) {
   std::vector<int> ind(a.size());
@@ -137,6 +139,42 @@ TEST(PartitionGraphTest, OrderedProperty) {
   
 }
 
+TEST(PartitionGraphTest, OptimalityTestWithAllBreakpoints) {
+  int NUM_CASES = 100, T = 3;
+
+  std::default_random_engine gen;
+  gen.seed(std::random_device()());
+  std::uniform_int_distribution<int> distn(5, 30);
+  std::uniform_real_distribution<float> dista(-10., 10.);
+  std::uniform_real_distribution<float> distb( 1., 10.);
+
+  std::vector<float> a, b;
+
+  for (int case_num=0; case_num<NUM_CASES; ++case_num) {
+
+    int n = distn(gen);
+    a.resize(n); b.resize(n);
+
+    for (auto &el : a)
+      el = dista(gen);
+    for (auto &el : b)
+      el = distb(gen);
+
+    sort_by_priority(a, b);
+
+    auto pg = PartitionGraph(n, T, a, b);
+    auto pg_weight = pg.get_optimal_weight_extern();
+
+    // Graph weights are negated rational scores, all ordered 3-partitions
+    for (int m1=1; m1<n-1; ++m1) {
+      for (int m2=m1+1; m2<n; ++m2) {
+	float weight = -1. * (rational_obj(a, b, 0, m1) + rational_obj(a, b, m1, m2) + rational_obj(a, b, m2, n));
+	ASSERT_LE(pg_weight, weight + 1.e-3 * std::fabs(weight));
+      }
+    }
+  }
+}
+
 TEST(DPSolverTest, OptimizationFlag) {
 
   int n = 100, T = 25;
@@ -355,6 +393,91 @@ TEST(DPSolverTest, OptimalityTestWithRandomPartitions) {
   }
 }
 
+TEST(DPSolverTest, PartitionResultMatchesSubsets) {
+  int n = 50, T = 6;
+
+  std::default_random_engine gen;
+  gen.seed(std::random_device()());
+  std::uniform_real_distribution<float> dista(-10., 10.);
+  std::uniform_real_distribution<float> distb( 1., 10.);
+
+  std::vector<float> a(n), b(n);
+
+  for (auto &el : a)
+    el = dista(gen);
+  for (auto &el : b)
+    el = distb(gen);
+
+  for (bool risk_partitioning_objective : {true, false}) {
+    auto dp = DPSolver(n, T, a, b, objective_fn::RationalScore, risk_partitioning_objective, false);
+    auto subsets = dp.get_optimal_subsets_extern();
+    auto result = dp.get_partition_result_extern();
+
+    ASSERT_EQ(result.labels.size(), static_cast<size_t>(n));
+    ASSERT_EQ(result.a_sums.size(), subsets.size());
+    ASSERT_TRUE(std::is_sorted(result.breakpoints.begin(), result.breakpoints.end()));
+    ASSERT_EQ(result.breakpoints.back(), n);
+
+    for (size_t i=0; i<subsets.size(); ++i) {
+      float a_sum = 0., b_sum = 0.;
+      for (auto el : subsets[i]) {
+	ASSERT_EQ(result.labels[el], static_cast<int>(i));
+	a_sum += a[el];
+	b_sum += b[el];
+      }
+      ASSERT_NEAR(result.a_sums[i], a_sum, 1.e-3);
+      ASSERT_NEAR(result.b_sums[i], b_sum, 1.e-3);
+    }
+  }
+}
+
+TEST(DPSolverTest, FewerSubsetsFromSameTable) {
+  int n = 50, T = 6;
+
+  std::default_random_engine gen;
+  gen.seed(std::random_device()());
+  std::uniform_real_distribution<float> dista(-10., 10.);
+  std::uniform_real_distribution<float> distb( 1., 10.);
+
+  std::vector<float> a(n), b(n);
+
+  for (auto &el : a)
+    el = dista(gen);
+  for (auto &el : b)
+    el = distb(gen);
+
+  for (bool risk_partitioning_objective : {true, false}) {
+    auto dp = DPSolver(n, T, a, b, objective_fn::RationalScore, risk_partitioning_objective, false);
+    for (int t=1; t<=T; ++t) {
+      auto result = dp.get_partition_result_extern(t);
+      auto expected = DPSolver(n, t, a, b, objective_fn::RationalScore, risk_partitioning_objective, false).get_partition_result_extern();
+      ASSERT_EQ(result.labels, expected.labels);
+      ASSERT_EQ(result.breakpoints, expected.breakpoints);
+      ASSERT_NEAR(result.score, expected.score, 1.e-3);
+    }
+  }
+}
+
+TEST(DPSolverTest, NonPositiveScoresCoverAllElements) {
+  // No candidate scores above zero at the last column; the search must
+  // still pick a breakpoint
+  int n = 7, T = 3;
+  std::vector<float> a{-1.78063989, -0.799583495, 0.222664669, 0.335442126, -0.189046577, -0.105306588, 0.974047363};
+  std::vector<float> b(n, 1.);
+
+  auto dp = DPSolver(n, T, a, b, objective_fn::Gaussian, false, false);
+  auto subsets = dp.get_optimal_subsets_extern();
+
+  std::vector<int> elements;
+  for (auto& subset : subsets)
+    elements.insert(elements.end(), subset.begin(), subset.end());
+  std::sort(elements.begin(), elements.end());
+
+  std::vector<int> expected(n);
+  std::iota(expected.begin(), expected.end(), 0);
+  ASSERT_EQ(elements, expected);
+}
+
 TEST(MultiSolverTest, SmallScaleTieouts) {
 
   int n = 40, T = 10;
@@ -468,8 +591,325 @@ TEST(MultiSolverTest, LargeScaleTieouts) {
   }
 }
 
+TEST(ThreadPoolTest, NestedJobsOnSingleWorker) {
+  // The outer job waits on jobs it submitted; with one worker this only
+  // completes if waiting threads run pending tasks
+  ThreadPool pool{1};
+
+  auto outer = pool.submit([&pool]() {
+      std::vector<ThreadPool::TaskFuture<int>> v;
+      for (int i=0; i<10; ++i)
+	v.push_back(pool.submit([](int j){ return j*j; }, i));
+      int sum = 0;
+      for (auto& item : v)
+	sum += item.get();
+      return sum;
+    });
+
+  ASSERT_EQ(outer.get(), 285);
+}
+
+TEST(ThreadPoolTest, ManyJobsFromSeveralThreads) {
+  ThreadPool pool{3};
+  std::atomic<int> count{0};
+
+  auto submitter = [&pool, &count]() {
+    std::vector<ThreadPool::TaskFuture<void>> v;
+    for (int i=0; i<1000; ++i)
+      v.push_back(pool.submit([&count](){ ++count; }));
+    for (auto& item : v)
+      item.get();
+  };
+
+  std::vector<std::thread> threads;
+  for (int i=0; i<4; ++i)
+    threads.emplace_back(submitter);
+  for (auto& t : threads)
+    t.join();
+
+  ASSERT_EQ(count.load(), 4000);
+}
+
+TEST(ThreadPoolTest, ParallelForVisitsEachIndexOnce) {
+  int n = 10007;
+  std::vector<int> visits(n, 0);
+
+  DefaultThreadPool::parallel_for(0, n, 0, [&visits](int i) { ++visits[i]; });
+
+  ASSERT_EQ(std::count(visits.begin(), visits.end(), 1), n);
+}
+
+TEST(ThreadPoolTest, ParallelReduceIsDeterministic) {
+  int n = 100000;
+  std::vector<float> a(n);
+
+  std::default_random_engine gen;
+  gen.seed(std::random_device()());
+  std::uniform_real_distribution<float> dista(-10., 10.);
+  for (auto &el : a)
+    el = dista(gen);
+
+  auto sum = [&a]() {
+    return DefaultThreadPool::parallel_reduce(0, 
+					      static_cast<int>(a.size()), 
+					      0.f, 
+					      [&a](int i) { return a[i]; }, 
+					      [](float x, float y) { return x + y; },
+					      1000);
+  };
+
+  // Same grain, same order of float additions
+  float first = sum();
+  for (int i=0; i<10; ++i)
+    ASSERT_EQ(sum(), first);
+
+  // Fixed chunks of 1000, combined left to right
+  float expected = 0.;
+  for (int b=0; b<n; b+=1000) {
+    float acc = a[b];
+    for (int i=b+1; i<std::min(b+1000, n); ++i)
+      acc += a[i];
+    expected += acc;
+  }
+  ASSERT_EQ(first, expected);
+}
+
+TEST(ThreadsafeQueueTest, SizeReportsDepth) {
+  ThreadsafeQueue<int> q;
+  ThreadsafeQueue<int, LockFreeQueuePolicy> r{8};
+  for (int i=0; i<5; ++i) {
+    q.push(i);
+    r.push(i);
+  }
+  ASSERT_EQ(q.size(), 5u);
+  ASSERT_EQ(r.size(), 5u);
+
+  int el;
+  ASSERT_TRUE(r.tryPop(el));
+  ASSERT_EQ(el, 0);
+  ASSERT_EQ(r.size(), 4u);
+}
+
+TEST(ThreadsafeQueueTest, LockFreeQueueIsBounded) {
+  ThreadsafeQueue<int, LockFreeQueuePolicy> q{5};
+  ASSERT_EQ(q.capacity(), 8u);
+
+  for (int i=0; i<8; ++i) {
+    ASSERT_TRUE(q.tryPush(i));
+  }
+  int el = 8;
+  ASSERT_FALSE(q.tryPush(el));
+  ASSERT_EQ(q.size(), 8u);
+
+  // A blocked push completes once a consumer makes room
+  std::thread producer([&q]() { q.push(8); });
+  ASSERT_TRUE(q.waitPop(el));
+  producer.join();
+  ASSERT_EQ(q.size(), 8u);
+
+  for (int i=1; i<=8; ++i) {
+    ASSERT_TRUE(q.tryPop(el));
+    ASSERT_EQ(el, i);
+  }
+  ASSERT_TRUE(q.empty());
+}
+
+TEST(ThreadsafeQueueTest, LockFreeQueueManyProducersAndConsumers) {
+  ThreadsafeQueue<long, LockFreeQueuePolicy> q{64};
+  const long numItems = 20000;
+  const int numProducers = 3, numConsumers = 3;
+  std::atomic<long> sum{0}, popped{0};
+
+  std::vector<std::thread> threads;
+  for (int p=0; p<numProducers; ++p) {
+    threads.emplace_back([&q, p, numItems]() {
+	for (long i=p; i<numItems; i+=numProducers)
+	  q.push(i);
+      });
+  }
+  for (int c=0; c<numConsumers; ++c) {
+    threads.emplace_back([&q, &sum, &popped, numItems]() {
+	long el;
+	while (popped.load() < numItems) {
+	  if (q.tryPop(el)) {
+	    sum += el;
+	    ++popped;
+	  }
+	}
+      });
+  }
+  for (auto& t : threads)
+    t.join();
+
+  ASSERT_EQ(popped.load(), numItems);
+  ASSERT_EQ(sum.load(), numItems*(numItems-1)/2);
+}
+
+TEST(ThreadPoolTest, LockFreeQueuePolicy) {
+  BasicThreadPool<LockFreeQueuePolicy> pool{2};
+
+  auto sum = pool.parallel_reduce(0, 1000, 0, [](int i) { return i; }, [](int x, int y) { return x + y; }, 10);
+  ASSERT_EQ(sum, 499500);
+
+  std::vector<BasicThreadPool<LockFreeQueuePolicy>::TaskFuture<int>> v;
+  for (int i=0; i<10000; ++i)
+    v.push_back(pool.submit([](int j) { return j; }, i));
+  long total = 0;
+  for (auto& item : v)
+    total += item.get();
+  ASSERT_EQ(total, 49995000L);
+}
+
+TEST(ThreadPoolTest, ResizeAndShutdownDefaultPool) {
+  DefaultThreadPool::set_num_threads(3);
+  ASSERT_EQ(DefaultThreadPool::get_num_threads(), 3u);
+
+  // Queued jobs survive replacing the pool
+  std::vector<ThreadPool::TaskFuture<int>> v;
+  for (int i=0; i<100; ++i)
+    v.push_back(DefaultThreadPool::submitJob([](int j) { return j; }, i));
+  DefaultThreadPool::set_num_threads(2);
+  int sum = 0;
+  for (auto& item : v)
+    sum += item.get();
+  ASSERT_EQ(sum, 4950);
+  ASSERT_EQ(DefaultThreadPool::get_num_threads(), 2u);
+
+  // Cannot replace the pool from one of its own jobs
+  auto f = DefaultThreadPool::submitJob([]() { DefaultThreadPool::shutdown(); });
+  ASSERT_THROW(f.get(), std::logic_error);
+
+  // Recreated on next use
+  DefaultThreadPool::shutdown();
+  ASSERT_EQ(DefaultThreadPool::submitJob([]() { return 1; }).get(), 1);
+
+  DefaultThreadPool::set_num_threads(0);
+  ASSERT_EQ(DefaultThreadPool::get_num_threads(), static_cast<std::size_t>(DefaultThreadPool::detail::defaultNumThreads()));
+}
+
+TEST(ThreadPoolTest, TelemetryCountsJobs) {
+  ThreadPool pool{2};
+  auto sleepFor = [](int ms) { std::this_thread::sleep_for(std::chrono::milliseconds(ms)); };
+
+  // Off by default, nothing recorded
+  pool.submit(sleepFor, 1).get();
+  ThreadPoolStats st = pool.stats();
+  ASSERT_FALSE(st.enabled);
+  ASSERT_EQ(st.tasks_submitted, 0);
+  ASSERT_EQ(st.tasks_completed, 0);
+
+  pool.setTelemetry(true);
+  {
+    std::vector<ThreadPool::TaskFuture<void>> v;
+    for (int i=0; i<8; ++i)
+      v.push_back(pool.submit(sleepFor, 5));
+  }
+  // A job is accounted for just after its future is ready
+  for (int i=0; (i<1000) && (pool.stats().tasks_completed < 8); ++i)
+    sleepFor(1);
+  st = pool.stats();
+  ASSERT_TRUE(st.enabled);
+  ASSERT_EQ(st.tasks_submitted, 8);
+  ASSERT_EQ(st.tasks_completed, 8);
+  ASSERT_EQ(st.worker_tasks.size(), 2u);
+  ASSERT_EQ(st.worker_tasks[0] + st.worker_tasks[1], 8);
+  ASSERT_EQ(st.trace_start.size(), 8u);
+  ASSERT_GE(st.max_queue_depth, 1);
+  ASSERT_GE(st.total_run_time, 0.035);
+  ASSERT_GE(st.max_run_time, 0.004);
+  // 8 jobs of 5ms on 2 workers: the last ones wait for the first
+  ASSERT_GE(st.max_wait_time, 0.01);
+  for (std::size_t i=0; i<st.trace_start.size(); ++i) {
+    ASSERT_LE(st.trace_enqueue[i], st.trace_start[i]);
+    ASSERT_LE(st.trace_start[i], st.trace_finish[i]);
+  }
+  for (double ratio : st.worker_busy_ratio) {
+    ASSERT_GT(ratio, 0.);
+    ASSERT_LE(ratio, 1.);
+  }
+
+  pool.resetStats();
+  st = pool.stats();
+  ASSERT_EQ(st.tasks_completed, 0);
+  ASSERT_TRUE(st.trace_start.empty());
+}
+
+TEST(CancellationTest, ExpiredTokenStopsSolves) {
+  int n = 40, T = 6;
+  std::default_random_engine gen;
+  gen.seed(std::random_device()());
+  std::uniform_real_distribution<float> dista(-10., 10.), distb(1., 10.);
+  std::vector<float> a(n), b(n);
+  for (auto &el : a)
+    el = dista(gen);
+  for (auto &el : b)
+    el = distb(gen);
+
+  // An unexpired token changes nothing
+  CancellationToken live;
+  live.set_deadline(3600.);
+  ASSERT_EQ(DPSolver(n, T, a, b, objective_fn::Gaussian, true, false, &live).get_optimal_subsets_extern(),
+	    DPSolver(n, T, a, b, objective_fn::Gaussian, true, false).get_optimal_subsets_extern());
+  ASSERT_EQ(PartitionGraph(n, T, a, b, &live).get_optimal_subsets_extern(),
+	    PartitionGraph(n, T, a, b).get_optimal_subsets_extern());
+
+  CancellationToken cancelled;
+  cancelled.cancel();
+  ASSERT_THROW(DPSolver(n, T, a, b, objective_fn::Gaussian, true, false, &cancelled), SolveCancelled);
+  ASSERT_THROW(PartitionGraph(n, T, a, b, &cancelled), SolveCancelled);
+
+  CancellationToken expired;
+  expired.set_deadline(1e-9);
+  std::this_thread::sleep_for(std::chrono::milliseconds(1));
+  try {
+    PartitionGraph(n, T, a, b, &expired);
+    FAIL();
+  }
+  catch (const SolveCancelled& e) {
+    ASSERT_TRUE(e.timed_out());
+  }
+
+  // Partial results are feasible partitions of all elements
+  CancellationToken partial{true};
+  partial.cancel();
+  for (bool risk : {true, false}) {
+    auto dp = DPSolver(n, T, a, b, objective_fn::Gaussian, risk, false, &partial);
+    ASSERT_TRUE(dp.interrupted_extern());
+    auto subsets = dp.get_optimal_subsets_extern();
+    ASSERT_LT(subsets.size(), static_cast<std::size_t>(T));
+    std::vector<int> all;
+    for (auto& subset : subsets)
+      all.insert(all.end(), subset.begin(), subset.end());
+    std::sort(all.begin(), all.end());
+    ASSERT_EQ(all.size(), static_cast<std::size_t>(n));
+    for (int i=0; i<n; ++i)
+      ASSERT_EQ(all[i], i);
+  }
+  auto pg = PartitionGraph(n, T, a, b, &partial);
+  ASSERT_TRUE(pg.interrupted_extern());
+  ASSERT_EQ(pg.get_optimal_subsets_extern().size(), 1u);
+  ASSERT_EQ(pg.get_optimal_subsets_extern()[0].size(), static_cast<std::size_t>(n));
+}
+
+TEST(ThreadPoolTest, ParallelForSkipsChunksAfterCancel) {
+  ThreadPool pool{2};
+  CancellationToken token;
+  std::atomic<int> visited{0};
+  pool.parallel_for(0, 1000, 1, [&](int i) {
+      if (i == 10)
+	token.cancel();
+      ++visited;
+    }, &token);
+  // Chunks run in any order, those starting after index 10 are skipped
+  ASSERT_GE(visited.load(), 1);
+  ASSERT_LT(visited.load(), 1000);
+
+  // Skipped chunks contribute init
+  int sum = pool.parallel_reduce(0, 100, 0, [](int i) { return i; }, [](int x, int y) { return x + y; }, 10, &token);
+  ASSERT_EQ(sum, 0);
+}
+
 auto main(int argc, char **argv) -> int {
   testing::InitGoogleTest(&argc, argv);
   return RUN_ALL_TESTS();
 }
-
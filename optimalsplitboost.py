@@ -1,4 +1,7 @@
+import concurrent.futures
 import heapq
+import os
+import pickle
 import numpy as np
 import sklearn.base
 import sklearn.tree
@@ -6,7 +9,10 @@ import theano
 import theano.tensor as T
 import logging
 
+import boosting_losses
 import classifier
+import ensemble_inference
+import shared_compute
 import solverSWIG_DP
 
 SEED = 515
@@ -19,6 +25,10 @@ class Distribution:
 
 logging.basicConfig(format='%(asctime)s %(message)s', level=logging.WARN)
 
+def _load_array(a):
+    ''' Arrays given by the path of a .npy file are memory-mapped '''
+    return np.load(a, mmap_mode='r') if isinstance(a, str) else a
+
 class OptimalSplitGradientBoostingClassifier(object):
     def __init__(self,
                  X,
@@ -36,15 +46,27 @@ class OptimalSplitGradientBoostingClassifier(object):
                  distiller=classifier.classifierFactory(sklearn.tree.DecisionTreeClassifier),
                  use_closed_form_differentials=True,
                  risk_partitioning_objective=False,
+                 solver_cache=None,
+                 loss_function='exp',
+                 num_candidates=4,
+                 memory_budget=None,
+                 num_workers=None,
                  ):
         ############
         ## Inputs ##
         ############
+        X, y = _load_array(X), _load_array(y)
+        # optional process pool computing g, h and predictions over row
+        # shards, with X, y in its shared memory; None computes in-process
+        self._pool = None
+        if num_workers is not None:
+            self._pool = shared_compute.ShardedCompute(X, y, num_workers)
+            X, y = self._pool.X, self._pool.y
         self.X = theano.shared(value=X, name='X', borrow=True)
         self.X_all = theano.shared(value=X, name='X_all', borrow=True)
         self.y = theano.shared(value=y, name='y', borrow=True)
         self.y_all = theano.shared(value=y, name='y_all', borrow=True)
-        initial_X = self.X.get_value()
+        initial_X = self.X.get_value(borrow=True)
         self.N, self.num_features = initial_X.shape
         self.N_all, self.num_features_all = self.N, self.num_features
         
@@ -65,26 +87,50 @@ class OptimalSplitGradientBoostingClassifier(object):
         self.distiller = distiller
         self.use_closed_form_differentials = use_closed_form_differentials
         self.risk_partitioning_objective = risk_partitioning_objective
+        # optional solver_cache.SolverCache, e.g. on disk to survive restarts
+        self.solver_cache = solver_cache
+        # one of boosting_losses.LOSSES
+        self.loss_function = boosting_losses.get_loss(loss_function)
+        # number of partition sizes tried at each step
+        self.num_candidates = num_candidates
+        # bytes of working memory per pass over X, None to process X whole;
+        # X, y may then be memory-mapped, see _chunk_size. The model only
+        # changes if the budget caps the row sample, see _max_sample_rows
+        self.memory_budget = memory_budget
         ################
         ## END Inputs ##
         ################
 
-        # optimal partition at each step, not part of any gradient, not a tensor
+        # float32 gradient, hessian buffers, see _differential_buffers
+        self._g = self._h = None
+        # fits and scores the candidate splits of a step concurrently
+        self._candidate_executor = None
+        # sampled rows of X, reused across steps, see _subsample_rows
+        self._X_sample = self._X_sample_shared = None
+        # row, column index arrays of the current sample
+        self.row_mask = self.col_mask = None
+        # ensemble size with the lowest validation loss, see fit
+        self.best_iteration = None
+        # flattened ensemble for predict_batch, see compile_ensemble
+        self._compiled_ensemble = None
+        # learner of the best candidate split, see find_best_optimal_split
+        self._best_split_tree = None
+
+        # Per step only the compact model is kept: leaf values at step i are
+        # distinct_leaf_values[i][partitions[i]]
+        # optimal partition at each step, as labels into the distinct leaf
+        # values, not part of any gradient, not a tensor. Only the last
+        # step's N labels are kept, earlier ones are None once the next
+        # step is set, see set_next_leaf_value
         self.partitions = list()
         # distinct leaf values at each step, not a tesnor
-        self.distinct_leaf_values = np.zeros((self.num_classifiers + 1,
-                                             self.N))
+        self.distinct_leaf_values = list()
         # regularization penalty at each step
         self.regularization = theano.shared(name='regularization',
                                             value=np.zeros((self.num_classifiers + 1,
                                                             1)).astype(theano.config.floatX))
-        # leaf values at each step
-        self.leaf_values = theano.shared(name='leaf_values',
-                                         value=np.zeros((self.num_classifiers + 1,
-                                                         self.N,
-                                                         1)).astype(theano.config.floatX))
         # classifier at each step
-        self.implied_trees = [classifier.LeafOnlyTree(self.X.get_value(), 0.5 * np.ones((self.N, 1)))] * \
+        self.implied_trees = [classifier.LeafOnlyTree(self.X.get_value(borrow=True), 0.5 * np.ones((self.N, 1)))] * \
                              (self.num_classifiers + 1)
 
         # Set initial set of leaf_values to be random
@@ -99,11 +145,14 @@ class OptimalSplitGradientBoostingClassifier(object):
             raise RuntimeError('Cannot determine whether distiller is of classifier or regressor type.')
         self.set_next_leaf_value(leaf_value)
 
-        # Set initial partition to be the size 1 partition (all leaf values the same)
-        self.partitions.append(list(range(self.N)))
-
         # Set initial classifier
-        implied_tree = self.imply_tree(leaf_value)
+        num_rows = self._max_sample_rows()
+        if num_rows >= self.N:
+            implied_tree = self.imply_tree(leaf_value)
+        else:
+            # Fitted on as many random rows as fit the memory budget
+            rows = np.sort(rng.choice(self.N, size=num_rows, replace=False))
+            implied_tree = self.distiller(np.take(initial_X, rows, axis=0), leaf_value[rows])
         
         self.set_next_classifier(implied_tree)        
         
@@ -111,32 +160,120 @@ class OptimalSplitGradientBoostingClassifier(object):
         self.srng = T.shared_randomstreams.RandomStreams(seed=SEED)
 
         # Set initial predictions
-        self.curr_predictions = np.zeros((self.num_classifiers+1,
-                                          self.N,
-                                          1)).astype(theano.config.floatX)
-        self.curr_predictions[0] = theano.function([], implied_tree.predict(self.X))()
+        # running sum of predictions over the ensemble so far
+        self.y_hat_sum = np.zeros((self.N, 1)) if self._pool is None else self._pool.y_hat_sum
+        self.add_learner_prediction(implied_tree)
 
         # masks
-        self.row_mask = list(range(self.N))
-        self.col_mask = list(range(self.num_features))
+        self.row_mask = np.arange(self.N)
+        self.col_mask = np.arange(self.num_features)
 
         self.curr_classifier += 1
 
     def set_next_classifier(self, classifier):
         i = self.curr_classifier
+        if i == len(self.implied_trees):
+            # Continuing past num_classifiers, see fit
+            self.implied_trees.append(classifier)
         self.implied_trees[i] = classifier
+        self._compiled_ensemble = None
+
+    def set_next_prediction(self, prediction):
+        self.y_hat_sum += prediction
+
+    def add_learner_prediction(self, learner, sign=1.):
+        ''' Add sign times the predictions of learner on X to the running sum,
+            over row shards in the process pool if there is one.
+        '''
+        if self._pool is not None:
+            try:
+                ensemble = ensemble_inference.CompiledEnsemble.from_learners([learner])
+            except TypeError:
+                ensemble = None
+            if ensemble is not None:
+                # The shards of all workers are in flight at once
+                row_bytes = self.num_features * (self.X_all.get_value(borrow=True).itemsize + 8)
+                shard_size = self._chunk_size(self.N, row_bytes * self._pool.num_workers)
+                self._pool.add_predictions(ensemble, sign, shard_size=shard_size)
+                return
+        self.set_next_prediction(sign * self._learner_predict(learner, self.X))
 
     def set_next_leaf_value(self, leaf_value):
-        i = self.curr_classifier
-        c = T.dmatrix()
-        update = (self.leaf_values,
-                  T.set_subtensor(self.leaf_values[i, :, :], c))
-        f = theano.function([c], updates=[update])
-        f(leaf_value)
+        values, labels = np.unique(np.ravel(leaf_value), return_inverse=True)
+        self.distinct_leaf_values.append(values.astype(theano.config.floatX))
+        # The learners of earlier steps are fitted, their labels are no
+        # longer needed; keeping them would cost N per step
+        if self.partitions:
+            self.partitions[-1] = None
+        self.partitions.append(labels.astype(np.min_scalar_type(max(len(values)-1, 0))))
+
+    def leaf_values(self, i):
+        ''' Leaf values of classifier i, one per row; only kept for the
+            last step.
+        '''
+        if self.partitions[i] is None:
+            raise ValueError('Partition of step {} was not kept, only the last step\'s is'.format(i))
+        return self.distinct_leaf_values[i][self.partitions[i]].reshape(-1, 1)
+
+    def _differential_buffers(self, n):
+        ''' Preallocated gradient and hessian, reused while n is unchanged '''
+        if self._g is None or self._g.shape[0] != n:
+            self._g = np.empty(n, dtype=np.float32)
+            self._h = np.empty(n, dtype=np.float32)
+        return self._g, self._h
+
+    def _chunk_size(self, n, row_bytes):
+        ''' Rows per chunk so that row_bytes of working memory per row fit
+            the memory budget, less the row sample buffer held throughout;
+            all n rows without a budget.
+        '''
+        if self.memory_budget is None:
+            return max(n, 1)
+        held = 0 if self._X_sample is None else self._X_sample.nbytes
+        return max(1, int((self.memory_budget - held) // row_bytes))
+
+    def _max_sample_rows(self):
+        ''' Most rows of X held in memory at once for the distiller: the
+            sample itself and, while a learner is fitted on it, its column
+            selection and float32 copy. Under a memory budget candidates
+            are fitted one at a time, see find_best_optimal_split.
+        '''
+        X_all = self.X_all.get_value(borrow=True)
+        if self.memory_budget is None:
+            return X_all.shape[0]
+        return max(1, int(self.memory_budget // (X_all.shape[1] * (2*X_all.itemsize + 4))))
+
+    def _learner_predict(self, learner, X):
+        ''' Predictions of learner on the shared X, as an (n, 1) array. With a
+            memory budget X is streamed through the learner in chunks.
+        '''
+        if self.memory_budget is None:
+            return self._value(learner.predict(X))
+        X0 = X.get_value(borrow=True)
+        n = X0.shape[0]
+        y_hat = np.empty((n, 1))
+        # Chunk read, float32 conversion and column selection
+        size = self._chunk_size(n, X0.shape[1] * (X0.itemsize + 8))
+        for start in range(0, n, size):
+            X_chunk = theano.shared(value=np.asarray(X0[start:start+size]), borrow=True)
+            y_hat[start:start+size] = self._value(learner.predict(X_chunk))
+        return y_hat
+
+    @staticmethod
+    def _value(expr):
+        ''' Value of a prediction graph. Implied tree predictions are
+            constants, read directly rather than compiling a function.
+        '''
+        if isinstance(expr, T.TensorConstant):
+            return expr.data
+        return expr.eval()
 
     def imply_tree(self, leaf_values, **impliedSolverKwargs):
-        X0 = self.X.get_value()
+        X0 = self.X.get_value(borrow=True)
         y0 = leaf_values
+        if self.col_mask is not None and len(self.col_mask) < self.num_features:
+            # Column sampling restricts the features the learner may use
+            impliedSolverKwargs['features'] = self.col_mask
         return self.distiller(X0, y0, **impliedSolverKwargs)
             
     def weak_learner_predict(self, classifier_ind):
@@ -150,6 +287,41 @@ class OptimalSplitGradientBoostingClassifier(object):
             y_hat += self.implied_trees[classifier_ind].predict(X)
         return y_hat
         
+    def compile_ensemble(self):
+        ''' ensemble_inference.CompiledEnsemble of the current learners,
+            rebuilt after the ensemble changes.
+        '''
+        if self._compiled_ensemble is None:
+            self._compiled_ensemble = ensemble_inference.CompiledEnsemble.from_learners(
+                self.implied_trees[:self.curr_classifier])
+        return self._compiled_ensemble
+
+    def predict_batch(self, X0, chunk_size=None):
+        ''' NumPy counterpart of predict_from_input, from the compiled
+            ensemble, evaluated in chunks.
+        '''
+        return self.compile_ensemble().predict(X0, chunk_size=chunk_size)
+        
+    def save(self, path):
+        ''' Compact inference model: the compiled ensemble, the distinct leaf
+            values of each step (leaf_values, with step k's at
+            leaf_values[leaf_value_offsets[k]:leaf_value_offsets[k+1]]) and
+            metadata. Read back with load, ensemble_inference.load if Theano
+            should not be imported.
+        '''
+        values = self.distinct_leaf_values[:self.curr_classifier]
+        ensemble_inference.save(path,
+                                self.compile_ensemble(),
+                                metadata=dict(num_classifiers=self.curr_classifier,
+                                              num_features=self.num_features,
+                                              loss_function=self.loss_function.name,
+                                              learning_rate=self.learning_rate,
+                                              best_iteration=self.best_iteration),
+                                tables=dict(leaf_values=np.concatenate(values) if values else np.zeros(0),
+                                            leaf_value_offsets=np.cumsum([0] + [len(v) for v in values])))
+
+    load = staticmethod(ensemble_inference.load)
+
     def predict_old(self):
         y_hat = theano.shared(name='y_hat', value=np.zeros((self.N, 1)))
         for classifier_ind in range(self.curr_classifier):
@@ -157,14 +329,27 @@ class OptimalSplitGradientBoostingClassifier(object):
         return y_hat
 
     def predict(self):
-        # col_mask filtering handled differently; masked columns
-        # are 0-filled to supress
-        # XXX
-        # Above method doesn't work with tree classifier, e.g.
-        y_hat = np.zeros((self.N, 1))
-        for classifier_ind in range(self.curr_classifier):
-            y_hat += self.curr_predictions[classifier_ind][self.row_mask,:]
-        return theano.shared(name='y_hat', value=y_hat, borrow=True)
+        return theano.shared(name='y_hat', value=self._predict_value(), borrow=True)
+
+    def _predict_value(self):
+        # Column sampling only restricts the features of the next learner,
+        # so the cached predictions hold under any col_mask
+        return self.y_hat_sum[self.row_mask,:]
+
+    def _current_loss(self, leaf_values):
+        return self._loss_value(self._predict_value(),
+                                len(np.unique(leaf_values)),
+                                leaf_values)
+
+    def _loss_value(self, y_hat, num_partitions, leaf_values):
+        ''' NumPy counterpart of loss '''
+        size_reg = self.gamma * num_partitions
+        coeff_reg = 0.5 * self.eta * np.sum(np.unique(leaf_values)**2)
+        y_hat, y = y_hat.ravel(), self.y.get_value(borrow=True)
+        size = self._chunk_size(len(y), 32)
+        loss = sum(self.loss_function.value(y_hat[start:start+size], y[start:start+size])
+                   for start in range(0, len(y), size))
+        return loss + size_reg + coeff_reg
 
     def predict_scan(self):
         def iter_step(classifier_ind):
@@ -181,90 +366,211 @@ class OptimalSplitGradientBoostingClassifier(object):
 
         return T.sum(y, axis=0)
 
-    def fit(self, num_steps=None):
+    def fit(self,
+            num_steps=None,
+            validation_data=None,
+            early_stopping_rounds=None,
+            tol=0.,
+            checkpoint_path=None,
+            checkpoint_every=10,
+            resume_from=None,
+            additional_steps=None):
+        ''' Boost until the ensemble has num_steps learners, or for
+            additional_steps more than it has; steps already taken, by an
+            earlier fit or in the checkpoint at resume_from, are not redone.
+            With checkpoint_path, a checkpoint is written there every
+            checkpoint_every steps and at the end.
+
+            With validation_data=(X_val, y_val) the unregularized loss on it is
+            also reported, from predictions updated by one learner per step.
+            With early_stopping_rounds as well, training stops once that loss
+            has not improved by more than tol for that many steps, and the
+            ensemble is truncated to the best iteration.
+        '''
+        if resume_from is not None:
+            self.load_checkpoint(resume_from)
+        if additional_steps is not None:
+            num_steps = self.curr_classifier + additional_steps
         num_steps = num_steps or self.num_classifiers
+        if early_stopping_rounds is not None and validation_data is None:
+            raise ValueError('early_stopping_rounds requires validation_data')
+
+        if validation_data is not None:
+            X_val = theano.shared(value=np.asarray(validation_data[0]), name='X_val', borrow=True)
+            y_val = np.asarray(validation_data[1])
+            y_hat_val = np.zeros((y_val.shape[0], 1))
+            for classifier_ind in range(self.curr_classifier):
+                y_hat_val += self._learner_predict(self.implied_trees[classifier_ind], X_val)
+            best_loss = self.loss_function.value(y_hat_val.ravel(), y_val)
+            self.best_iteration = self.curr_classifier
 
         # Initial leaf_values for initial loss calculation
-        leaf_values = self.leaf_values.get_value()[0,:]
-        print('STEP {}: LOSS: {:4.6f}'.format(0,
-                                              theano.function([],
-                                                              self.loss(
-                                                                  self.predict(),
-                                                                  len(np.unique(leaf_values)),
-                                                                  leaf_values))()))
+        leaf_values = self.distinct_leaf_values[-1+self.curr_classifier]
+        print('STEP {}: LOSS: {:4.6f}'.format(-1+self.curr_classifier, self._current_loss(leaf_values)))
         # Iterative boosting
-        for i in range(1,num_steps):
+        for i in range(self.curr_classifier,num_steps):
             self.fit_step()
-            leaf_values = self.leaf_values.get_value()[-1+self.curr_classifier,:]
-            print('STEP {}: LOSS: {:4.6f}'.format(i,
-                                                  theano.function([],
-                                                                  self.loss(
-                                                                      self.predict(),
-                                                                      len(np.unique(leaf_values)),
-                                                                      leaf_values))()))
+            leaf_values = self.distinct_leaf_values[-1+self.curr_classifier]
+            message = 'STEP {}: LOSS: {:4.6f}'.format(i, self._current_loss(leaf_values))
+            if validation_data is not None:
+                y_hat_val += self._learner_predict(self.implied_trees[-1+self.curr_classifier], X_val)
+                loss_val = self.loss_function.value(y_hat_val.ravel(), y_val)
+                message += ' VALIDATION LOSS: {:4.6f}'.format(loss_val)
+                if loss_val < best_loss - tol:
+                    best_loss, self.best_iteration = loss_val, self.curr_classifier
+            print(message)
             # Summary statistics mid-training
+            if early_stopping_rounds is not None and \
+               self.curr_classifier - self.best_iteration >= early_stopping_rounds:
+                print('Stopping early, best iteration {}'.format(self.best_iteration))
+                break
+            if checkpoint_path is not None and i % checkpoint_every == 0:
+                self.save_checkpoint(checkpoint_path)
+
+        if early_stopping_rounds is not None:
+            self.truncate(self.best_iteration)
+        if checkpoint_path is not None:
+            self.save_checkpoint(checkpoint_path)
         print('Training finished')
 
+    def save_checkpoint(self, path):
+        ''' Training state after the last step: learners, running predictions,
+            distinct leaf values and the sampling RNG. The training data and
+            the per-step partitions, N labels each, are not included; resume
+            on the same X, y. Written atomically.
+        '''
+        state = dict(N=self.N,
+                     num_features=self.num_features,
+                     loss_function=self.loss_function.name,
+                     curr_classifier=self.curr_classifier,
+                     implied_trees=self.implied_trees[:self.curr_classifier],
+                     distinct_leaf_values=self.distinct_leaf_values,
+                     y_hat_sum=self.y_hat_sum,
+                     best_iteration=self.best_iteration,
+                     rng_state=rng.get_state())
+        tmp = '{}.tmp'.format(path)
+        with open(tmp, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    def load_checkpoint(self, path):
+        ''' Restore the state written by save_checkpoint, for a model built on
+            the same training data.
+        '''
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+        if (state['N'], state['num_features']) != (self.N, self.num_features):
+            raise ValueError('Checkpoint {} is for {} x {} training data, not {} x {}'.format(
+                path, state['N'], state['num_features'], self.N, self.num_features))
+
+        self.loss_function = boosting_losses.get_loss(state['loss_function'])
+        self.curr_classifier = state['curr_classifier']
+        trees = state['implied_trees']
+        self.implied_trees[:len(trees)] = trees
+        self.distinct_leaf_values = state['distinct_leaf_values']
+        # Training never reads the partitions of earlier steps
+        self.partitions = [None] * self.curr_classifier
+        self.y_hat_sum[...] = state['y_hat_sum']
+        self.best_iteration = state['best_iteration']
+        rng.set_state(state['rng_state'])
+        self._compiled_ensemble = None
+
+    def truncate(self, num_classifiers):
+        ''' Drop the learners after the first num_classifiers '''
+        for classifier_ind in range(num_classifiers, self.curr_classifier):
+            self.add_learner_prediction(self.implied_trees[classifier_ind], sign=-1.)
+        del self.partitions[num_classifiers:]
+        del self.distinct_leaf_values[num_classifiers:]
+        self.curr_classifier = min(self.curr_classifier, num_classifiers)
+        self._compiled_ensemble = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        ''' Stop the process pool and the candidate threads. The shared arrays
+            are copied back into private ones, the model stays usable; X
+            memory-mapped from a file stays so. Also called on leaving a
+            with block.
+        '''
+        if self._pool is not None:
+            self.y_hat_sum = np.array(self.y_hat_sum)
+            if self._pool._X_spec[0] != 'file':
+                self.X = self.X_all = theano.shared(value=np.array(self.X_all.get_value(borrow=True)), name='X', borrow=True)
+            else:
+                self.X = self.X_all
+            self.y = self.y_all = theano.shared(value=np.array(self.y_all.get_value(borrow=True)), name='y', borrow=True)
+            self._pool.close()
+            self._pool = None
+        if self._candidate_executor is not None:
+            self._candidate_executor.shutdown()
+            self._candidate_executor = None
+
     def find_best_optimal_split(self, g, h, num_partitions):
-        ''' Method: results contains the optimal partitions for all partition sizes in
-            [1, num_partitions]. We take each, from the optimal_split_tree from an
-            inductive fitting of the classifier, then look at the loss of the new
-            predictor (current predictor + optimal_split_tree predictor). The minimal
-            loss wins.
+        ''' Method: results contains the optimal partitions for each candidate
+            partition size in num_partitions, all from one DP table. We take each,
+            form the optimal_split_tree from an inductive fitting of the classifier,
+            then look at the loss of the new predictor (current predictor +
+            optimal_split_tree predictor). The minimal loss wins. Candidates are
+            fitted and scored concurrently, unless there is a memory budget.
         '''
+        if np.isscalar(num_partitions):
+            num_partitions = (num_partitions,)
 
         # XXX
         # Revisit use_rational_optimization flag
-        results = solverSWIG_DP.OptimizerSWIG(num_partitions,
-                                              g,
-                                              h,
-                                              objective_fn=Distribution.RATIONALSCORE,
-                                              risk_partitioning_objective=self.risk_partitioning_objective,
-                                              use_rational_optimization=False)()
+        results = solverSWIG_DP.optimize_candidates__DP(num_partitions,
+                                                        g,
+                                                        h,
+                                                        objective_fn=Distribution.RATIONALSCORE,
+                                                        risk_partitioning_objective=self.risk_partitioning_objective,
+                                                        use_rational_optimization=False,
+                                                        cache=self.solver_cache)
         
         logging.info('found optimal partition')
 
-        npart = T.scalar('npart')
-        lv = T.dmatrix('lv')
-        x = T.dmatrix('x')
-        loss = theano.function([x,npart,lv], self.loss(x, npart, lv))
-        
-        leaf_values = self.leaf_values.get_value()[-1+self.curr_classifier,:]
-        loss_heap = []
-
-        results = (results,)
-
-        for rind, result in enumerate(results):
-            leaf_values = np.zeros((self.N, 1))
-            subsets = result[0]
-            for subset in subsets:
-                s = list(subset)
-
-                # XXX
-                # Do we need regularization terms here?
-                min_val = -1 * np.sum(g[s])/np.sum(h[s])
-                
-                # XXX
-                # impliedSolverKwargs = dict(max_depth=max([int(len(s)/2), 2]))
-                # impliedSolverKwargs = dict(max_depth=int(np.log2(num_partitions)))
-                impliedSolverKwargs = dict(max_depth=None)
-                leaf_values[s] = self.learning_rate * min_val
+        y_hat = self._predict_value()
+
+        def evaluate(result):
+            # XXX
+            # Do we need regularization terms here?
+            # Empty subsets (early stopping in the solver) are never labeled
+            min_vals = -1 * np.divide(result.a_sums, result.b_sums,
+                                      out=np.zeros_like(result.a_sums),
+                                      where=result.b_sums != 0)
+            leaf_values = self.learning_rate * min_vals[result.labels].astype(np.float64).reshape(-1, 1)
+
+            # XXX
+            # impliedSolverKwargs = dict(max_depth=max([int(len(s)/2), 2]))
+            # impliedSolverKwargs = dict(max_depth=int(np.log2(num_partitions)))
+            impliedSolverKwargs = dict(max_depth=None)
             optimal_split_tree = self.imply_tree(leaf_values, **impliedSolverKwargs)
-            loss_new = loss(theano.function([], self.predict())() +
-                            theano.function([], optimal_split_tree.predict(self.X))(),
-                            len(subsets),
-                            leaf_values)
-            heapq.heappush(loss_heap, (loss_new.item(0), rind, leaf_values))
+            loss_new = self._loss_value(y_hat + self._learner_predict(optimal_split_tree, self.X),
+                                        len(result.a_sums),
+                                        leaf_values)
+            return loss_new, leaf_values, optimal_split_tree
+
+        if len(results) == 1 or self.memory_budget is not None:
+            # Under a memory budget only one learner is fitted at a time
+            evaluated = [evaluate(result) for result in results]
+        else:
+            if self._candidate_executor is None:
+                self._candidate_executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.num_candidates)
+            evaluated = list(self._candidate_executor.map(evaluate, results))
+
+        loss_heap = []
+        for rind, (loss_new, leaf_values, optimal_split_tree) in enumerate(evaluated):
+            heapq.heappush(loss_heap, (loss_new, rind, leaf_values))
 
         best_loss, best_rind, best_leaf_values = heapq.heappop(loss_heap)
+        optimal_split_tree = evaluated[best_rind][2]
+        self._best_split_tree = optimal_split_tree
 
         logging.info('found optimal leaf values')
 
-        # XXX
-        # solverKwargs = dict(max_depth=int(np.log2(num_partitions)))
-        solverKwargs = dict(max_depth=None)        
-        optimal_split_tree = self.imply_tree(best_leaf_values, **solverKwargs)
-
         # ===============================
         # == If DecisionTreeClassifier ==
         # ===============================
@@ -274,8 +580,6 @@ class OptimalSplitGradientBoostingClassifier(object):
         # graph = graphviz.Source(dot_data)
         # graph.render('Boosting')
 
-        self.partitions.append(results[best_rind][0])
-
         # XXX
         # implied_values = theano.function([], optimal_split_tree.predict(self.X))()
         # logging.info('found implied values for comparison')
@@ -290,12 +594,23 @@ class OptimalSplitGradientBoostingClassifier(object):
 
     @contextmanager
     def _subsample_rows(self):
-
-        mask = sorted(rng.choice(self.N, size=int(self.N * self.row_sample_ratio), replace=False))
-
-        self.X = theano.shared(value=self.X_all.get_value()[mask,:], name='X', borrow=True)
-        self.y = theano.shared(value=self.y_all.get_value()[mask], name='y', borrow=True)
-        self.N = int(self.N * self.row_sample_ratio)
+        ''' Sorted index array of the sampled rows. The rows of X are gathered
+            into a scratch buffer allocated once and reused by every step;
+            without row sampling X itself is used. With a memory budget, at
+            most _max_sample_rows rows are sampled.
+        '''
+        n = min(int(self.N * self.row_sample_ratio), self._max_sample_rows())
+        mask = np.arange(self.N) if n == self.N else np.sort(rng.choice(self.N, size=n, replace=False))
+
+        if n < self.N:
+            X_all = self.X_all.get_value(borrow=True)
+            if self._X_sample is None or self._X_sample.shape != (n, X_all.shape[1]) or self._X_sample.dtype != X_all.dtype:
+                self._X_sample = np.empty((n, X_all.shape[1]), dtype=X_all.dtype)
+                self._X_sample_shared = theano.shared(value=self._X_sample, name='X', borrow=True)
+            np.take(X_all, mask, axis=0, out=self._X_sample)
+            self.X = self._X_sample_shared
+            self.y = theano.shared(value=self.y_all.get_value(borrow=True)[mask], name='y', borrow=True)
+            self.N = n
 
         try:
             yield mask
@@ -304,18 +619,13 @@ class OptimalSplitGradientBoostingClassifier(object):
 
     @contextmanager
     def _subsample_columns(self):
-        ''' Must be called after _subsample_rows, if that is called. We handle subsampling
-            of columns differently than subsampling of rows as the number of features is
-            built in to the classifier.
+        ''' Must be called after _subsample_rows, if that is called. Sorted index
+            array of the columns the next learner may use, passed to the distiller
+            as its feature selection by imply_tree; X is left as it is.
         '''
-
-        mask = sorted(rng.choice(self.num_features,
-                                 size=int(self.num_features * (1. - self.col_sample_ratio)), replace=False))
-
-        X0 = self.X.get_value()
-        # X0[:,sorted(set(range(self.num_features)) - set(mask))] = 0
-        X0[:, sorted(set(mask))] = 0
-        self.X = theano.shared(value=X0, name='X', borrow=True)
+        num_kept = self.num_features - int(self.num_features * (1. - self.col_sample_ratio))
+        mask = np.arange(self.num_features) if num_kept == self.num_features \
+               else np.sort(rng.choice(self.num_features, size=num_kept, replace=False))
 
         try:
             yield mask
@@ -340,7 +650,10 @@ class OptimalSplitGradientBoostingClassifier(object):
                 logging.info('generated coefficients')
             
                 # SWIG optimizer, task-based C++ distribution
-                num_partitions = int(rng.choice(range(self.min_partition_size, self.max_partition_size)))
+                partition_sizes = range(self.min_partition_size, self.max_partition_size)
+                num_partitions = sorted(int(t) for t in rng.choice(partition_sizes,
+                                                                   size=min(self.num_candidates, len(partition_sizes)),
+                                                                   replace=False))
         
                 # Find best optimal split
                 best_leaf_values = self.find_best_optimal_split(g, h, num_partitions)
@@ -350,125 +663,57 @@ class OptimalSplitGradientBoostingClassifier(object):
         self.N = self.N_all
         
         best_leaf_values_all = np.zeros((self.N, 1))
-        if self.row_mask:
+        if self.row_mask is not None:
             best_leaf_values_all[self.row_mask,:] = best_leaf_values
         best_leaf_values = best_leaf_values_all
         
         # Set leaf_value, return leaf values used to generate
         self.set_next_leaf_value(best_leaf_values)
 
-        # Calculate optimal_split_tree
-        # XXX
-        # impliedSolverKwargs = dict(max_depth=int(np.log2(num_partitions)))
-        impliedSolverKwargs = dict(max_depth=None)        
-        optimal_split_tree = self.imply_tree(best_leaf_values, **impliedSolverKwargs)
+        # The learner of the best candidate, fitted on the sampled rows; the
+        # rows left out are not refitted to zero leaf values
+        optimal_split_tree = self._best_split_tree
 
         # Set implied_tree
         self.set_next_classifier(optimal_split_tree)
 
         # Set current marginal prediction
-        self.curr_predictions[self.curr_classifier] = theano.function([],
-                                                                 optimal_split_tree.predict(self.X))()
+        self.add_learner_prediction(optimal_split_tree)
 
-        self.row_mask = list(range(self.N))
-        self.col_mask = list(range(self.num_features))
+        self.row_mask = np.arange(self.N)
+        self.col_mask = np.arange(self.num_features)
 
         self.curr_classifier += 1
 
     def generate_coefficients(self, row_mask=None, constantTerm=False):
-
-        if (self.use_closed_form_differentials):
-            if len(self.col_mask) == 0:
-                # If no column mask, use cached predictions and restrict by row
-                # depending on row mask
-                g_f = self.grad_exp_loss_without_regularization(self.predict())
-                h_f = self.hess_exp_loss_without_regularization(self.predict())
-            else:
-                # If column mask, cannot rely on cached predictions
-                g_f = self.grad_exp_loss_without_regularization(self.predict_from_input(self.X.get_value()))
-                h_f = self.hess_exp_loss_without_regularization(self.predict_from_input(self.X.get_value()))
-            
-            g = theano.function([], g_f)()[0]
-            h = theano.function([], h_f)()[0]
-            c = None
-            if constantTerm and not self.solver_type == 'linear_hessian':
-                c = theano.function([], self._mse_coordinatewise(self.predict()))().squeeze()
-
-            return (g, h, c)        
-
+        ''' Diagonal gradient and hessian of the loss at the current
+            predictions, from boosting_losses. The returned arrays are
+            buffers reused by the next call.
+        '''
+        y = self.y.get_value(borrow=True)
+        # Differentials of the regularized loss, as the autodiff path had,
+        # add gamma to h
+        h_offset = 0. if self.use_closed_form_differentials else self.gamma
+        size = self._chunk_size(y.shape[0], 32)
+        if self._pool is not None:
+            # Over row shards of the shared y, predictions in the pool
+            g, h = self._pool.grad_hess(self.loss_function, rows=self.row_mask, h_offset=h_offset, shard_size=size)
         else:
-            x = T.dvector('x')
-            leaf_values = self.leaf_values.get_value()[-1+self.curr_classifier,:]
-            if row_mask:
-                leaf_values = leaf_values[row_mask,:]
-            loss = self.loss(T.shape_padaxis(x, 1), len(np.unique(leaf_values)), leaf_values)
-
-            grads = T.grad(loss, x)
-            hess = T.hessian(loss, x)
-            
-            G = theano.function([x], grads)
-            H = theano.function([x], hess)
-            y_hat0 = theano.function([], self.predict())().squeeze()
-            g = G(y_hat0)
-            h = np.diag(H(y_hat0))
-            h = h + np.array([self.gamma]*h.shape[0])
-            
-            c = None
-            if constantTerm and not self.solver_type == 'linear_hessian':
-                c = theano.function([], self._mse_coordinatewise(self.predict()))().squeeze()
-            return (g, h, c)
+            # Cached predictions, restricted by row depending on row mask
+            y_hat = self._predict_value().ravel()
+            g, h = self._differential_buffers(y.shape[0])
+            for start in range(0, y.shape[0], size):
+                rows = slice(start, start+size)
+                self.loss_function.grad_hess(y_hat[rows], y[rows], g[rows], h[rows])
+            if h_offset:
+                np.add(h, h_offset, out=h)
+
+        c = None
+        if constantTerm and not self.solver_type == 'linear_hessian':
+            c = boosting_losses.get_loss('mse').coordinatewise(self._predict_value().ravel(), y)
+        return (g, h, c)
 
         
-    def loss(self, y_hat, num_partitions, leaf_values):
-        return self.loss_without_regularization(y_hat) + self.regularization_loss(num_partitions, leaf_values)
-
-    def loss_without_regularization(self, y_hat):
-        ''' Dependent on loss function '''
-        # return self.mse_loss_without_regularization(y_hat)
-        return self.exp_loss_without_regularization(y_hat)
-
-    def regularization_loss(self, num_partitions, leaf_values):
-        ''' Independent of loss function '''
-        size_reg = self.gamma * num_partitions
-        coeff_reg = 0.5 * self.eta * T.sum(T.extra_ops.Unique(False,False,False)(leaf_values)**2)
-        return size_reg + coeff_reg
-
-    def mse_loss_without_regularization(self, y_hat):
-        return self._mse(y_hat)
-
-    def exp_loss_without_regularization(self, y_hat):
-        return T.sum(T.exp(-1(2*y_hat.T-1)*(2*self.y-1)))
-
-    def grad_exp_loss_without_regularization(self, y_hat):
-        return -2*(2*self.y-1)*T.exp(-(2*y_hat.T-1)*(2*self.y-1))
-
-    def hess_exp_loss_without_regularization(self, y_hat):
-        return 4*(2*self.y-1)*(2*self.y-1)*T.exp(-(2*y_hat.T-1)*(2*self.y-1))
-    
-    def exp_loss_without_regularization(self, y_hat):
-        # return T.sum(T.exp(-y_hat * T.shape_padaxis(self.y, 1)))
-        return T.sum(T.exp(-(2*y_hat.T-1)*(2*self.y-1)).T)
-
-    def cosh_loss_without_regularization(self, y_hat):
-        return T.sum(T.log(T.cosh(y_hat - T.shape_padaxis(self.y, 1))))
-
-    def hinge_loss_without_regularization(self, y_hat):
-        return T.sum(T.abs_(y_hat - T.shape_padaxis(self.y, 1)))
-
-    def logistic_loss_without_regularization(self, y_hat):
-        return T.sum(T.log(1 + T.exp(-y_hat * T.shape_padaxis(self.y, 1))))
-
-    def cross_entropy(self, y_hat):
-        y0 = T.shape_padaxis(self.y, 1)
-        # return T.sum(-(y0 * T.log(y_hat) + (1-y0)*T.log(1-y_hat)))
-        return T.sum(T.nnet.binary_crossentropy(y_hat, y0))
-    
-    def _mse(self, y_hat):
-        return T.sqrt(T.sum(self._mse_coordinatewise(y_hat)))
-
-    def _mse_coordinatewise(self, y_hat):
-        return (T.shape_padaxis(self.y, 1) - y_hat)**2
-
     def quadratic_solution_scalar(self, g, h, c):
         a,b = 0.5*h, g
         s1 = -b
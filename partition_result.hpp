@@ -0,0 +1,38 @@
+#ifndef __PARTITION_RESULT_HPP__
+#define __PARTITION_RESULT_HPP__
+
+#include <vector>
+
+//
+// Compact form of an optimal partition, filled in during backtracking.
+// labels[i] is the subset index of element i, in the order of the
+// subsets returned by get_optimal_subsets_extern(). breakpoints are the
+// sorted end positions of the subsets in priority order. a_sums, b_sums
+// and scores are per subset.
+//
+
+struct PartitionResult {
+  std::vector<int> labels;
+  std::vector<int> breakpoints;
+  std::vector<float> a_sums;
+  std::vector<float> b_sums;
+  std::vector<float> scores;
+  float score;
+};
+
+//
+// Results of a batch of independent problems laid out CSR style: the
+// elements of problem k are [offsets[k], offsets[k+1]) in the flat
+// inputs, and labels uses the same layout. a_sums and b_sums are
+// num_problems x T, row major, scores has one entry per problem.
+//
+
+struct BatchPartitionResult {
+  std::vector<int> offsets;
+  std::vector<int> labels;
+  std::vector<float> a_sums;
+  std::vector<float> b_sums;
+  std::vector<float> scores;
+};
+
+#endif
@@ -12,6 +12,9 @@ import utils
 from optimalsplitboost import OptimalSplitGradientBoostingClassifier
 
 TEST_SIZE = 0.20
+# Held out of the training set to stop boosting once it stops improving
+VALIDATION_SIZE = 0.20
+EARLY_STOPPING_ROUNDS = 25
 FILENAME = './summary_final1.csv'
 
 ########################
@@ -51,12 +54,13 @@ for ind,dataset_name in enumerate(class_datasets):
     
     X,y = pmlb.fetch_data(dataset_name, return_X_y=True)
     X_train, X_test, y_train, y_test = train_test_split(X,y, test_size=TEST_SIZE)
+    X_fit, X_val, y_fit, y_val = train_test_split(X_train, y_train, test_size=VALIDATION_SIZE)
 
     distiller = classifier.classifierFactory(sklearn.tree.DecisionTreeClassifier)
     num_steps = 250
     part_ratio = .7
     min_partition_size= 1
-    max_partition_size = int(part_ratio*X_train.shape[0])
+    max_partition_size = int(part_ratio*X_fit.shape[0])
     row_sample_ratio = 0.65
     col_sample_ratio = 1.0
     gamma = 0.
@@ -79,9 +83,11 @@ for ind,dataset_name in enumerate(class_datasets):
                   'use_closed_form_differentials': True
                   }
 
-    clf = OptimalSplitGradientBoostingClassifier( X_train, y_train, **clfKwargs)
+    clf = OptimalSplitGradientBoostingClassifier( X_fit, y_fit, **clfKwargs)
 
-    clf.fit(num_steps)
+    clf.fit(num_steps,
+            validation_data=(X_val, y_val),
+            early_stopping_rounds=EARLY_STOPPING_ROUNDS)
 
     stats = utils.oos_summary(clf, X_train, y_train, X_test, y_test,
                               catboost_iterations=num_steps,
@@ -90,7 +96,8 @@ for ind,dataset_name in enumerate(class_datasets):
                               catboost_loss_function='Logloss',
                               catboost_verbose=False)
 
-    all_stats = [dataset_name, row_sample_ratio, col_sample_ratio, part_ratio, learning_rate, num_steps,
+    # Steps of the model evaluated, after early stopping
+    all_stats = [dataset_name, row_sample_ratio, col_sample_ratio, part_ratio, learning_rate, clf.curr_classifier,
                  X_train.shape[0], X_train.shape[1], len(np.unique(y_train)),
                  2.0*((sum(y_train==0)/len(y_train) - .5)**2 + (sum(y_train==1)/len(y_train) - .5)**2),
                  stats[0], stats[1], stats[2], stats[3]]
@@ -1,9 +1,17 @@
 /* File : proto.i */
-%module proto
+%module(threads="1") proto
+
+// Thread support is off by default and only switched on around the solver
+// entry points below, which release the GIL for the duration of the C++
+// call. Anything touching Python objects (the container proxies, the
+// PartitionResult buffer accessors) keeps the GIL.
+%nothread;
 
 %{
 #include <boost/multiprecision/gmp.hpp>
 #include <boost/multiprecision/cpp_dec_float.hpp>
+#include "partition_result.hpp"
+#include "cancellation.hpp"
 #include "graph.hpp"
 #include "python_graph.hpp"
 #include "DP.hpp"
@@ -12,6 +20,62 @@
 #include "python_ltsssolver.hpp"
 #include "DP_multiprec.hpp"
 #include "python_dp_multisolver.hpp"
+#include "threadpool_stats.hpp"
+#include "python_threadpool.hpp"
+
+#include <type_traits>
+
+// Fill a std::vector<T> from any C-contiguous float32/float64/int32/int64
+// object exporting the buffer protocol (NumPy arrays, array.array,
+// memoryview), without going through the per-element sequence
+// conversion. Floating point buffers are only read into floating point
+// vectors, never truncated into integer ones. Returns false if the
+// object is not such a buffer, in which case the caller falls back to
+// the generic conversion.
+template<typename S, typename T>
+static void copy_buffer(const Py_buffer& view, std::vector<T>& out) {
+  const S *p = static_cast<const S*>(view.buf);
+  out.assign(p, p + view.len/sizeof(S));
+}
+
+template<typename T>
+static bool buffer_to_vector(PyObject *obj, std::vector<T>& out) {
+  if (!PyObject_CheckBuffer(obj))
+    return false;
+
+  Py_buffer view;
+  if (PyObject_GetBuffer(obj, &view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT) != 0) {
+    PyErr_Clear();
+    return false;
+  }
+
+  // strip byte-order/alignment prefix, only native order is accepted
+  const char *fmt = view.format ? view.format : "B";
+  if ((*fmt == '@') || (*fmt == '=') || (*fmt == '<'))
+    ++fmt;
+
+  bool ok = (fmt[0] != '\0') && (fmt[1] == '\0');
+  if (ok) {
+    switch (fmt[0]) {
+    case 'f': ok = std::is_floating_point<T>::value && (view.itemsize == sizeof(float));  if (ok) copy_buffer<float>(view, out);  break;
+    case 'd': ok = std::is_floating_point<T>::value && (view.itemsize == sizeof(double)); if (ok) copy_buffer<double>(view, out); break;
+    case 'i': ok = (view.itemsize == sizeof(int));       if (ok) copy_buffer<int>(view, out);       break;
+    case 'l': ok = (view.itemsize == sizeof(long));      if (ok) copy_buffer<long>(view, out);      break;
+    case 'q': ok = (view.itemsize == sizeof(long long)); if (ok) copy_buffer<long long>(view, out); break;
+    default:  ok = false;
+    }
+  }
+
+  PyBuffer_Release(&view);
+  return ok;
+}
+
+// Contents of a vector as a bytearray, wrapped on the python side with
+// np.frombuffer
+template<typename T>
+static PyObject* vector_to_bytearray(const std::vector<T>& v) {
+  return PyByteArray_FromStringAndSize(reinterpret_cast<const char*>(v.data()), sizeof(T)*v.size());
+}
 %}
 
 %include "std_vector.i"
@@ -20,6 +84,8 @@
 namespace std {
 %template(IArray) vector<int>;
 %template(FArray) vector<float>;
+%template(DArray) vector<double>;
+%template(LLArray) vector<long long>;
 %template(IArrayArray) vector<vector<int> >;
 %template(IArrayFPair) pair<vector<int>, float>;
 %template(IArrayArrayFPair) pair<vector<vector<int> >, float>;
@@ -28,8 +94,110 @@ namespace std {
 %template(SWGMPPair) pair<vector<vector<int> >, boost::multiprecision::cpp_dec_float_100>;
 }
 
+// Numeric buffers are read directly, anything else (lists, FArray,
+// IArray) goes through the usual std_vector.i conversion
+%define %buffer_vector_typemaps(T, PRECEDENCE)
+%typemap(in) std::vector<T> {
+  if (!buffer_to_vector($input, $1)) {
+    std::vector<T> *ptr = (std::vector<T> *)0;
+    int res = swig::asptr($input, &ptr);
+    if (!SWIG_IsOK(res) || !ptr) {
+      SWIG_exception_fail(SWIG_ArgError((ptr ? res : SWIG_TypeError)), "in method '" "$symname" "', argument " "$argnum"" of type '" "$type""'");
+    }
+    $1 = *ptr;
+    if (SWIG_IsNewObj(res)) delete ptr;
+  }
+}
+%typemap(typecheck, precedence=PRECEDENCE) std::vector<T> {
+  $1 = (PyObject_CheckBuffer($input) || PySequence_Check($input)) ? 1 : 0;
+}
+%enddef
+
+%buffer_vector_typemaps(float, SWIG_TYPECHECK_FLOAT_ARRAY)
+%buffer_vector_typemaps(int, SWIG_TYPECHECK_INT32_ARRAY)
+
+%include "partition_result.hpp"
+%include "threadpool_stats.hpp"
+
+namespace std {
+%template(PartitionResultArray) vector<PartitionResult>;
+}
+
+%extend PartitionResult {
+  PyObject* labels_buffer() const { return vector_to_bytearray($self->labels); }
+  PyObject* breakpoints_buffer() const { return vector_to_bytearray($self->breakpoints); }
+  PyObject* a_sums_buffer() const { return vector_to_bytearray($self->a_sums); }
+  PyObject* b_sums_buffer() const { return vector_to_bytearray($self->b_sums); }
+  PyObject* scores_buffer() const { return vector_to_bytearray($self->scores); }
+}
+
+%extend BatchPartitionResult {
+  PyObject* offsets_buffer() const { return vector_to_bytearray($self->offsets); }
+  PyObject* labels_buffer() const { return vector_to_bytearray($self->labels); }
+  PyObject* a_sums_buffer() const { return vector_to_bytearray($self->a_sums); }
+  PyObject* b_sums_buffer() const { return vector_to_bytearray($self->b_sums); }
+  PyObject* scores_buffer() const { return vector_to_bytearray($self->scores); }
+}
+
+// Raised for SolveCancelled: proto.SolveCancelled, a RuntimeError, and
+// for an expired deadline proto.SolveTimeout, also a TimeoutError
+%{
+static PyObject* SolveCancelledError = NULL;
+static PyObject* SolveTimeoutError = NULL;
+%}
+
+%init %{
+  SolveCancelledError = PyErr_NewException("proto.SolveCancelled", PyExc_RuntimeError, NULL);
+  SolveTimeoutError = PyErr_NewException("proto.SolveTimeout",
+					 Py_BuildValue("(OO)", SolveCancelledError, PyExc_TimeoutError),
+					 NULL);
+  Py_INCREF(SolveCancelledError);
+  PyModule_AddObject(m, "SolveCancelled", SolveCancelledError);
+  Py_INCREF(SolveTimeoutError);
+  PyModule_AddObject(m, "SolveTimeout", SolveTimeoutError);
+%}
+
+// The proxy picks the types up through these rather than naming the
+// low-level module, whose name depends on the build
+%inline %{
+static PyObject* _solve_cancelled_type() { Py_INCREF(SolveCancelledError); return SolveCancelledError; }
+static PyObject* _solve_timeout_type() { Py_INCREF(SolveTimeoutError); return SolveTimeoutError; }
+%}
+
+%pythoncode %{
+SolveCancelled = _solve_cancelled_type()
+SolveTimeout = _solve_timeout_type()
+%}
+
+// C++ exceptions, including those rethrown from a pool task, surface as
+// RuntimeError rather than terminating the interpreter
+%exception {
+  try {
+    $action
+  }
+  catch (const SolveCancelled& e) {
+    PyErr_SetString(e.timed_out() ? SolveTimeoutError : SolveCancelledError, e.what());
+    SWIG_fail;
+  }
+  catch (const std::exception& e) {
+    SWIG_exception(SWIG_RuntimeError, e.what());
+  }
+}
+
+// Polled by the solvers without the GIL; cancel() and set_deadline() may be
+// called from any python thread
+%ignore SolveCancelled;
+%ignore solve_interrupted;
+%ignore CancellationToken::check;
+%include "cancellation.hpp"
+
+%newobject submit_optimize__DP;
+
+%thread;
 %include "python_graph.hpp"
 %include "python_dpsolver.hpp"
 %include "python_ltsssolver.hpp"
 %include "python_dp_multisolver.hpp"
+%include "python_threadpool.hpp"
+%nothread;
 
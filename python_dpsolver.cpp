@@ -1,5 +1,8 @@
 #include "python_dpsolver.hpp"
 #include <thread>
+#include <algorithm>
+#include <chrono>
+#include <condition_variable>
 
 using namespace Objectives;
 
@@ -28,8 +31,8 @@ std::vector<std::vector<int>> find_optimal_partition__DP(int n,
 							 bool use_rational_optimization) {
   auto dp = DPSolver(n, 
 		     T, 
-		     a, 
-		     b, 
+		     std::move(a), 
+		     std::move(b), 
 		     static_cast<objective_fn>(parametric_dist), 
 		     risk_partitioning_objective, 
 		     use_rational_optimization);
@@ -45,8 +48,8 @@ float find_optimal_score__DP(int n,
 			     bool use_rational_optimization) {
   auto dp = DPSolver(n, 
 		     T, 
-		     a, 
-		     b, 
+		     std::move(a), 
+		     std::move(b), 
 		     static_cast<objective_fn>(parametric_dist), 
 		     risk_partitioning_objective, 
 		     use_rational_optimization);
@@ -59,20 +62,113 @@ std::pair<std::vector<std::vector<int>>, float> optimize_one__DP(int n,
 			std::vector<float> b,
 			int parametric_dist,
 			bool risk_partitioning_objective,
-			bool use_rational_optimization) {
+			bool use_rational_optimization,
+			const CancellationToken* token) {
   auto dp = DPSolver(n, 
 		     T, 
-		     a, 
-		     b, 
+		     std::move(a), 
+		     std::move(b), 
 		     static_cast<objective_fn>(parametric_dist), 
 		     risk_partitioning_objective, 
-		     use_rational_optimization);
+		     use_rational_optimization,
+		     token);
   std::vector<std::vector<int>> subsets = dp.get_optimal_subsets_extern();
   float score = dp.get_optimal_score_extern();
   
   return std::make_pair(subsets, score);
 }
 
+PartitionResult optimize_one_compact__DP(int n,
+					 int T,
+					 std::vector<float> a,
+					 std::vector<float> b,
+					 int parametric_dist,
+					 bool risk_partitioning_objective,
+					 bool use_rational_optimization,
+					 const CancellationToken* token) {
+  auto dp = DPSolver(n, 
+		     T, 
+		     std::move(a), 
+		     std::move(b), 
+		     static_cast<objective_fn>(parametric_dist), 
+		     risk_partitioning_objective, 
+		     use_rational_optimization,
+		     token);
+  return dp.get_partition_result_extern();
+}
+
+std::vector<PartitionResult> optimize_candidates_compact__DP(int n,
+							     std::vector<int> Ts,
+							     std::vector<float> a,
+							     std::vector<float> b,
+							     int parametric_dist,
+							     bool risk_partitioning_objective,
+							     bool use_rational_optimization,
+							     const CancellationToken* token) {
+  if (Ts.empty())
+    throw std::invalid_argument("optimize_candidates_compact__DP: no candidate number of subsets");
+  auto dp = DPSolver(n, 
+		     *std::max_element(Ts.begin(), Ts.end()), 
+		     std::move(a), 
+		     std::move(b), 
+		     static_cast<objective_fn>(parametric_dist), 
+		     risk_partitioning_objective, 
+		     use_rational_optimization,
+		     token);
+  std::vector<PartitionResult> results;
+  results.reserve(Ts.size());
+  for (int t : Ts)
+    results.push_back(dp.get_partition_result_extern(t));
+  return results;
+}
+
+BatchPartitionResult optimize_batch__DP(int T,
+					 std::vector<float> a,
+					 std::vector<float> b,
+					 std::vector<int> offsets,
+					 int parametric_dist,
+					 bool risk_partitioning_objective,
+					 bool use_rational_optimization) {
+  if (a.size() != b.size())
+    throw std::invalid_argument("optimize_batch__DP: a and b differ in length");
+  if (offsets.empty() || (offsets.front() != 0) || (offsets.back() != static_cast<int>(a.size())))
+    throw std::invalid_argument("optimize_batch__DP: offsets must run from 0 to len(a)");
+  for (std::size_t k=1; k<offsets.size(); ++k) {
+    if ((offsets[k] - offsets[k-1]) < T)
+      throw std::invalid_argument("optimize_batch__DP: every problem needs at least T elements");
+  }
+
+  const int num_problems = static_cast<int>(offsets.size()) - 1;
+
+  BatchPartitionResult r;
+  r.labels.resize(a.size());
+  r.a_sums.resize(num_problems*T);
+  r.b_sums.resize(num_problems*T);
+  r.scores.resize(num_problems);
+
+  // Each problem writes to its own slice of r, so no synchronization is
+  // needed
+  DefaultThreadPool::parallel_for(0, num_problems, 1, [&](int k) {
+      const int first = offsets[k], last = offsets[k+1];
+      auto dp = DPSolver(last - first,
+			 T,
+			 std::vector<float>(a.begin()+first, a.begin()+last),
+			 std::vector<float>(b.begin()+first, b.begin()+last),
+			 static_cast<objective_fn>(parametric_dist),
+			 risk_partitioning_objective,
+			 use_rational_optimization);
+      PartitionResult p = dp.get_partition_result_extern();
+      std::copy(p.labels.begin(), p.labels.end(), r.labels.begin()+first);
+      const std::size_t num_subsets = std::min(p.a_sums.size(), static_cast<std::size_t>(T));
+      std::copy_n(p.a_sums.begin(), num_subsets, r.a_sums.begin()+k*T);
+      std::copy_n(p.b_sums.begin(), num_subsets, r.b_sums.begin()+k*T);
+      r.scores[k] = p.score;
+    });
+
+  r.offsets = std::move(offsets);
+  return r;
+}
+
 std::pair<std::vector<std::vector<int>>, float> sweep_best__DP(int n,
 							       int T,
 							       std::vector<float> a,
@@ -110,44 +206,28 @@ std::vector<std::pair<std::vector<std::vector<int>>, float>> sweep_parallel__DP(
 			  std::vector<float> b,
 			  int parametric_dist,
 			  bool risk_partitioning_objective,
-										bool use_rational_optimization) {
-  
-  ThreadsafeQueue<std::pair<std::vector<std::vector<int>>, float>> results_queue;
+										bool use_rational_optimization,
+										const CancellationToken* token) {
   
-  auto task = [&results_queue](int n, 
-			       int i, 
-			       std::vector<float> a, 
-			       std::vector<float> b, 
-			       int parametric_dist,
-			       bool risk_partitioning_objective,
-			       bool use_rational_optimization) {
-    auto dp = DPSolver(n, 
-		       i, 
-		       a, 
-		       b, 
-		       static_cast<objective_fn>(parametric_dist), 
-		       risk_partitioning_objective, 
-		       use_rational_optimization);
-    results_queue.push(std::make_pair(dp.get_optimal_subsets_extern(),
-				      dp.get_optimal_score_extern()));
-  };
+  // One entry per number of subsets, in the order T, T-1, ..., 2
+  std::vector<std::pair<std::vector<std::vector<int>>, float>> results(std::max(T-1, 0));
 
-  std::vector<ThreadPool::TaskFuture<void>> v;
+  // Solves not started when the token expires are skipped and left empty
+  DefaultThreadPool::parallel_for(0, static_cast<int>(results.size()), 1, [&](int k) {
+      auto dp = DPSolver(n, 
+			 T-k, 
+			 a, 
+			 b, 
+			 static_cast<objective_fn>(parametric_dist), 
+			 risk_partitioning_objective, 
+			 use_rational_optimization,
+			 token);
+      results[k] = std::make_pair(dp.get_optimal_subsets_extern(),
+				  dp.get_optimal_score_extern());
+    }, token);
 
-  for (int i=T; i>1; --i) {
-    v.push_back(DefaultThreadPool::submitJob(task, n, i, a, b, parametric_dist, risk_partitioning_objective, use_rational_optimization));
-  }	       
-  for (auto& item : v) 
-    item.get();
-
-  std::pair<std::vector<std::vector<int>>, float> result;
-  std::vector<std::pair<std::vector<std::vector<int>>, float>> results;
-  while (!results_queue.empty()) {
-    bool valid = results_queue.waitPop(result);
-    if (valid) {
-      results.push_back(result);
-    }
-  }
+  // Throws unless partial results were asked for
+  solve_interrupted(token);
 
   return results;
 
@@ -181,3 +261,172 @@ std::vector<std::pair<std::vector<std::vector<int>>, float>> sweep__DP(int n,
   return r;
   
 }
+
+namespace {
+  std::mutex completion_mutex;
+  std::condition_variable completion_cv;
+  unsigned long long completion_count = 0;
+
+  // Marks a handle's task finished, however it exits
+  struct CompletionGuard {
+    std::shared_ptr<std::atomic<bool>> done;
+    ~CompletionGuard() {
+      done->store(true);
+      {
+	std::lock_guard<std::mutex> lock(completion_mutex);
+	++completion_count;
+      }
+      completion_cv.notify_all();
+    }
+  };
+}
+
+unsigned long long
+wait_for_completion__DP(unsigned long long seen, double timeout) {
+  std::unique_lock<std::mutex> lock(completion_mutex);
+  completion_cv.wait_for(lock,
+			 std::chrono::duration<double>(timeout),
+			 [seen]{ return completion_count != seen; });
+  return completion_count;
+}
+
+std::shared_ptr<CancellationToken>
+DPSolverHandle::deadline_token_(double timeout) {
+  auto token = std::make_shared<CancellationToken>();
+  token->set_deadline(timeout);
+  return token;
+}
+
+ThreadPool::TaskFuture<DPSolverHandle::result_type>
+DPSolverHandle::submit_(std::shared_ptr<std::atomic<int>> status,
+			std::shared_ptr<std::atomic<bool>> done,
+			std::shared_ptr<CancellationToken> token,
+			int n,
+			int T,
+			std::vector<float> a,
+			std::vector<float> b,
+			int parametric_dist,
+			bool risk_partitioning_objective,
+			bool use_rational_optimization) {
+
+  auto task = [status, done, token](int n, 
+		       int T, 
+		       std::vector<float> a, 
+		       std::vector<float> b, 
+		       int parametric_dist,
+		       bool risk_partitioning_objective,
+		       bool use_rational_optimization) {
+    CompletionGuard guard{done};
+    // Skip if cancelled while queued
+    int expected = queued;
+    if (!status->compare_exchange_strong(expected, started)) {
+      return result_type{};
+    }
+    auto dp = DPSolver(n, 
+		       T, 
+		       std::move(a), 
+		       std::move(b), 
+		       static_cast<objective_fn>(parametric_dist), 
+		       risk_partitioning_objective, 
+		       use_rational_optimization,
+		       token.get());
+    return std::make_pair(dp.get_optimal_subsets_extern(), dp.get_optimal_score_extern());
+  };
+
+  return DefaultThreadPool::submitJob(task, 
+				      n, 
+				      T, 
+				      std::move(a), 
+				      std::move(b), 
+				      parametric_dist, 
+				      risk_partitioning_objective, 
+				      use_rational_optimization);
+}
+
+DPSolverHandle::DPSolverHandle(int n,
+			       int T,
+			       std::vector<float> a,
+			       std::vector<float> b,
+			       int parametric_dist,
+			       bool risk_partitioning_objective,
+			       bool use_rational_optimization,
+			       double timeout) :
+  status_{std::make_shared<std::atomic<int>>(queued)},
+  done_{std::make_shared<std::atomic<bool>>(false)},
+  token_{deadline_token_(timeout)},
+  future_{submit_(status_, 
+		  done_,
+		  token_,
+		  n, 
+		  T, 
+		  std::move(a), 
+		  std::move(b), 
+		  parametric_dist, 
+		  risk_partitioning_objective, 
+		  use_rational_optimization)},
+  has_result_{false}
+{}
+
+bool
+DPSolverHandle::ready() const {
+  return done_->load();
+}
+
+bool
+DPSolverHandle::cancel() {
+  // A queued solve is skipped, a running one stops at its next DP layer
+  int expected = queued;
+  if (status_->compare_exchange_strong(expected, cancelled_) || (expected == cancelled_))
+    return true;
+  if (ready())
+    return false;
+  token_->cancel();
+  return true;
+}
+
+bool
+DPSolverHandle::cancelled() const {
+  return (*status_ == cancelled_) || token_->cancelled();
+}
+
+bool
+DPSolverHandle::running() const {
+  return (*status_ == started) && !ready();
+}
+
+DPSolverHandle::result_type
+DPSolverHandle::get() {
+  // Blocks until the task has been dequeued; a task cancelled while queued
+  // yields an empty result, one cancelled while running throws
+  // SolveCancelled. The outcome is kept, later calls return or rethrow it
+  std::lock_guard<std::mutex> lock(get_mutex_);
+  if (!has_result_) {
+    try {
+      result_ = future_.get();
+    } catch (...) {
+      error_ = std::current_exception();
+    }
+    has_result_ = true;
+  }
+  if (error_)
+    std::rethrow_exception(error_);
+  return result_;
+}
+
+DPSolverHandle* submit_optimize__DP(int n,
+				    int T,
+				    std::vector<float> a,
+				    std::vector<float> b,
+				    int parametric_dist,
+				    bool risk_partitioning_objective,
+				    bool use_rational_optimization,
+				    double timeout) {
+  return new DPSolverHandle(n, 
+			    T, 
+			    std::move(a), 
+			    std::move(b), 
+			    parametric_dist, 
+			    risk_partitioning_objective, 
+			    use_rational_optimization,
+			    timeout);
+}
@@ -3,6 +3,7 @@
 
 #include "score.hpp"
 #include "DP.hpp"
+#include "cancellation.hpp"
 #include "threadpool.hpp"
 #include "threadsafequeue.hpp"
 
@@ -10,6 +11,11 @@
 #include <utility>
 #include <limits>
 #include <type_traits>
+#include <atomic>
+#include <memory>
+#include <mutex>
+#include <stdexcept>
+#include <exception>
 
 std::vector<std::vector<int>> find_optimal_partition__DP(int n,
 							 int T,
@@ -28,13 +34,43 @@ float find_optimal_score__DP(int n,
 			     bool risk_partitioning_objective,
 			     bool use_rational_optimization);
 
+// The optional token is polled once per DP layer, see cancellation.hpp
 std::pair<std::vector<std::vector<int>>, float> optimize_one__DP(int n,
 								 int T,
 								 std::vector<float> a,
 								 std::vector<float> b,
 								 int parametric_dist,
 								 bool risk_partitioning_objective,
-								 bool use_rational_optimization);
+								 bool use_rational_optimization,
+								 const CancellationToken* token=nullptr);
+
+PartitionResult optimize_one_compact__DP(int n,
+					 int T,
+					 std::vector<float> a,
+					 std::vector<float> b,
+					 int parametric_dist,
+					 bool risk_partitioning_objective,
+					 bool use_rational_optimization,
+					 const CancellationToken* token=nullptr);
+
+// Optimal partitions into each of Ts subsets, in the order given, all
+// backtracked from the table of a single solve with T = max(Ts)
+std::vector<PartitionResult> optimize_candidates_compact__DP(int n,
+							     std::vector<int> Ts,
+							     std::vector<float> a,
+							     std::vector<float> b,
+							     int parametric_dist,
+							     bool risk_partitioning_objective,
+							     bool use_rational_optimization,
+							     const CancellationToken* token=nullptr);
+
+BatchPartitionResult optimize_batch__DP(int T,
+					 std::vector<float> a,
+					 std::vector<float> b,
+					 std::vector<int> offsets,
+					 int parametric_dist,
+					 bool risk_partitioning_objective,
+					 bool use_rational_optimization);
 
 std::pair<std::vector<std::vector<int>>, float> sweep_best__DP(int n,
 							       int T,
@@ -50,7 +86,8 @@ std::vector<std::pair<std::vector<std::vector<int>>, float>> sweep_parallel__DP(
 										std::vector<float> b,
 										int parametric_dist,
 										bool risk_partitioning_objective,
-										bool use_rational_optimization);
+										bool use_rational_optimization,
+										const CancellationToken* token=nullptr);
 
 std::vector<std::pair<std::vector<std::vector<int>>, float>> sweep__DP(int n,
 								       int T,
@@ -59,4 +96,69 @@ std::vector<std::pair<std::vector<std::vector<int>>, float>> sweep__DP(int n,
 								       int parametric_dist,
 								       bool risk_partitioning_objective,
 								       bool use_rational_optimization);
+// Handle on a single DP solve submitted to DefaultThreadPool. Tasks that
+// have not started yet can be cancelled; they are then skipped when a
+// worker dequeues them. Cancelling a running solve, or exceeding the
+// timeout (seconds from submission, 0 for none), makes it stop at the
+// next DP layer and get() throw SolveCancelled. ready(), cancel() and
+// get() may be called concurrently: only get() touches the future, the
+// others read the task state from atomics.
+class DPSolverHandle {
+public:
+  using result_type = std::pair<std::vector<std::vector<int>>, float>;
+
+  DPSolverHandle(int n,
+		 int T,
+		 std::vector<float> a,
+		 std::vector<float> b,
+		 int parametric_dist,
+		 bool risk_partitioning_objective,
+		 bool use_rational_optimization,
+		 double timeout=0.);
+
+  bool ready() const;
+  bool cancel();
+  bool cancelled() const;
+  bool running() const;
+  result_type get();
+
+private:
+  enum status { queued = 0, started = 1, cancelled_ = 2 };
+
+  std::shared_ptr<std::atomic<int>> status_;
+  std::shared_ptr<std::atomic<bool>> done_;
+  std::shared_ptr<CancellationToken> token_;
+  ThreadPool::TaskFuture<result_type> future_;
+  std::mutex get_mutex_;
+  bool has_result_;
+  result_type result_;
+  std::exception_ptr error_;
+
+  static std::shared_ptr<CancellationToken> deadline_token_(double);
+  static ThreadPool::TaskFuture<result_type> submit_(std::shared_ptr<std::atomic<int>>,
+						     std::shared_ptr<std::atomic<bool>>,
+						     std::shared_ptr<CancellationToken>,
+						     int,
+						     int,
+						     std::vector<float>,
+						     std::vector<float>,
+						     int,
+						     bool,
+						     bool);
+};
+
+DPSolverHandle* submit_optimize__DP(int n,
+				    int T,
+				    std::vector<float> a,
+				    std::vector<float> b,
+				    int parametric_dist,
+				    bool risk_partitioning_objective,
+				    bool use_rational_optimization,
+				    double timeout=0.);
+
+// Number of submit_optimize__DP tasks finished so far. Blocks until it
+// differs from seen, or for at most timeout seconds, so that a single
+// waiter can follow any number of handles.
+unsigned long long wait_for_completion__DP(unsigned long long seen, double timeout);
+
 #endif
@@ -6,7 +6,7 @@ std::vector<std::vector<int>> find_optimal_partition__PG(int n,
 			       std::vector<float> a, 
 			       std::vector<float> b) {
   
-  auto pg = PartitionGraph(n, T, a, b);
+  auto pg = PartitionGraph(n, T, std::move(a), std::move(b));
   return pg.get_optimal_subsets_extern();
   
 }
@@ -15,7 +15,7 @@ float find_optimal_weight__PG(int n,
 			  int T,
 			  std::vector<float> a,
 			  std::vector<float> b) {
-  auto pg = PartitionGraph(n, T, a, b);
+  auto pg = PartitionGraph(n, T, std::move(a), std::move(b));
   return pg.get_optimal_weight_extern();
 
 }
@@ -23,15 +23,25 @@ float find_optimal_weight__PG(int n,
 std::pair<std::vector<std::vector<int>>, float> optimize_one__PG(int n,
 								 int T,
 								 std::vector<float> a,
-								 std::vector<float> b) {
+								 std::vector<float> b,
+								 const CancellationToken* token) {
   
-  auto pg = PartitionGraph(n, T, a, b);
+  auto pg = PartitionGraph(n, T, std::move(a), std::move(b), token);
   std::vector<std::vector<int>> subsets = pg.get_optimal_subsets_extern();
   float weight = pg.get_optimal_weight_extern();
 
   return std::make_pair(subsets, weight);
 }
 
+PartitionResult optimize_one_compact__PG(int n,
+					 int T,
+					 std::vector<float> a,
+					 std::vector<float> b,
+					 const CancellationToken* token) {
+  auto pg = PartitionGraph(n, T, std::move(a), std::move(b), token);
+  return pg.get_partition_result_extern();
+}
+
 std::pair<std::vector<std::vector<int>>, float> sweep_best__PG(int n,
 		  int T,
 		  std::vector<float> a,
@@ -59,31 +69,20 @@ std::pair<std::vector<std::vector<int>>, float> sweep_best__PG(int n,
 std::vector<std::pair<std::vector<std::vector<int>>, float>> sweep_parallel__PG(int n,
 										int T,
 										std::vector<float> a,
-										std::vector<float> b) {
-  ThreadsafeQueue<std::pair<std::vector<std::vector<int>>, float>> results_queue;
-  
-  auto task = [&results_queue](int n, int i, std::vector<float> a, std::vector<float> b){
-    PartitionGraph pg{n, i, a, b};
-    results_queue.push(std::make_pair(pg.get_optimal_subsets_extern(),
-				      pg.get_optimal_weight_extern()));
-  };
+										std::vector<float> b,
+										const CancellationToken* token) {
+  // One entry per number of subsets, in the order T, T-1, ..., 2
+  std::vector<std::pair<std::vector<std::vector<int>>, float>> results(std::max(T-1, 0));
 
-  std::vector<ThreadPool::TaskFuture<void>> v;
-  
-  for (int i=T; i>1; --i) {
-    v.push_back(DefaultThreadPool::submitJob(task, n, i, a, b));
-  }	       
-  for (auto& item : v) 
-    item.get();
-
-  std::pair<std::vector<std::vector<int>>, float> result;
-  std::vector<std::pair<std::vector<std::vector<int>>, float>> results;
-  while (!results_queue.empty()) {
-    bool valid = results_queue.waitPop(result);
-    if (valid) {
-      results.push_back(result);
-    }
-  }
+  // Solves not started when the token expires are skipped and left empty
+  DefaultThreadPool::parallel_for(0, static_cast<int>(results.size()), 1, [&](int k) {
+      PartitionGraph pg{n, T-k, a, b, token};
+      results[k] = std::make_pair(pg.get_optimal_subsets_extern(),
+				  pg.get_optimal_weight_extern());
+    }, token);
+
+  // Throws unless partial results were asked for
+  solve_interrupted(token);
 
   return results;
 
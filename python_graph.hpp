@@ -2,6 +2,7 @@
 #define __PYTHON_GRAPH_HPP__
 
 #include "graph.hpp"
+#include "cancellation.hpp"
 #include "threadpool.hpp"
 #include "threadsafequeue.hpp"
 
@@ -19,10 +20,18 @@ float find_optimal_weight__PG(int n,
 			      std::vector<float> a,
 			      std::vector<float> b);
 
+// The optional token is polled once per graph layer, see cancellation.hpp
 std::pair<std::vector<std::vector<int> >, float> optimize_one__PG(int n,
 								  int T,
 								  std::vector<float> a,
-								  std::vector<float> b);
+								  std::vector<float> b,
+								  const CancellationToken* token=nullptr);
+
+PartitionResult optimize_one_compact__PG(int n,
+					 int T,
+					 std::vector<float> a,
+					 std::vector<float> b,
+					 const CancellationToken* token=nullptr);
 
 std::pair<std::vector<std::vector<int> >, float> sweep_best__PG(int n,
 								int T,
@@ -31,7 +40,8 @@ std::pair<std::vector<std::vector<int> >, float> sweep_best__PG(int n,
 std::vector<std::pair<std::vector<std::vector<int>>, float>> sweep_parallel__PG(int n,
 										int T,
 										std::vector<float> a,
-										std::vector<float> b);
+										std::vector<float> b,
+										const CancellationToken* token=nullptr);
 std::vector<std::pair<std::vector<std::vector<int>>, float>> sweep__PG(int n,
 								       int T,
 								       std::vector<float> a,
@@ -12,14 +12,14 @@ std::vector<int> find_optimal_partition__LTSS(int n,
 float find_optimal_score__LTSS(int n,
 			       std::vector<float> a,
 			       std::vector<float> b) {
-  auto ltss = LTSSSolver(n, a, b);
+  auto ltss = LTSSSolver(n, std::move(a), std::move(b));
   return ltss.get_optimal_score_extern();
 }
 
 std::pair<std::vector<int>, float> optimize_one__LTSS(int n,
 						      std::vector<float> a,
 						      std::vector<float> b) {
-  auto ltss = LTSSSolver(n, a, b);
+  auto ltss = LTSSSolver(n, std::move(a), std::move(b));
   std::vector<int> subset = ltss.get_optimal_subset_extern();
   float score = ltss.get_optimal_score_extern();
   return std::make_pair(subset, score);
@@ -0,0 +1,31 @@
+#include "python_threadpool.hpp"
+
+void set_num_threads(int num_threads) {
+  if (num_threads < 0)
+    throw std::invalid_argument("set_num_threads: num_threads must be nonnegative");
+  DefaultThreadPool::set_num_threads(static_cast<std::uint32_t>(num_threads));
+}
+
+int get_num_threads() {
+  return static_cast<int>(DefaultThreadPool::get_num_threads());
+}
+
+bool set_thread_affinity(bool pin) {
+  return DefaultThreadPool::set_thread_affinity(pin);
+}
+
+void shutdown_thread_pool() {
+  DefaultThreadPool::shutdown();
+}
+
+void set_thread_pool_telemetry(bool enabled) {
+  DefaultThreadPool::set_telemetry(enabled);
+}
+
+ThreadPoolStats thread_pool_stats() {
+  return DefaultThreadPool::telemetry_stats();
+}
+
+void reset_thread_pool_stats() {
+  DefaultThreadPool::reset_telemetry();
+}
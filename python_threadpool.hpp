@@ -0,0 +1,27 @@
+#ifndef __PYTHON_THREADPOOL_HPP__
+#define __PYTHON_THREADPOOL_HPP__
+
+#include "threadpool.hpp"
+
+// Control of DefaultThreadPool, which runs the parallel sweeps, batch and
+// async solves. By default it has one thread less than the CPUs available
+// to the process (respecting affinity and cgroup quotas), or
+// PROTO_NUM_THREADS if set. PROTO_PIN_THREADS=1 pins the workers to CPUs.
+// Telemetry is off by default; once enabled, thread_pool_stats() reports
+// queueing, wait and run times and worker utilisation since the last reset.
+
+void set_num_threads(int num_threads);
+
+int get_num_threads();
+
+bool set_thread_affinity(bool pin);
+
+void shutdown_thread_pool();
+
+void set_thread_pool_telemetry(bool enabled);
+
+ThreadPoolStats thread_pool_stats();
+
+void reset_thread_pool_stats();
+
+#endif
@@ -0,0 +1,187 @@
+import concurrent.futures
+import mmap
+import os
+import weakref
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import boosting_losses
+from ensemble_inference import _ENSEMBLE_ARRAYS, CompiledEnsemble
+
+# Process-pool computation of the per-row quantities of a boosting step,
+# for large N. The labels y, the running predictions, the gradient g, the
+# hessian h, the sampled row indices and X live in shared memory blocks
+# mapped by the parent and by every worker; a task carries only the block
+# names and its row range, so no data array is ever pickled. X memory-
+# mapped from a file is opened by path in the workers instead of copied.
+# The ensemble of add_predictions is written once per call to a block of
+# its own, which the workers map for the duration of a task.
+
+# Worker side: arrays attached so far, by spec, and their blocks, which
+# must stay open while the arrays are in use
+_attached = {}
+_attached_blocks = []
+
+def _array(spec):
+    array = _attached.get(spec)
+    if array is None:
+        if spec[0] == 'shm':
+            _, name, shape, dtype = spec
+            block = shared_memory.SharedMemory(name=name)
+            _attached_blocks.append(block)
+            array = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        else:
+            _, filename, offset, shape, dtype, order = spec
+            array = np.memmap(filename, dtype=dtype, mode='r', offset=offset, shape=shape, order=order)
+        _attached[spec] = array
+    return array
+
+def _grad_hess_shard(loss_name, specs, start, stop, sampled, h_offset):
+    y, y_hat, g, h, rows = (_array(spec) for spec in specs)
+    if sampled:
+        shard = rows[start:stop]
+        y_hat, y = y_hat[shard, 0], y[shard]
+    else:
+        y_hat, y = y_hat[start:stop, 0], y[start:stop]
+    g, h = g[start:stop], h[start:stop]
+    boosting_losses.get_loss(loss_name).grad_hess(y_hat, y, g, h)
+    if h_offset:
+        np.add(h, h_offset, out=h)
+
+def _predict_into(block, ensemble_spec, X, y_hat, sign):
+    _, _, layout, max_depth = ensemble_spec
+    arrays = [np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)
+              for offset, shape, dtype in layout]
+    y_hat += sign * CompiledEnsemble(*arrays, max_depth=max_depth).predict(X)
+
+def _add_predictions_shard(ensemble_spec, X_spec, y_hat_spec, start, stop, sign):
+    X, y_hat = _array(X_spec), _array(y_hat_spec)
+    # Not cached like the arrays above, the block lasts one call
+    block = shared_memory.SharedMemory(name=ensemble_spec[1])
+    try:
+        _predict_into(block, ensemble_spec, X[start:stop], y_hat[start:stop], sign)
+    finally:
+        block.close()
+
+class _Block(object):
+    ''' Array in a new shared memory block '''
+    def __init__(self, shape, dtype):
+        dtype = np.dtype(dtype)
+        shape = tuple(int(d) for d in shape)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        self.spec = ('shm', self.shm.name, shape, dtype.str)
+
+    def release(self):
+        self.array = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Views are still alive, the mapping goes with the last of them
+            pass
+        self.shm.unlink()
+
+class _EnsembleBlock(_Block):
+    ''' The arrays of a CompiledEnsemble packed in a new shared memory block '''
+    def __init__(self, ensemble):
+        arrays = [np.ascontiguousarray(getattr(ensemble, name)) for name in _ENSEMBLE_ARRAYS]
+        layout, offset = [], 0
+        for a in arrays:
+            layout.append((offset, a.shape, a.dtype.str))
+            offset += -(-a.nbytes // 8) * 8
+        super(_EnsembleBlock, self).__init__((offset,), np.uint8)
+        for (start, _, _), a in zip(layout, arrays):
+            self.array[start:start+a.nbytes] = a.view(np.uint8).ravel()
+        self.spec = ('ensemble', self.shm.name, tuple(layout), ensemble.max_depth)
+
+def _shutdown(executor, blocks):
+    executor.shutdown()
+    for block in blocks:
+        block.release()
+    del blocks[:]
+
+class ShardedCompute(object):
+    ''' Pool of num_workers processes computing over row shards of the
+        shared arrays X, y, y_hat_sum (N, 1), g and h. The attributes X, y
+        and y_hat_sum are views of the shared blocks for the caller to use
+        in place of its own arrays; X is the caller's if it is memory-mapped
+        from a file. The workers and blocks are freed by close, on leaving
+        a with block, or at the latest when the object is collected.
+    '''
+    def __init__(self, X, y, num_workers=None):
+        self.num_workers = num_workers or os.cpu_count() or 1
+        self.N = X.shape[0]
+        self._blocks = []
+
+        if isinstance(X, np.memmap) and isinstance(X.base, mmap.mmap) and X.filename is not None:
+            order = 'F' if X.flags.f_contiguous and not X.flags.c_contiguous else 'C'
+            self.X = X
+            self._X_spec = ('file', X.filename, X.offset, X.shape, X.dtype.str, order)
+        else:
+            self.X, self._X_spec = self._shared(X.shape, X.dtype, X)
+        self.y, self._y_spec = self._shared(y.shape, y.dtype, y)
+        self.y_hat_sum, self._y_hat_spec = self._shared((self.N, 1), np.float64, 0.)
+        self._g, self._g_spec = self._shared((self.N,), np.float32)
+        self._h, self._h_spec = self._shared((self.N,), np.float32)
+        self._rows, self._rows_spec = self._shared((self.N,), np.int64)
+
+        self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.num_workers)
+        self._finalizer = weakref.finalize(self, _shutdown, self._executor, self._blocks)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _shared(self, shape, dtype, value=None):
+        block = _Block(shape, dtype)
+        self._blocks.append(block)
+        if value is not None:
+            block.array[...] = value
+        return block.array, block.spec
+
+    def _shards(self, n, shard_size=None):
+        size = -(-n // self.num_workers)
+        if shard_size:
+            size = min(size, shard_size)
+        size = max(size, 1)
+        return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+    def _run(self, fn, tasks):
+        futures = [self._executor.submit(fn, *task) for task in tasks]
+        # Wait for every shard, then raise the first failure
+        concurrent.futures.wait(futures)
+        for future in futures:
+            future.result()
+
+    def grad_hess(self, loss, rows=None, h_offset=0., shard_size=None):
+        ''' Gradient and hessian of loss at y_hat_sum, over the sorted row
+            indices rows or all rows, with h_offset added to the hessian.
+            The results are views of the shared g and h blocks, overwritten
+            by the next call.
+        '''
+        n = self.N if rows is None else len(rows)
+        sampled = n < self.N
+        if sampled:
+            self._rows[:n] = rows
+        specs = (self._y_spec, self._y_hat_spec, self._g_spec, self._h_spec, self._rows_spec)
+        self._run(_grad_hess_shard, [(loss.name, specs, start, stop, sampled, float(h_offset))
+                                     for start, stop in self._shards(n, shard_size)])
+        return self._g[:n], self._h[:n]
+
+    def add_predictions(self, ensemble, sign=1., shard_size=None):
+        ''' Add sign times the predictions of the ensemble_inference.CompiledEnsemble
+            ensemble on X to y_hat_sum.
+        '''
+        block = _EnsembleBlock(ensemble)
+        try:
+            self._run(_add_predictions_shard, [(block.spec, self._X_spec, self._y_hat_spec, start, stop, float(sign))
+                                               for start, stop in self._shards(self.N, shard_size)])
+        finally:
+            block.release()
+
+    def close(self):
+        ''' Stop the workers and free the shared blocks '''
+        self._finalizer()
@@ -1,13 +1,54 @@
+import asyncio
+import concurrent.futures
 import multiprocessing
+import threading
+from collections import namedtuple
+from functools import partial
+import numpy as np
 import proto
 
+def as_solver_array(x):
+    ''' Contiguous float32/float64 array for the C++ entry points, which
+        read it through the buffer protocol instead of converting element
+        by element. Other dtypes are cast to float32.
+    '''
+    x = np.asarray(x)
+    if x.dtype not in (np.float32, np.float64):
+        x = x.astype(np.float32)
+    return np.ascontiguousarray(x)
+
+# Compact solver output: labels[i] is the subset index of element i, breakpoints
+# the subset end positions in priority order, a_sums, b_sums, scores per subset
+PartitionResult = namedtuple('PartitionResult',
+                             ['labels', 'breakpoints', 'a_sums', 'b_sums', 'scores', 'score'])
+
+def compact_result(result):
+    ''' NumPy views of a proto.PartitionResult, no per-element conversion.
+    '''
+    return PartitionResult(np.frombuffer(result.labels_buffer(), dtype=np.int32),
+                           np.frombuffer(result.breakpoints_buffer(), dtype=np.int32),
+                           np.frombuffer(result.a_sums_buffer(), dtype=np.float32),
+                           np.frombuffer(result.b_sums_buffer(), dtype=np.float32),
+                           np.frombuffer(result.scores_buffer(), dtype=np.float32),
+                           result.score)
+
+def completed_solve(cancel_token, result):
+    ''' False if the solve may have been cut short, so that partial results
+        are not cached.
+    '''
+    return cancel_token is None or not cancel_token.expired()
+
 class Distribution:
     GAUSSIAN = 0
     POISSON = 1
     RATIONALSCORE = 2
 
 class OptimizerSWIG(object):
-    ''' Task-based C++ optimizer.
+    ''' Task-based C++ optimizer. The C++ solve runs with the GIL released,
+        so instances can be called concurrently from python threads. If a
+        solver_cache.SolverCache is passed, results are looked up there
+        before solving. A proto.CancellationToken stops the solve, from
+        another thread or at its deadline, see cancellation.hpp.
     '''
     def __init__(self,
                  num_partitions,
@@ -16,20 +57,48 @@ class OptimizerSWIG(object):
                  objective_fn=Distribution.GAUSSIAN,
                  risk_partitioning_objective=False, # So multiple clustering
                  use_rational_optimization=False,
-                 sweep_mode=False):
+                 sweep_mode=False,
+                 compact=False,
+                 cache=None,
+                 cancel_token=None):
         self.N = len(g)
         self.num_partitions = num_partitions
         self.objective_fn = objective_fn
         self.risk_partitioning_objective = risk_partitioning_objective
         self.use_rational_optimization = use_rational_optimization
-        self.g_c = proto.FArray()
-        self.h_c = proto.FArray()        
-        self.g_c = g
-        self.h_c = h
+        self.g_c = as_solver_array(g)
+        self.h_c = as_solver_array(h)
 
         self.sweep_mode = sweep_mode
+        self.compact = compact
+        self.cache = cache
+        self.cancel_token = cancel_token
 
     def __call__(self):
+        if self.cache is None:
+            return self._solve()
+        key = self.cache.key(self.g_c,
+                             self.h_c,
+                             solver='DP',
+                             num_partitions=self.num_partitions,
+                             objective_fn=self.objective_fn,
+                             risk_partitioning_objective=self.risk_partitioning_objective,
+                             use_rational_optimization=self.use_rational_optimization,
+                             sweep_mode=self.sweep_mode,
+                             compact=self.compact)
+        kind = 'sweep' if self.sweep_mode else 'partition' if self.compact else 'subsets'
+        return self.cache.get_or_compute(key, kind, self._solve, partial(completed_solve, self.cancel_token))
+
+    def _solve(self):
+        if self.compact and not self.sweep_mode:
+            return compact_result(proto.optimize_one_compact__DP(self.N,
+                                                                 self.num_partitions,
+                                                                 self.g_c,
+                                                                 self.h_c,
+                                                                 self.objective_fn,
+                                                                 self.risk_partitioning_objective,
+                                                                 self.use_rational_optimization,
+                                                                 self.cancel_token))
         if self.sweep_mode:
             return proto.sweep_parallel__DP(self.N,
                                             self.num_partitions,
@@ -37,7 +106,8 @@ class OptimizerSWIG(object):
                                             self.h_c,
                                             self.objective_fn,
                                             self.risk_partitioning_objective,
-                                            self.use_rational_optimization)
+                                            self.use_rational_optimization,
+                                            self.cancel_token)
         else:
             return proto.optimize_one__DP(self.N,
                                           self.num_partitions,
@@ -45,7 +115,199 @@ class OptimizerSWIG(object):
                                           self.h_c,
                                           self.objective_fn,
                                           self.risk_partitioning_objective,
-                                          self.use_rational_optimization)
+                                          self.use_rational_optimization,
+                                          self.cancel_token)
+
+    def submit(self, timeout=None):
+        ''' Submit the solve to the C++ thread pool, returns an OptimizerFuture.
+        '''
+        return submit_optimize__DP(self.num_partitions,
+                                   self.g_c,
+                                   self.h_c,
+                                   objective_fn=self.objective_fn,
+                                   risk_partitioning_objective=self.risk_partitioning_objective,
+                                   use_rational_optimization=self.use_rational_optimization,
+                                   timeout=timeout)
+
+class _CompletionWaiter(object):
+    ''' One thread completing every pending OptimizerFuture. It sleeps in
+        proto.wait_for_completion__DP, without the GIL, until a pool task
+        finishes, then collects the results of the handles that are ready.
+        The thread exits when nothing is pending.
+    '''
+    # Bound on each wait, in case a completion is missed
+    POLL_SECONDS = 1.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._thread = None
+
+    def add(self, future):
+        with self._lock:
+            self._pending.add(future)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        seen = 0
+        while True:
+            # Read the count before checking the handles, so that a task
+            # finishing in between wakes the next wait at once
+            seen = proto.wait_for_completion__DP(seen, self.POLL_SECONDS)
+            with self._lock:
+                finished = [future for future in self._pending if future._handle.ready()]
+                self._pending.difference_update(finished)
+            for future in finished:
+                future._complete()
+            with self._lock:
+                if not self._pending:
+                    self._thread = None
+                    return
+
+_completion_waiter = _CompletionWaiter()
+
+class OptimizerFuture(concurrent.futures.Future):
+    ''' concurrent.futures.Future backed by a proto.DPSolverHandle. It can be
+        awaited from a coroutine without blocking the event loop, and
+        cancelled until the solve finishes: a queued solve is skipped, a
+        running one stops at its next DP layer. With a timeout the result
+        is a proto.SolveTimeout exception once it is exceeded.
+    '''
+    def __init__(self, handle):
+        super(OptimizerFuture, self).__init__()
+        self._handle = handle
+        _completion_waiter.add(self)
+
+    def _complete(self):
+        # The task has finished, handle.get() does not block
+        try:
+            result = self._handle.get()
+        except Exception as e:
+            if self.set_running_or_notify_cancel():
+                self.set_exception(e)
+            return
+        if self.set_running_or_notify_cancel():
+            self.set_result(result)
+
+    def cancel(self):
+        ''' Fails only for solves that have already finished in the C++ pool.
+        '''
+        if not self.done() and not self._handle.cancel():
+            return False
+        return super(OptimizerFuture, self).cancel()
+
+    def __await__(self):
+        return asyncio.wrap_future(self).__await__()
+
+def submit_optimize__DP(num_partitions,
+                        g,
+                        h,
+                        objective_fn=Distribution.GAUSSIAN,
+                        risk_partitioning_objective=False,
+                        use_rational_optimization=False,
+                        timeout=None):
+    ''' timeout is in seconds from submission, None for no limit.
+    '''
+    g_c = as_solver_array(g)
+    h_c = as_solver_array(h)
+    handle = proto.submit_optimize__DP(len(g_c),
+                                       num_partitions,
+                                       g_c,
+                                       h_c,
+                                       objective_fn,
+                                       risk_partitioning_objective,
+                                       use_rational_optimization,
+                                       timeout or 0.)
+    return OptimizerFuture(handle)
+
+# Output of optimize_batch__DP. labels is num_problems x n for 2-D input,
+# otherwise flat with problem k at labels[offsets[k]:offsets[k+1]]. a_sums
+# and b_sums are num_problems x num_partitions, scores one per problem
+BatchPartitionResult = namedtuple('BatchPartitionResult',
+                                  ['labels', 'offsets', 'a_sums', 'b_sums', 'scores'])
+
+def optimize_batch__DP(G,
+                       H,
+                       num_partitions,
+                       offsets=None,
+                       objective_fn=Distribution.GAUSSIAN,
+                       risk_partitioning_objective=False,
+                       use_rational_optimization=False):
+    ''' Solve many independent problems in one call, spread over the C++
+        thread pool. G and H are either 2-D arrays with one problem per
+        row, a list of 1-D arrays of different lengths, or flat arrays
+        with CSR style offsets (problem k is G[offsets[k]:offsets[k+1]]).
+    '''
+    rows = None
+    if offsets is None:
+        if isinstance(G, np.ndarray) and G.ndim == 2:
+            rows, n = G.shape
+            offsets = np.arange(0, rows*n+1, n, dtype=np.int32)
+        else:
+            offsets = np.concatenate([[0], np.cumsum([len(g) for g in G])]).astype(np.int32)
+            G = np.concatenate(G) if len(G) else np.zeros(0, dtype=np.float32)
+            H = np.concatenate(H) if len(H) else np.zeros(0, dtype=np.float32)
+    g_c = as_solver_array(G)
+    h_c = as_solver_array(H)
+    offsets_c = np.ascontiguousarray(offsets, dtype=np.int32)
+
+    result = proto.optimize_batch__DP(num_partitions,
+                                      g_c,
+                                      h_c,
+                                      offsets_c,
+                                      objective_fn,
+                                      risk_partitioning_objective,
+                                      use_rational_optimization)
+
+    labels = np.frombuffer(result.labels_buffer(), dtype=np.int32)
+    if rows is not None:
+        labels = labels.reshape(rows, n)
+    return BatchPartitionResult(labels,
+                                np.frombuffer(result.offsets_buffer(), dtype=np.int32),
+                                np.frombuffer(result.a_sums_buffer(), dtype=np.float32).reshape(-1, num_partitions),
+                                np.frombuffer(result.b_sums_buffer(), dtype=np.float32).reshape(-1, num_partitions),
+                                np.frombuffer(result.scores_buffer(), dtype=np.float32))
+
+def optimize_candidates__DP(num_partitions,
+                            g,
+                            h,
+                            objective_fn=Distribution.GAUSSIAN,
+                            risk_partitioning_objective=False,
+                            use_rational_optimization=False,
+                            cache=None,
+                            cancel_token=None):
+    ''' Optimal partitions into each of the candidate numbers of subsets in
+        num_partitions, as a tuple of PartitionResult in the same order.
+        All come from the table of one solve with the largest candidate,
+        at about the cost of that solve alone.
+    '''
+    num_partitions = [int(t) for t in num_partitions]
+    g_c = as_solver_array(g)
+    h_c = as_solver_array(h)
+
+    def solve():
+        return tuple(compact_result(result)
+                     for result in proto.optimize_candidates_compact__DP(len(g_c),
+                                                                         num_partitions,
+                                                                         g_c,
+                                                                         h_c,
+                                                                         objective_fn,
+                                                                         risk_partitioning_objective,
+                                                                         use_rational_optimization,
+                                                                         cancel_token))
+    if cache is None:
+        return solve()
+    key = cache.key(g_c,
+                    h_c,
+                    solver='DP',
+                    num_partitions=tuple(num_partitions),
+                    objective_fn=objective_fn,
+                    risk_partitioning_objective=risk_partitioning_objective,
+                    use_rational_optimization=use_rational_optimization,
+                    candidates=True)
+    return cache.get_or_compute(key, 'partitions', solve, partial(completed_solve, cancel_token))
 
 class EndTask(object):
     pass
@@ -58,11 +320,10 @@ class OptimizerTask(object):
                  h,
                  objective_fn,
                  risk_partitioning_objective,
-                 use_rational_optimization):
-        g_c = proto.FArray()
-        h_c = proto.FArray()        
-        g_c = g
-        h_c = h
+                 use_rational_optimization,
+                 timeout=None):
+        g_c = as_solver_array(g)
+        h_c = as_solver_array(h)
         self.task = partial(self._task,
                             N,
                             num_partitions,
@@ -70,7 +331,8 @@ class OptimizerTask(object):
                             h_c,
                             objective_fn,
                             risk_partitioning_objective,
-                            use_rational_optimization)
+                            use_rational_optimization,
+                            timeout)
 
     def __call__(self):
         return self.task()
@@ -82,14 +344,19 @@ class OptimizerTask(object):
               h,
               objective_fn,
               risk_partitioning_objective,
-              use_rational_optimization):
+              use_rational_optimization,
+              timeout):
+        # The deadline starts when a worker picks the task up
+        token = proto.CancellationToken()
+        token.set_deadline(timeout or 0.)
         s, w = proto.optimize_one__DP(N,
                                       num_partitions,
                                       g,
                                       h,
                                       objective_fn,
                                       risk_partitioning_objective,
-                                      use_rational_optimization)
+                                      use_rational_optimization,
+                                      token)
         return s, w
 
 class Worker(multiprocessing.Process):
@@ -100,12 +367,18 @@ class Worker(multiprocessing.Process):
 
     def run(self):
         proc_name = self.name
+        # One solver thread per process, the processes already fill the CPUs
+        proto.set_num_threads(1)
         while True:
             task = self.task_queue.get()
             if isinstance(task, EndTask):
                 self.task_queue.task_done()
                 break
-            result = task()
+            try:
+                result = task()
+            except proto.SolveCancelled as e:
+                # Timed out, reported instead of a result
+                result = e
             self.task_queue.task_done()
             self.result_queue.put(result)
 
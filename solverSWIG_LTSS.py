@@ -1,15 +1,22 @@
 import proto
 
+from solverSWIG_DP import as_solver_array
+
 class OptimizerSWIG(object):
-    '''C++ LTSS optimizer
+    '''C++ LTSS optimizer, optionally behind a solver_cache.SolverCache
     '''
 
-    def __init__(self, g, h):
+    def __init__(self, g, h, cache=None):
         self.N = len(g)
-        self.g_c = proto.FArray()
-        self.h_c = proto.FArray()
-        self.g_c = g
-        self.h_c = h
+        self.g_c = as_solver_array(g)
+        self.h_c = as_solver_array(h)
+        self.cache = cache
 
     def __call__(self):
+        if self.cache is None:
+            return self._solve()
+        key = self.cache.key(self.g_c, self.h_c, solver='LTSS')
+        return self.cache.get_or_compute(key, 'subset', self._solve)
+
+    def _solve(self):
         return proto.optimize_one__LTSS(self.N, self.g_c, self.h_c)
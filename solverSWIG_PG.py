@@ -1,42 +1,62 @@
 import multiprocessing
+from functools import partial
 import proto
 
+from solverSWIG_DP import as_solver_array, compact_result, completed_solve
+
 class OptimizerSWIG(object):
-    ''' Task-based C++ optimizer.
+    ''' Task-based C++ optimizer, optionally behind a solver_cache.SolverCache
+        and stoppable through a proto.CancellationToken.
     '''
-    def __init__(self, num_partitions, g, h, sweep_mode=False):
+    def __init__(self, num_partitions, g, h, sweep_mode=False, compact=False, cache=None, cancel_token=None):
         self.N = len(g)
         self.num_partitions = num_partitions
-        self.g_c = proto.FArray()
-        self.h_c = proto.FArray()        
-        self.g_c = g
-        self.h_c = h
+        self.g_c = as_solver_array(g)
+        self.h_c = as_solver_array(h)
 
         self.sweep_mode = sweep_mode
+        self.compact = compact
+        self.cache = cache
+        self.cancel_token = cancel_token
         
     def __call__(self):
+        if self.cache is None:
+            return self._solve()
+        key = self.cache.key(self.g_c,
+                             self.h_c,
+                             solver='PG',
+                             num_partitions=self.num_partitions,
+                             sweep_mode=self.sweep_mode,
+                             compact=self.compact)
+        kind = 'sweep' if self.sweep_mode else 'partition' if self.compact else 'subsets'
+        return self.cache.get_or_compute(key, kind, self._solve, partial(completed_solve, self.cancel_token))
+
+    def _solve(self):
+        if self.compact and not self.sweep_mode:
+            return compact_result(proto.optimize_one_compact__PG(self.N, self.num_partitions, self.g_c, self.h_c, self.cancel_token))
         if self.sweep_mode:
-            return proto.sweep_parallel__PG(self.N, self.num_partitions, self.g_c, self.h_c)
+            return proto.sweep_parallel__PG(self.N, self.num_partitions, self.g_c, self.h_c, self.cancel_token)
         else:
-            return proto.optimize_one__PG(self.N, self.num_partitions, self.g_c, self.h_c)
+            return proto.optimize_one__PG(self.N, self.num_partitions, self.g_c, self.h_c, self.cancel_token)
 
 class EndTask(object):
     pass
 
 class OptimizerTask(object):
-    def __init__(self, N, num_partitions, g, h):
-        g_c = proto.FArray()
-        h_c = proto.FArray()        
-        g_c = g
-        h_c = h
-        self.task = partial(self._task, N, num_partitions, g_c, h_c)
+    def __init__(self, N, num_partitions, g, h, timeout=None):
+        g_c = as_solver_array(g)
+        h_c = as_solver_array(h)
+        self.task = partial(self._task, N, num_partitions, g_c, h_c, timeout)
 
     def __call__(self):
         return self.task()
         
     @staticmethod
-    def _task(N, num_partitions, g, h):
-        s, w = proto.optimize_one__PG(N, num_partitions, g, h)
+    def _task(N, num_partitions, g, h, timeout):
+        # The deadline starts when a worker picks the task up
+        token = proto.CancellationToken()
+        token.set_deadline(timeout or 0.)
+        s, w = proto.optimize_one__PG(N, num_partitions, g, h, token)
         return s, w
 
 class Worker(multiprocessing.Process):
@@ -47,12 +67,18 @@ class Worker(multiprocessing.Process):
 
     def run(self):
         proc_name = self.name
+        # One solver thread per process, the processes already fill the CPUs
+        proto.set_num_threads(1)
         while True:
             task = self.task_queue.get()
             if isinstance(task, EndTask):
                 self.task_queue.task_done()
                 break
-            result = task()
+            try:
+                result = task()
+            except proto.SolveCancelled as e:
+                # Timed out, reported instead of a result
+                result = e
             self.task_queue.task_done()
             self.result_queue.put(result)
 
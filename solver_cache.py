@@ -0,0 +1,217 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from solverSWIG_DP import PartitionResult
+
+# Results are stored as a handful of flat arrays per entry, so that the
+# byte budget is easy to account for and the disk tier can memory-map them.
+# Each kind maps to an (encode, decode) pair.
+
+def _encode_partition(result):
+    return dict(labels=result.labels,
+                breakpoints=result.breakpoints,
+                a_sums=result.a_sums,
+                b_sums=result.b_sums,
+                scores=result.scores,
+                score=np.array([result.score], dtype=np.float32))
+
+def _decode_partition(arrays):
+    return PartitionResult(arrays['labels'],
+                           arrays['breakpoints'],
+                           arrays['a_sums'],
+                           arrays['b_sums'],
+                           arrays['scores'],
+                           float(arrays['score'][0]))
+
+def _encode_partitions(results):
+    # Entry k's arrays are stored under 'k.<field>'
+    return {'{}.{}'.format(k, name): a
+            for k, result in enumerate(results)
+            for name, a in _encode_partition(result).items()}
+
+def _decode_partitions(arrays):
+    count = len({name.split('.')[0] for name in arrays})
+    return tuple(_decode_partition({name.split('.')[1]: a
+                                    for name, a in arrays.items() if name.split('.')[0] == str(k)})
+                 for k in range(count))
+
+def _flatten(subsets):
+    lengths = [len(s) for s in subsets]
+    values = np.fromiter((el for s in subsets for el in s), dtype=np.int32, count=sum(lengths))
+    return values, np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32)
+
+def _unflatten(values, offsets):
+    return tuple(tuple(int(el) for el in values[offsets[i]:offsets[i+1]])
+                 for i in range(len(offsets)-1))
+
+def _encode_subsets(result):
+    subsets, score = result
+    values, offsets = _flatten(subsets)
+    return dict(values=values, offsets=offsets, score=np.array([score], dtype=np.float32))
+
+def _decode_subsets(arrays):
+    return (_unflatten(arrays['values'], arrays['offsets']), float(arrays['score'][0]))
+
+def _encode_subset(result):
+    subset, score = result
+    return dict(values=np.asarray(subset, dtype=np.int32), score=np.array([score], dtype=np.float32))
+
+def _decode_subset(arrays):
+    return (tuple(int(el) for el in arrays['values']), float(arrays['score'][0]))
+
+def _encode_sweep(results):
+    # One entry per number of partitions; counts[k] subsets in entry k
+    values, offsets = _flatten([s for subsets, _ in results for s in subsets])
+    return dict(values=values,
+                offsets=offsets,
+                counts=np.array([len(subsets) for subsets, _ in results], dtype=np.int32),
+                scores=np.array([score for _, score in results], dtype=np.float32))
+
+def _decode_sweep(arrays):
+    subsets = _unflatten(arrays['values'], arrays['offsets'])
+    bounds = np.concatenate([[0], np.cumsum(arrays['counts'])])
+    return tuple((subsets[bounds[k]:bounds[k+1]], float(score))
+                 for k, score in enumerate(arrays['scores']))
+
+def _frozen(a):
+    # Private read-only copy, callers may modify the arrays they were given
+    a = np.array(a, order='C')
+    a.flags.writeable = False
+    return a
+
+_CODECS = dict(partition=(_encode_partition, _decode_partition),
+               partitions=(_encode_partitions, _decode_partitions),
+               subsets=(_encode_subsets, _decode_subsets),
+               subset=(_encode_subset, _decode_subset),
+               sweep=(_encode_sweep, _decode_sweep))
+
+class SolverCache(object):
+    ''' Content-addressed cache of partition solves. Keys are a hash of the
+        input buffers and solver parameters. Entries are kept in an LRU
+        bounded by max_bytes and, if cache_dir is given, also written there
+        as .npy files which are memory-mapped when read back.
+    '''
+    def __init__(self, max_bytes=256*2**20, cache_dir=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._entries = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(*arrays, **params):
+        h = hashlib.blake2b(digest_size=16)
+        for a in arrays:
+            a = np.ascontiguousarray(a)
+            h.update('{}{}'.format(a.dtype.str, a.shape).encode())
+            h.update(a)
+        h.update(repr(sorted(params.items())).encode())
+        return h.hexdigest()
+
+    def get_or_compute(self, key, kind, fn, cacheable=None):
+        ''' Cached result for key, or the result of fn() which is then stored,
+            unless cacheable(result) is false. Either way the arrays of the
+            result are read-only.
+        '''
+        encode, decode = _CODECS[kind]
+
+        arrays = self._get(key)
+        if arrays is not None:
+            return decode(arrays)
+
+        result = fn()
+        arrays = {k: _frozen(v) for k, v in encode(result).items()}
+        if cacheable is None or cacheable(result):
+            self._put(key, arrays)
+        return decode(arrays)
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits,
+                        disk_hits=self.disk_hits,
+                        misses=self.misses,
+                        entries=len(self._entries),
+                        nbytes=self._nbytes)
+
+    def clear(self, disk=False):
+        with self._lock:
+            self._entries.clear()
+            self._nbytes = 0
+            self.hits = self.disk_hits = self.misses = 0
+        if disk and self.cache_dir is not None:
+            for name in os.listdir(self.cache_dir):
+                shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+    def _get(self, key):
+        with self._lock:
+            arrays = self._entries.get(key)
+            if arrays is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return arrays
+
+        arrays = self._load(key)
+
+        with self._lock:
+            if arrays is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+                self._insert(key, arrays)
+        return arrays
+
+    def _put(self, key, arrays):
+        with self._lock:
+            self._insert(key, arrays)
+        self._store(key, arrays)
+
+    def _insert(self, key, arrays):
+        nbytes = sum(a.nbytes for a in arrays.values())
+        if key in self._entries or nbytes > self.max_bytes:
+            return
+        self._entries[key] = arrays
+        self._nbytes += nbytes
+        while self._nbytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._nbytes -= sum(a.nbytes for a in evicted.values())
+
+    def _load(self, key):
+        if self.cache_dir is None:
+            return None
+        path = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            return {name[:-4]: np.load(os.path.join(path, name), mmap_mode='r')
+                    for name in os.listdir(path) if name.endswith('.npy')}
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, key, arrays):
+        if self.cache_dir is None:
+            return
+        path = os.path.join(self.cache_dir, key)
+        if os.path.isdir(path):
+            return
+        # Write to a scratch directory and rename, so readers never see
+        # a partial entry
+        tmp = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        try:
+            for name, a in arrays.items():
+                np.save(os.path.join(tmp, name + '.npy'), a)
+            os.rename(tmp, path)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+import boosting_losses
+
+rng = np.random.RandomState(21)
+
+EPS = 1e-5
+
+def labels(name, n):
+    if name == 'exp':
+        return rng.randint(0, 2, size=n).astype(np.float64)
+    if name == 'logistic':
+        return 2. * rng.randint(0, 2, size=n) - 1.
+    return rng.uniform(low=-1.0, high=1.0, size=n)
+
+def grad_hess(loss, y_hat, y):
+    g, h = np.empty_like(y_hat), np.empty_like(y_hat)
+    loss.grad_hess(y_hat, y, g, h)
+    return g, h
+
+@pytest.mark.parametrize('name', sorted(boosting_losses.LOSSES))
+def test_grad_hess_match_finite_differences(name):
+    loss = boosting_losses.get_loss(name)
+    y = labels(name, 200)
+    y_hat = rng.uniform(low=-1.5, high=1.5, size=200)
+    if name == 'hinge':
+        # Away from the kink at y_hat = y
+        y_hat[np.abs(y_hat - y) < 10*EPS] += 0.1
+
+    g, h = grad_hess(loss, y_hat, y)
+    g_up, _ = grad_hess(loss, y_hat + EPS, y)
+    g_down, _ = grad_hess(loss, y_hat - EPS, y)
+    g_fd = (loss.coordinatewise(y_hat + EPS, y) - loss.coordinatewise(y_hat - EPS, y)) / (2*EPS)
+    h_fd = (g_up - g_down) / (2*EPS)
+
+    np.testing.assert_allclose(g, g_fd, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(h, h_fd, rtol=1e-5, atol=1e-6)
+
+@pytest.mark.parametrize('name', sorted(boosting_losses.LOSSES))
+def test_grad_hess_into_float32_buffers(name):
+    loss = boosting_losses.get_loss(name)
+    y = labels(name, 50)
+    y_hat = rng.uniform(low=-1.5, high=1.5, size=50)
+    g, h = grad_hess(loss, y_hat, y)
+
+    g32, h32 = np.empty(50, dtype=np.float32), np.empty(50, dtype=np.float32)
+    loss.grad_hess(y_hat, y, g32, h32)
+    np.testing.assert_allclose(g32, g, rtol=1e-5, atol=1e-6)
+    np.testing.assert_allclose(h32, h, rtol=1e-5, atol=1e-6)
+
+def test_value_sums_coordinatewise():
+    for name, loss in boosting_losses.LOSSES.items():
+        y = labels(name, 50)
+        y_hat = rng.uniform(low=-1.5, high=1.5, size=50)
+        assert loss.value(y_hat, y) == pytest.approx(np.sum(loss.coordinatewise(y_hat, y)))
+
+def test_unknown_loss():
+    with pytest.raises(ValueError):
+        boosting_losses.get_loss('huber')
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+import ensemble_inference
+from ensemble_inference import CompiledEnsemble
+
+rng = np.random.RandomState(33)
+
+def random_ensemble(num_trees, depth, num_features):
+    ''' Complete trees of the given depth with random splits and leaves '''
+    roots, left, right, feature, threshold, value = [], [], [], [], [], []
+    for _ in range(num_trees):
+        offset = len(left)
+        roots.append(offset)
+        num_nodes = 2**(depth+1) - 1
+        for i in range(num_nodes):
+            if 2*i+1 < num_nodes:
+                left.append(offset + 2*i+1)
+                right.append(offset + 2*i+2)
+            else:
+                left.append(-1)
+                right.append(-1)
+            feature.append(rng.randint(num_features))
+            threshold.append(rng.uniform())
+            value.append(rng.normal())
+    return CompiledEnsemble(np.array(roots, dtype=np.int32),
+                            np.array(left, dtype=np.int32),
+                            np.array(right, dtype=np.int32),
+                            np.array(feature, dtype=np.int32),
+                            np.array(threshold),
+                            np.array(value),
+                            depth)
+
+def walk(ensemble, X):
+    ''' Reference prediction, one row and one tree at a time '''
+    y_hat = np.zeros((X.shape[0], 1))
+    for r, row in enumerate(X.astype(np.float32)):
+        for node in ensemble.roots:
+            while ensemble.children_left[node] >= 0:
+                if row[ensemble.feature[node]] <= ensemble.threshold[node]:
+                    node = ensemble.children_left[node]
+                else:
+                    node = ensemble.children_right[node]
+            y_hat[r, 0] += ensemble.value[node]
+    return y_hat
+
+def test_predict_matches_tree_walk():
+    ensemble = random_ensemble(num_trees=7, depth=4, num_features=5)
+    X = rng.uniform(size=(300, 5))
+    expected = walk(ensemble, X)
+    for chunk_size in (None, 1, 64, 1000):
+        np.testing.assert_array_equal(ensemble.predict(X, chunk_size=chunk_size), expected)
+
+def test_empty_ensemble():
+    ensemble = CompiledEnsemble.from_learners([])
+    np.testing.assert_array_equal(ensemble.predict(np.ones((3, 2))), np.zeros((3, 1)))
+
+def test_save_load_round_trip(tmp_path):
+    ensemble = random_ensemble(num_trees=3, depth=3, num_features=4)
+    X = rng.uniform(size=(100, 4))
+    path = str(tmp_path / 'model.bin')
+    ensemble_inference.save(path, ensemble, metadata=dict(steps=3), tables=dict(extra=np.arange(5.)))
+
+    for mmap in (True, False):
+        model = ensemble_inference.load(path, mmap=mmap)
+        assert model.metadata['steps'] == 3
+        np.testing.assert_array_equal(model.tables['extra'], np.arange(5.))
+        np.testing.assert_array_equal(model.predict(X), ensemble.predict(X))
+
+def test_load_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.bin'
+    path.write_bytes(b'not a model')
+    with pytest.raises(ValueError):
+        ensemble_inference.load(str(path))
+
+# Parity with the Theano prediction path of the fitted learners, the
+# invariant the module exists for
+
+@pytest.fixture
+def theano_learners():
+    sklearn_tree = pytest.importorskip('sklearn.tree')
+    theano = pytest.importorskip('theano')
+    import classifier
+    return sklearn_tree, theano, classifier
+
+@pytest.mark.parametrize('kind', ['regressor', 'classifier'])
+@pytest.mark.parametrize('features', [None, np.array([0, 2, 3])])
+def test_predict_matches_learners(theano_learners, kind, features):
+    sklearn_tree, theano, classifier = theano_learners
+    tree = sklearn_tree.DecisionTreeRegressor if kind == 'regressor' else sklearn_tree.DecisionTreeClassifier
+    distiller = classifier.classifierFactory(tree)
+
+    X = rng.uniform(size=(400, 5)).astype(theano.config.floatX)
+    X_test = rng.uniform(size=(150, 5)).astype(theano.config.floatX)
+    learners = []
+    for _ in range(4):
+        leaf_values = rng.choice(rng.uniform(size=6), size=(400, 1))
+        learners.append(distiller(X, leaf_values, max_depth=None, features=features))
+
+    X_shared = theano.shared(value=X_test, borrow=True)
+    expected = sum(np.asarray(learner.predict(X_shared).eval()) for learner in learners)
+    predicted = CompiledEnsemble.from_learners(learners).predict(X_test)
+    np.testing.assert_allclose(predicted, expected, rtol=1e-6, atol=1e-6)
+
+@pytest.mark.parametrize('kind', ['regressor', 'classifier'])
+@pytest.mark.parametrize('col_sample_ratio', [1., 0.6])
+def test_predict_batch_matches_predict_from_input(theano_learners, kind, col_sample_ratio):
+    sklearn_tree, theano, classifier = theano_learners
+    pytest.importorskip('proto')
+    from optimalsplitboost import OptimalSplitGradientBoostingClassifier
+
+    tree = sklearn_tree.DecisionTreeRegressor if kind == 'regressor' else sklearn_tree.DecisionTreeClassifier
+    X = rng.uniform(size=(200, 5)).astype(theano.config.floatX)
+    y = (X[:, 0] + X[:, 1] > 1.).astype(theano.config.floatX)
+    X_test = rng.uniform(size=(80, 5)).astype(theano.config.floatX)
+
+    clf = OptimalSplitGradientBoostingClassifier(X,
+                                                 y,
+                                                 min_partition_size=2,
+                                                 max_partition_size=8,
+                                                 col_sample_ratio=col_sample_ratio,
+                                                 num_classifiers=5,
+                                                 distiller=classifier.classifierFactory(tree))
+    clf.fit(4)
+
+    expected = np.asarray(clf.predict_from_input(X_test).eval())
+    np.testing.assert_allclose(clf.predict_batch(X_test), expected, rtol=1e-6, atol=1e-6)
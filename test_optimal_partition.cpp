@@ -60,51 +60,27 @@ PartitionTest::sort_by_priority_(std::vector<double>& a, std::vector<double>& b,
 }
 
 void
-PartitionTest::runTest() {
+PartitionTest::runTest(const CancellationToken* token) {
   
-  int NUM_TASKS = 10;
-
   int numPartitions = fList_.size();
-  int window = static_cast<int>(numPartitions/NUM_TASKS);
-  int excess = numPartitions - window*NUM_TASKS;
 
   sort_by_priority_(a_, b_, delta_);
 
-  auto task = [this](int b, int e) {
-    results_queue_.push(optimize_(b, e));
-  };
-
-  // submit work if chunk size is large enough, otherwise single process
-  // DISABLED
-#ifdef FALSE
-  if (false) {
-    for (int i=0; i<NUM_TASKS; ++i) {
-      v_.push_back(DefaultThreadPool::submitJob(task, i*window, (i+1)*window));
-    }
-    // submit remainder of work, if any
-    if (excess) { 
-      v_.push_back(DefaultThreadPool::submitJob(task, NUM_TASKS*window, numPartitions)); 
-    }
-    
-  } else {
-    v_.push_back(DefaultThreadPool::submitJob(task, 0, numPartitions));
-  }
-#endif
-  v_.push_back(DefaultThreadPool::submitJob(task, 0, numPartitions));
-  
-  for (auto& item : v_)
-    item.get();
-
-  double maxScore = std::numeric_limits<double>::lowest();
-
-  resultPair result;
-  while (!results_queue_.empty()) {
-    bool valid = results_queue_.waitPop(result);
-    std::cerr << "result: " << result.first << std::endl;
-    if (valid && (result.first > maxScore)) {
-      maxScore = result.first;
-      optimalResult_ = result;
-    }
+  // (score, index) of the best partition, ties go to the lowest index
+  using scoreIndex = std::pair<double, int>;
+  auto best = DefaultThreadPool::parallel_reduce(0,
+						 numPartitions,
+						 scoreIndex{std::numeric_limits<double>::lowest(), -1},
+						 [this](int i) { return scoreIndex{score_(i), i}; },
+						 [](scoreIndex x, scoreIndex y) { return (y.first > x.first) ? y : x; },
+						 0,
+						 token);
+
+  // Chunks skipped after the token expired leave the best of those scored
+  interrupted_ = solve_interrupted(token);
+
+  if (best.second >= 0) {
+    optimalResult_ = std::make_pair(best.first, fList_[best.second]);
   }
   
   optimization_done_ = true;
@@ -150,45 +126,32 @@ PartitionTest::init_(bool formPartitions) {
 
 void
 PartitionTest::cleanup_() {
-  results_queue_.clear();
   results_.clear();
 }
 
-resultPair
-PartitionTest::optimize_(int b, int e) {
-  double rSum, paSum, pbSum;
-  double rMax = std::numeric_limits<double>::lowest();
-  std::vector<std::vector<int>> partMax;
-
-  for (auto it=fList_.cbegin()+b; it!=fList_.cbegin()+e; ++it) {
-    rSum = 0.;
-    for (auto pit=(*it).cbegin(); pit!=(*it).cend(); ++pit) {
-      paSum = 0.;
-      pbSum = 0.;
-      for (auto eit=(*pit).cbegin(); eit!=(*pit).cend(); ++eit) {
-	paSum += a_[*eit];
-	pbSum += b_[*eit];
-      }
-      // XXX
-      rSum += Score::power_(paSum, pbSum, gamma_);      
-      // rSum += Score::log_(paSum, pbSum);
-      // rSum += Score::log_prod_(paSum, pbSum);
-      // rSum += Score::double_log_(paSum, pbSum);
-      // rSum += Score::exp_(paSum, pbSum);
-      // rSum += Score::power_sum_(paSum, pbSum, gamma_);
-      // rSum += Score::power_prod_(paSum, pbSum, gamma_);
-      // rSum += Score::score_summand_(paSum, pbSum, gamma_);
-    }
-    // print_pair(std::make_pair(rSum, *it));
-    if (rSum > rMax) {
-      rMax = rSum;
-      partMax = *it;
+double
+PartitionTest::score_(int i) const {
+  double rSum = 0., paSum, pbSum;
+
+  for (auto pit=fList_[i].cbegin(); pit!=fList_[i].cend(); ++pit) {
+    paSum = 0.;
+    pbSum = 0.;
+    for (auto eit=(*pit).cbegin(); eit!=(*pit).cend(); ++eit) {
+      paSum += a_[*eit];
+      pbSum += b_[*eit];
     }
+    // XXX
+    rSum += Score::power_(paSum, pbSum, gamma_);      
+    // rSum += Score::log_(paSum, pbSum);
+    // rSum += Score::log_prod_(paSum, pbSum);
+    // rSum += Score::double_log_(paSum, pbSum);
+    // rSum += Score::exp_(paSum, pbSum);
+    // rSum += Score::power_sum_(paSum, pbSum, gamma_);
+    // rSum += Score::power_prod_(paSum, pbSum, gamma_);
+    // rSum += Score::score_summand_(paSum, pbSum, gamma_);
   }
 
-  cleanup_();
-
-  return std::make_pair(rMax, partMax);
+  return rSum;
 }
 
 void
@@ -252,6 +215,11 @@ PartitionTest::get_results() const {
     return optimalResult_;
 }
 
+bool
+PartitionTest::interrupted() const {
+  return interrupted_;
+}
+
 bool
 PartitionTest::assertOrdered(const resultPair& r) const {
   for (auto& list: r.second) {
@@ -8,9 +8,10 @@
 #include <numeric>
 #include <iterator>
 #include <atomic>
+#include <limits>
 
+#include "cancellation.hpp"
 #include "threadpool.hpp"
-#include "threadsafequeue.hpp"
 
 #define UNUSED(expr) do { (void)(expr); } while (0)
 
@@ -85,8 +86,9 @@ public:
     fList_(fList)
   { init_(false); }
 		
-  void runTest();
+  void runTest(const CancellationToken* token=nullptr);
   resultPair get_results() const;
+  bool interrupted() const;
   void print_pair(const resultPair&) const;
   void print_partitions() const;
   bool assertOrdered(const resultPair&) const;
@@ -109,14 +111,13 @@ private:
   std::vector<resultPair> results_;
   resultPair optimalResult_;
   std::vector<std::vector<std::vector<int>>> fList_;
-  ThreadsafeQueue<resultPair> results_queue_;
-  std::vector<ThreadPool::TaskFuture<void>> v_;
 
   mutable std::atomic<bool> optimization_done_{false};
+  bool interrupted_{false};
 
   void init_(bool);
   void cleanup_();
-  resultPair optimize_(int, int);
+  double score_(int) const;
   void formPartitions_();
   void sort_by_priority_(std::vector<double>&, std::vector<double>&, double);
 };
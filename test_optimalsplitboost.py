@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+sklearn_tree = pytest.importorskip('sklearn.tree')
+theano = pytest.importorskip('theano')
+pytest.importorskip('proto')
+
+import classifier
+import optimalsplitboost
+from optimalsplitboost import OptimalSplitGradientBoostingClassifier
+
+rng = np.random.RandomState(57)
+
+def data(n=400, num_features=5):
+    X = rng.uniform(size=(n, num_features)).astype(theano.config.floatX)
+    y = (X[:, 0] + X[:, 1] > 1.).astype(theano.config.floatX)
+    return X, y
+
+def fitted(X, y, seed, num_steps=3, **kwargs):
+    optimalsplitboost.rng = np.random.RandomState(seed)
+    np.random.seed(seed)
+    clf = OptimalSplitGradientBoostingClassifier(X,
+                                                 y,
+                                                 min_partition_size=2,
+                                                 max_partition_size=8,
+                                                 num_candidates=1,
+                                                 num_classifiers=num_steps+1,
+                                                 distiller=classifier.classifierFactory(sklearn_tree.DecisionTreeRegressor),
+                                                 **kwargs)
+    clf.fit(num_steps)
+    return clf
+
+@pytest.mark.parametrize('row_sample_ratio', [1., 0.5])
+def test_memory_budget_keeps_model(row_sample_ratio):
+    # A budget that does not limit the row sample only changes the chunking
+    X, y = data()
+    unbudgeted = fitted(X, y, seed=3, row_sample_ratio=row_sample_ratio)
+    budgeted = fitted(X, y, seed=3, row_sample_ratio=row_sample_ratio, memory_budget=X.nbytes * 4)
+    np.testing.assert_allclose(budgeted.y_hat_sum, unbudgeted.y_hat_sum)
+    np.testing.assert_allclose(budgeted.predict_batch(X), unbudgeted.predict_batch(X))
+
+def test_only_last_partition_kept():
+    X, y = data()
+    clf = fitted(X, y, seed=5, num_steps=4)
+    last = clf.curr_classifier - 1
+    assert [labels is None for labels in clf.partitions] == [True] * last + [False]
+    assert clf.leaf_values(last).shape == (X.shape[0], 1)
+    np.testing.assert_array_equal(np.unique(clf.leaf_values(last)), clf.distinct_leaf_values[last])
+    with pytest.raises(ValueError):
+        clf.leaf_values(last - 1)
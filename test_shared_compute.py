@@ -0,0 +1,78 @@
+import os
+
+import numpy as np
+import pytest
+
+import boosting_losses
+from shared_compute import ShardedCompute
+from test_ensemble_inference import random_ensemble
+
+rng = np.random.RandomState(41)
+
+def shm_names(compute):
+    return [block.shm.name for block in compute._blocks]
+
+def test_add_predictions_matches_predict():
+    ensemble = random_ensemble(num_trees=5, depth=3, num_features=4)
+    X = rng.uniform(size=(500, 4))
+    y = rng.randint(0, 2, size=500).astype(np.float64)
+    with ShardedCompute(X, y, num_workers=2) as compute:
+        compute.add_predictions(ensemble, shard_size=64)
+        compute.add_predictions(ensemble, sign=-0.5)
+        np.testing.assert_allclose(compute.y_hat_sum, 0.5 * ensemble.predict(X))
+
+def test_grad_hess_matches_loss():
+    X = rng.uniform(size=(300, 3))
+    y = rng.randint(0, 2, size=300).astype(np.float64)
+    loss = boosting_losses.get_loss('exp')
+    rows = np.sort(rng.choice(300, size=100, replace=False))
+    with ShardedCompute(X, y, num_workers=2) as compute:
+        compute.y_hat_sum[:, 0] = rng.uniform(size=300)
+        g, h = compute.grad_hess(loss, rows=rows, shard_size=16)
+        g_expected, h_expected = np.empty(100), np.empty(100)
+        loss.grad_hess(compute.y_hat_sum[rows, 0], y[rows], g_expected, h_expected)
+        np.testing.assert_allclose(g, g_expected, rtol=1e-6)
+        np.testing.assert_allclose(h, h_expected, rtol=1e-6)
+
+def test_blocks_freed_on_error():
+    X, y = rng.uniform(size=(10, 2)), np.zeros(10)
+    try:
+        with ShardedCompute(X, y, num_workers=1) as compute:
+            names = shm_names(compute)
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert not any(os.path.exists('/dev/shm/' + name) for name in names)
+
+def test_blocks_freed_when_collected():
+    X, y = rng.uniform(size=(10, 2)), np.zeros(10)
+    compute = ShardedCompute(X, y, num_workers=1)
+    names = shm_names(compute)
+    del compute
+    assert not any(os.path.exists('/dev/shm/' + name) for name in names)
+
+def file_backed(array):
+    # Theano keeps a plain ndarray view of a memmap, look through the views
+    while isinstance(array, np.ndarray):
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+def test_close_keeps_file_backed_X(tmp_path):
+    pytest.importorskip('sklearn')
+    theano = pytest.importorskip('theano')
+    pytest.importorskip('proto')
+    from optimalsplitboost import OptimalSplitGradientBoostingClassifier
+
+    X = rng.uniform(size=(200, 4)).astype(theano.config.floatX)
+    y = (X[:, 0] > .5).astype(theano.config.floatX)
+    path = str(tmp_path / 'X.npy')
+    np.save(path, X)
+
+    clf = OptimalSplitGradientBoostingClassifier(path, y, min_partition_size=2, max_partition_size=8,
+                                                 num_classifiers=3, num_workers=1)
+    clf.fit(2)
+    clf.close()
+    assert file_backed(clf.X_all.get_value(borrow=True))
+    assert not file_backed(clf.y_all.get_value(borrow=True))
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+import solverSWIG_DP
+from solver_cache import SolverCache
+from solverSWIG_DP import PartitionResult
+
+rng = np.random.RandomState(12)
+
+def partition_result():
+    return PartitionResult(np.array([0, 1, 1, 0], dtype=np.int32),
+                           np.array([2, 4], dtype=np.int32),
+                           np.array([1.5, -2.], dtype=np.float32),
+                           np.array([3., 4.], dtype=np.float32),
+                           np.array([.75, 1.], dtype=np.float32),
+                           1.75)
+
+def assert_same_partition(result, expected):
+    for name in ('labels', 'breakpoints', 'a_sums', 'b_sums', 'scores'):
+        np.testing.assert_array_equal(getattr(result, name), getattr(expected, name))
+        assert not getattr(result, name).flags.writeable
+    assert result.score == expected.score
+
+def test_hit_miss_round_trip():
+    cache = SolverCache()
+    calls = []
+    def solve():
+        calls.append(1)
+        return partition_result()
+
+    key = cache.key(np.arange(4.), solver='test')
+    miss = cache.get_or_compute(key, 'partition', solve)
+    hit = cache.get_or_compute(key, 'partition', solve)
+
+    assert len(calls) == 1
+    assert_same_partition(miss, partition_result())
+    assert_same_partition(hit, partition_result())
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+def test_disk_round_trip(tmp_path):
+    key = SolverCache.key(np.arange(4.), solver='test')
+    SolverCache(cache_dir=str(tmp_path)).get_or_compute(key, 'partition', partition_result)
+
+    # A fresh cache on the same directory reads the entry back memory-mapped
+    cache = SolverCache(cache_dir=str(tmp_path))
+    result = cache.get_or_compute(key, 'partition', lambda: pytest.fail('recomputed'))
+    assert_same_partition(result, partition_result())
+    assert cache.stats()['disk_hits'] == 1
+
+def test_uncacheable_result_not_stored():
+    cache = SolverCache()
+    key = cache.key(np.arange(4.), solver='test')
+    result = cache.get_or_compute(key, 'partition', partition_result, cacheable=lambda result: False)
+    assert_same_partition(result, partition_result())
+    assert cache.stats()['entries'] == 0
+
+def test_candidates_match_uncached(tmp_path):
+    g = rng.uniform(low=-10.0, high=10.0, size=200)
+    h = rng.uniform(low=1.0, high=10.0, size=200)
+    expected = solverSWIG_DP.optimize_candidates__DP((3, 5, 8), g, h)
+
+    for cache in (SolverCache(), SolverCache(cache_dir=str(tmp_path))):
+        for _ in range(2):
+            results = solverSWIG_DP.optimize_candidates__DP((3, 5, 8), g, h, cache=cache)
+            for result, expected_result in zip(results, expected):
+                assert_same_partition(result, expected_result)
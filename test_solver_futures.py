@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+
+import proto
+import solverSWIG_DP
+
+rng = np.random.RandomState(8)
+
+def test_handle_get_rethrows_solve_error():
+    g = rng.uniform(low=-10.0, high=10.0, size=3000)
+    h = rng.uniform(low=1.0, high=10.0, size=3000)
+    future = solverSWIG_DP.submit_optimize__DP(20, g, h, timeout=1e-4)
+    with pytest.raises(proto.SolveTimeout):
+        future.result()
+    # The future has already taken the outcome from the handle
+    for _ in range(2):
+        with pytest.raises(proto.SolveTimeout):
+            future._handle.get()
+
+def test_handle_get_repeats_result():
+    g = rng.uniform(low=-10.0, high=10.0, size=50)
+    h = rng.uniform(low=1.0, high=10.0, size=50)
+    future = solverSWIG_DP.submit_optimize__DP(4, g, h)
+    future.result()
+    assert future._handle.get() == future._handle.get()
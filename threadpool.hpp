@@ -3,20 +3,44 @@
 
 #include <algorithm>
 #include <atomic>
+#include <chrono>
+#include <cmath>
+#include <condition_variable>
 #include <cstdint>
+#include <cstdlib>
+#include <exception>
+#include <fstream>
 #include <functional>
 #include <future>
 #include <iostream>
 #include <memory>
+#include <mutex>
+#include <stdexcept>
+#include <string>
 #include <thread>
 #include <type_traits>
 #include <utility>
 #include <vector>
 
+#ifdef __linux__
+#include <pthread.h>
+#include <sched.h>
+#endif
+
+#include "cancellation.hpp"
 #include "port_utils.hpp"
 #include "threadsafequeue.hpp"
+#include "threadpool_stats.hpp"
 
-class ThreadPool
+// QueuePolicy selects the ThreadsafeQueue used for jobs submitted from
+// outside the pool; LockFreeQueuePolicy bounds it, blocking submitters
+// while it is full.
+//
+// Telemetry (queue depth, wait and run times, worker utilisation, steals
+// and lock contention) is compiled in but off by default; when off it
+// costs one relaxed atomic load per submit and per job.
+template <typename QueuePolicy = LockingQueuePolicy>
+class BasicThreadPool
 {
 private:
   class IThreadTask
@@ -33,8 +57,35 @@ private:
      * Run the task.
      */
     virtual void execute() = 0;
+
+    // steady_clock time of submission in ns, 0 unless telemetry was on
+    std::int64_t m_enqueued = 0;
+  };
+
+  struct TaskRecord
+  {
+    std::int64_t m_enqueued;
+    std::int64_t m_start;
+    std::int64_t m_finish;
   };
 
+  // Written by the owning worker only; reset and stats() read it from other threads
+  struct alignas(64) WorkerTelemetry
+  {
+    std::atomic<std::uint64_t> m_tasks{0};
+    std::atomic<std::uint64_t> m_steals{0};
+    std::atomic<std::int64_t> m_busy{0};
+    std::atomic<std::int64_t> m_run{0};
+    std::atomic<std::int64_t> m_maxRun{0};
+    std::atomic<std::int64_t> m_wait{0};
+    std::atomic<std::int64_t> m_maxWait{0};
+    std::mutex m_traceMutex;
+    std::vector<TaskRecord> m_trace;
+    std::size_t m_traceNext = 0;
+  };
+
+  static constexpr std::size_t traceLength = 1024;
+
   template <typename Func>
   class ThreadTask: public IThreadTask
   {
@@ -66,13 +117,17 @@ public:
   /**
    * A wrapper around a std::future that adds the behavior of futures returned from std::async.
    * Specifically, this object will block and wait for execution to finish before going out of scope.
+   * When waited on from one of the pool's workers, the worker runs pending tasks in the
+   * meantime, so a task may wait on jobs it submitted itself without tying up a worker.
+   * Other threads simply block, leaving queued jobs queued (and cancellable).
    */
   template <typename T>
   class TaskFuture
   {
   public:
-    TaskFuture(std::future<T>&& future)
-      :m_future{std::move(future)}
+    TaskFuture(std::future<T>&& future, BasicThreadPool* pool = nullptr)
+      :m_future{std::move(future)},
+      m_pool{pool}
     {
     }
 
@@ -84,26 +139,60 @@ public:
     {
       if(m_future.valid())
 	{
+	  wait();
 	  m_future.get();
 	}
     }
 
     auto get(void) -> T
     {
+      wait();
       return m_future.get();
     }
 
+    /**
+     * Non-blocking check for a result; false once the result has been taken by get().
+     */
+    bool ready(void) const
+    {
+      return m_future.valid() && 
+	(m_future.wait_for(std::chrono::seconds(0)) == std::future_status::ready);
+    }
+
+    void wait(void) const
+    {
+      // A finished job may outlive its pool, don't touch m_pool then
+      if(!m_future.valid() || ready())
+	{
+	  return;
+	}
+      if((m_pool == nullptr) || !m_pool->isWorkerThread())
+	{
+	  m_future.wait();
+	  return;
+	}
+      while(m_future.valid() && !ready())
+	{
+	  if(!m_pool->runPendingTask())
+	    {
+	      // Nothing to help with, the job is running elsewhere
+	      m_future.wait_for(std::chrono::microseconds(100));
+	    }
+	}
+    }
+
 
   private:
     std::future<T> m_future;
+    BasicThreadPool* m_pool;
   };
 
 public:
   /**
    * Constructor.
    */
-  ThreadPool(void)
-    :ThreadPool{std::max(std::thread::hardware_concurrency(), 2u) - 1u}
+  BasicThreadPool(void)
+    :BasicThreadPool{std::max(std::thread::hardware_concurrency(), 2u) - 1u}
   {
     /*
      * Always create at least one thread.  If hardware_concurrency() returns 0,
@@ -115,16 +204,24 @@ public:
   /**
    * Constructor.
    */
-  explicit ThreadPool(const std::uint32_t numThreads)
+  explicit BasicThreadPool(const std::uint32_t numThreads)
     :m_done{false},
+    m_pending{0},
     m_workQueue{},
+    m_localQueues{},
     m_threads{}
   {
+    for(std::uint32_t i = 0u; i < numThreads; ++i)
+      {
+	m_localQueues.emplace_back(std::make_unique<WorkStealingQueue<std::unique_ptr<IThreadTask>>>());
+	m_workerTelemetry.emplace_back(std::make_unique<WorkerTelemetry>());
+      }
+    resetStats();
     try
       {
 	for(std::uint32_t i = 0u; i < numThreads; ++i)
 	  {
-	    m_threads.emplace_back(&ThreadPool::worker, this);
+	    m_threads.emplace_back(&BasicThreadPool::worker, this, i);
 	  }
       }
     catch(...)
@@ -137,23 +234,24 @@ public:
   /**
    * Non-copyable.
    */
-  ThreadPool(const ThreadPool& rhs) = delete;
+  BasicThreadPool(const BasicThreadPool& rhs) = delete;
 
   /**
    * Non-assignable.
    */
-  ThreadPool& operator=(const ThreadPool& rhs) = delete;
+  BasicThreadPool& operator=(const BasicThreadPool& rhs) = delete;
 
   /**
    * Destructor.
    */
-  ~ThreadPool(void)
+  ~BasicThreadPool(void)
   {
     destroy();
   }
 
   /**
-   * Submit a job to be run by the thread pool.
+   * Submit a job to be run by the thread pool. Jobs submitted from one of the pool's
+   * workers go to that worker's deque, others to the shared queue.
    */
   template <typename Func, typename... Args>
   auto submit(Func&& func, Args&&... args) -> TaskFuture<typename std::result_of<Func(Args...)>::type>
@@ -164,34 +262,461 @@ public:
     using TaskType = ThreadTask<PackagedTask>;
             
     PackagedTask task{std::move(boundTask)};
-    TaskFuture<ResultType> result{task.get_future()};
-    m_workQueue.push(std::make_unique<TaskType>(std::move(task)));
+    TaskFuture<ResultType> result{task.get_future(), this};
+    std::unique_ptr<IThreadTask> pTask = std::make_unique<TaskType>(std::move(task));
+    const bool telemetry = m_telemetry.load(std::memory_order_relaxed);
+    if(telemetry)
+      {
+	pTask->m_enqueued = nowNs();
+      }
+    if(tl_pool == this)
+      {
+	m_localQueues[tl_index]->push(std::move(pTask));
+      }
+    else
+      {
+	m_workQueue.push(std::move(pTask));
+      }
+    std::size_t depth;
+    {
+      std::lock_guard<std::mutex> lock{m_wakeMutex};
+      depth = ++m_pending;
+    }
+    m_wakeCondition.notify_one();
+    if(telemetry)
+      {
+	recordSubmit(depth);
+      }
     return result;
   }
 
+  /**
+   * Apply fn(i) to every i in [begin, end), in chunks of grain indices. A grain of 0
+   * picks one based on the number of workers. The calling thread runs the first chunk.
+   * Chunks not yet started when token expires are skipped.
+   */
+  template <typename Index, typename Func>
+  void parallel_for(Index begin, Index end, Index grain, Func&& fn, const CancellationToken* token = nullptr)
+  {
+    parallel_chunks(begin, end, grain, [&fn](Index b, Index e, std::size_t)
+		    {
+		      for(Index i = b; i < e; ++i)
+			{
+			  fn(i);
+			}
+		    }, token);
+  }
+
+  /**
+   * Fold map(i) over [begin, end) with combine. Each chunk is folded separately,
+   * then the chunk results are combined with init from left to right, so the
+   * result does not depend on scheduling. It depends on the chunking only
+   * through grain, pass an explicit grain for results independent of the
+   * number of workers. Chunks skipped because token expired contribute init.
+   */
+  template <typename Index, typename T, typename Map, typename Combine>
+  T parallel_reduce(Index begin, Index end, T init, Map&& map, Combine&& combine, Index grain = 0, const CancellationToken* token = nullptr)
+  {
+    if(end <= begin)
+      {
+	return init;
+      }
+    const Index chunkSize = chunk_size(begin, end, grain);
+    std::vector<T> partials(static_cast<std::size_t>((end - begin + chunkSize - 1) / chunkSize), init);
+    parallel_chunks(begin, end, chunkSize, [&](Index b, Index e, std::size_t chunk)
+		    {
+		      T acc = map(b);
+		      for(Index i = b + 1; i < e; ++i)
+			{
+			  acc = combine(std::move(acc), map(i));
+			}
+		      partials[chunk] = std::move(acc);
+		    }, token);
+    T result = std::move(init);
+    for(auto& partial : partials)
+      {
+	result = combine(std::move(result), std::move(partial));
+      }
+    return result;
+  }
+
+  /**
+   * Pin worker i to the i-th CPU the process may run on, round robin. Returns
+   * false if pinning is not supported or failed for some worker.
+   */
+  bool pinWorkers(void)
+  {
+#ifdef __linux__
+    cpu_set_t allowed;
+    CPU_ZERO(&allowed);
+    if(sched_getaffinity(0, sizeof(allowed), &allowed) != 0)
+      {
+	return false;
+      }
+    std::vector<int> cpus;
+    for(int cpu = 0; cpu < CPU_SETSIZE; ++cpu)
+      {
+	if(CPU_ISSET(cpu, &allowed))
+	  {
+	    cpus.push_back(cpu);
+	  }
+      }
+    if(cpus.empty())
+      {
+	return false;
+      }
+    bool ok = true;
+    for(std::size_t i = 0; i < m_threads.size(); ++i)
+      {
+	cpu_set_t cpuset;
+	CPU_ZERO(&cpuset);
+	CPU_SET(cpus[i % cpus.size()], &cpuset);
+	ok = (pthread_setaffinity_np(m_threads[i].native_handle(), sizeof(cpuset), &cpuset) == 0) && ok;
+      }
+    return ok;
+#else
+    return false;
+#endif
+  }
+
+  /**
+   * Number of worker threads.
+   */
+  std::size_t size(void) const
+  {
+    return m_threads.size();
+  }
+
+  /**
+   * True if called from one of this pool's worker threads.
+   */
+  bool isWorkerThread(void) const
+  {
+    return tl_pool == this;
+  }
+
+  /**
+   * Run one pending task on the calling thread, if there is one.
+   */
+  bool runPendingTask(void)
+  {
+    std::unique_ptr<IThreadTask> pTask{nullptr};
+    bool stolen = false;
+    if(!popTask(pTask, stolen))
+      {
+	return false;
+      }
+    if(!m_telemetry.load(std::memory_order_relaxed) || (tl_pool != this))
+      {
+	pTask->execute();
+	return true;
+      }
+    // Jobs run while waiting inside another job count towards its busy time only
+    const bool outermost = (tl_nesting++ == 0);
+    const std::int64_t start = nowNs();
+    pTask->execute();
+    const std::int64_t finish = nowNs();
+    --tl_nesting;
+    recordTask(*pTask, stolen, outermost, start, finish);
+    return true;
+  }
+
+  /**
+   * Turn telemetry on or off. Turning it on resets the statistics.
+   */
+  void setTelemetry(bool enabled)
+  {
+    if(enabled && !m_telemetry.load())
+      {
+	resetStats();
+      }
+    m_telemetry.store(enabled);
+  }
+
+  bool telemetryEnabled(void) const
+  {
+    return m_telemetry.load();
+  }
+
+  /**
+   * Zero the statistics and restart the clock they are measured against.
+   */
+  void resetStats(void)
+  {
+    m_submitted.store(0);
+    m_depthSum.store(0);
+    m_maxDepth.store(0);
+    std::uint64_t contentions = m_workQueue.contentions();
+    for(std::size_t i = 0; i < m_workerTelemetry.size(); ++i)
+      {
+	WorkerTelemetry& t = *m_workerTelemetry[i];
+	t.m_tasks.store(0);
+	t.m_steals.store(0);
+	t.m_busy.store(0);
+	t.m_run.store(0);
+	t.m_maxRun.store(0);
+	t.m_wait.store(0);
+	t.m_maxWait.store(0);
+	{
+	  std::lock_guard<std::mutex> lock{t.m_traceMutex};
+	  t.m_trace.clear();
+	  t.m_traceNext = 0;
+	}
+	contentions += m_localQueues[i]->contentions();
+      }
+    m_contentionBase.store(contentions);
+    m_epoch.store(nowNs());
+  }
+
+  /**
+   * Snapshot of the statistics since the last reset. A job is accounted for
+   * just after its future becomes ready, so the counts may briefly lag.
+   */
+  ThreadPoolStats stats(void) const
+  {
+    const std::int64_t epoch = m_epoch.load();
+    const double elapsed = std::max(nowNs() - epoch, std::int64_t{1}) * 1e-9;
+    const std::uint64_t submitted = m_submitted.load();
+
+    ThreadPoolStats st{};
+    st.enabled = m_telemetry.load();
+    st.elapsed = elapsed;
+    st.tasks_submitted = static_cast<long long>(submitted);
+    // m_pending may briefly dip below zero while a job is popped before it is counted
+    st.queue_depth = std::max(static_cast<long long>(static_cast<std::int64_t>(m_pending.load())), 0LL);
+    st.max_queue_depth = static_cast<long long>(m_maxDepth.load());
+    st.mean_queue_depth = submitted ? static_cast<double>(m_depthSum.load()) / submitted : 0.;
+
+    std::uint64_t contentions = m_workQueue.contentions();
+    std::int64_t maxWait = 0, maxRun = 0, wait = 0, run = 0;
+    std::vector<std::pair<int, TaskRecord>> trace;
+    for(std::size_t i = 0; i < m_workerTelemetry.size(); ++i)
+      {
+	WorkerTelemetry& t = *m_workerTelemetry[i];
+	const std::uint64_t tasks = t.m_tasks.load(), steals = t.m_steals.load();
+	st.tasks_completed += static_cast<long long>(tasks);
+	st.steals += static_cast<long long>(steals);
+	st.worker_tasks.push_back(static_cast<long long>(tasks));
+	st.worker_steals.push_back(static_cast<long long>(steals));
+	st.worker_busy_ratio.push_back(std::min(t.m_busy.load() * 1e-9 / elapsed, 1.));
+	wait += t.m_wait.load();
+	run += t.m_run.load();
+	maxWait = std::max(maxWait, t.m_maxWait.load());
+	maxRun = std::max(maxRun, t.m_maxRun.load());
+	contentions += m_localQueues[i]->contentions();
+
+	std::lock_guard<std::mutex> lock{t.m_traceMutex};
+	const std::size_t n = t.m_trace.size();
+	for(std::size_t j = 0; j < n; ++j)
+	  {
+	    // Oldest first
+	    const TaskRecord& r = t.m_trace[(t.m_traceNext + j) % n];
+	    st.trace_worker.push_back(static_cast<int>(i));
+	    st.trace_enqueue.push_back(r.m_enqueued ? (r.m_enqueued - epoch) * 1e-9 : (r.m_start - epoch) * 1e-9);
+	    st.trace_start.push_back((r.m_start - epoch) * 1e-9);
+	    st.trace_finish.push_back((r.m_finish - epoch) * 1e-9);
+	  }
+      }
+    st.total_wait_time = wait * 1e-9;
+    st.total_run_time = run * 1e-9;
+    st.max_wait_time = maxWait * 1e-9;
+    st.max_run_time = maxRun * 1e-9;
+    st.lock_contentions = static_cast<long long>(contentions - m_contentionBase.load());
+    return st;
+  }
+
 private:
+  template <typename Index>
+  Index chunk_size(Index begin, Index end, Index grain) const
+  {
+    if(grain > 0)
+      {
+	return grain;
+      }
+    // A few chunks per thread, counting the caller, to even out the load
+    const Index numChunks = static_cast<Index>(4 * (m_threads.size() + 1));
+    return std::max(static_cast<Index>(1), static_cast<Index>((end - begin + numChunks - 1) / numChunks));
+  }
+
+  /**
+   * Run fn(b, e, chunk) over consecutive chunks of [begin, end). All chunks are
+   * finished before returning; the first exception thrown, if any, is rethrown.
+   * Once token expires, chunks that have not started are skipped.
+   */
+  template <typename Index, typename Func>
+  void parallel_chunks(Index begin, Index end, Index grain, Func&& fn, const CancellationToken* token = nullptr)
+  {
+    if(end <= begin)
+      {
+	return;
+      }
+    const Index chunkSize = chunk_size(begin, end, grain);
+
+    std::vector<TaskFuture<void>> v;
+    std::size_t chunk = 1;
+    for(Index b = begin + chunkSize; b < end; b += chunkSize, ++chunk)
+      {
+	const Index e = std::min(end, static_cast<Index>(b + chunkSize));
+	v.push_back(submit([&fn, token](Index b, Index e, std::size_t chunk)
+			   {
+			     if((token == nullptr) || !token->expired())
+			       {
+				 fn(b, e, chunk);
+			       }
+			   }, b, e, chunk));
+      }
+
+    std::exception_ptr err;
+    try
+      {
+	if((token == nullptr) || !token->expired())
+	  {
+	    fn(begin, std::min(end, static_cast<Index>(begin + chunkSize)), std::size_t{0});
+	  }
+      }
+    catch(...)
+      {
+	err = std::current_exception();
+      }
+    // Chunks reference the caller's state, finish all of them before rethrowing
+    for(auto& item : v)
+      {
+	try
+	  {
+	    item.get();
+	  }
+	catch(...)
+	  {
+	    if(!err)
+	      {
+		err = std::current_exception();
+	      }
+	  }
+      }
+    if(err)
+      {
+	std::rethrow_exception(err);
+      }
+  }
+
   /**
-   * Constantly running function each thread uses to acquire work items from the queue.
+   * Own deque first, then the shared queue, then steal from the other workers.
    */
-  void worker(void)
+  bool popTask(std::unique_ptr<IThreadTask>& pTask, bool& stolen)
   {
-    while(!m_done)
+    const std::size_t numQueues = m_localQueues.size();
+    const bool isWorker = (tl_pool == this);
+    bool found = (isWorker && m_localQueues[tl_index]->tryPop(pTask)) || m_workQueue.tryPop(pTask);
+
+    const std::size_t start = isWorker ? tl_index + 1 : 0;
+    for(std::size_t i = 0; !found && (i < numQueues); ++i)
       {
-	std::unique_ptr<IThreadTask> pTask{nullptr};
-	if(m_workQueue.waitPop(pTask))
+	const std::size_t victim = (start + i) % numQueues;
+	if(!(isWorker && (victim == tl_index)))
 	  {
-	    pTask->execute();
+	    found = stolen = m_localQueues[victim]->trySteal(pTask);
 	  }
       }
+
+    if(found)
+      {
+	--m_pending;
+      }
+    return found;
+  }
+
+  static std::int64_t nowNs(void)
+  {
+    return std::chrono::duration_cast<std::chrono::nanoseconds>(std::chrono::steady_clock::now().time_since_epoch()).count();
+  }
+
+  template <typename T>
+  static void updateMax(std::atomic<T>& current, T value)
+  {
+    T prev = current.load(std::memory_order_relaxed);
+    while((value > prev) && !current.compare_exchange_weak(prev, value, std::memory_order_relaxed))
+      {
+      }
+  }
+
+  void recordSubmit(std::size_t depth)
+  {
+    m_submitted.fetch_add(1, std::memory_order_relaxed);
+    m_depthSum.fetch_add(depth, std::memory_order_relaxed);
+    updateMax(m_maxDepth, static_cast<std::uint64_t>(depth));
+  }
+
+  void recordTask(const IThreadTask& task, bool stolen, bool outermost, std::int64_t start, std::int64_t finish)
+  {
+    WorkerTelemetry& t = *m_workerTelemetry[tl_index];
+    const std::int64_t run = finish - start;
+    t.m_tasks.fetch_add(1, std::memory_order_relaxed);
+    if(stolen)
+      {
+	t.m_steals.fetch_add(1, std::memory_order_relaxed);
+      }
+    if(outermost)
+      {
+	t.m_busy.fetch_add(run, std::memory_order_relaxed);
+      }
+    t.m_run.fetch_add(run, std::memory_order_relaxed);
+    updateMax(t.m_maxRun, run);
+    if(task.m_enqueued > 0)
+      {
+	const std::int64_t wait = start - task.m_enqueued;
+	t.m_wait.fetch_add(wait, std::memory_order_relaxed);
+	updateMax(t.m_maxWait, wait);
+      }
+
+    std::lock_guard<std::mutex> lock{t.m_traceMutex};
+    const TaskRecord record{task.m_enqueued, start, finish};
+    if(t.m_trace.size() < traceLength)
+      {
+	t.m_trace.push_back(record);
+      }
+    else
+      {
+	t.m_trace[t.m_traceNext] = record;
+      }
+    t.m_traceNext = (t.m_traceNext + 1) % traceLength;
   }
 
   /**
-   * Invalidates the queue and joins all running threads.
+   * Constantly running function each thread uses to acquire work items from the queues.
+   */
+  void worker(std::size_t index)
+  {
+    tl_pool = this;
+    tl_index = index;
+    for(;;)
+      {
+	if(runPendingTask())
+	  {
+	    continue;
+	  }
+	// Queued jobs are still run after shutdown is requested
+	if(m_done && (m_pending == 0))
+	  {
+	    break;
+	  }
+	std::unique_lock<std::mutex> lock{m_wakeMutex};
+	m_wakeCondition.wait(lock, [this]()
+			     {
+			       return (m_pending > 0) || m_done;
+			     });
+      }
+  }
+
+  /**
+   * Lets the workers drain the queues, joins them and invalidates the queue.
    */
   void destroy(void)
   {
-    m_done = true;
-    m_workQueue.invalidate();
+    {
+      std::lock_guard<std::mutex> lock{m_wakeMutex};
+      m_done = true;
+    }
+    m_wakeCondition.notify_all();
     for(auto& thread : m_threads)
       {
 	if(thread.joinable())
@@ -199,24 +724,259 @@ private:
 	    thread.join();
 	  }
       }
+    m_workQueue.invalidate();
   }
 
 private:
   std::atomic_bool m_done;
-  ThreadsafeQueue<std::unique_ptr<IThreadTask>> m_workQueue;
+  std::atomic<std::size_t> m_pending;
+  std::mutex m_wakeMutex;
+  std::condition_variable m_wakeCondition;
+  ThreadsafeQueue<std::unique_ptr<IThreadTask>, QueuePolicy> m_workQueue;
+  std::vector<std::unique_ptr<WorkStealingQueue<std::unique_ptr<IThreadTask>>>> m_localQueues;
   std::vector<std::thread> m_threads;
+
+  // Telemetry, see stats()
+  std::atomic_bool m_telemetry{false};
+  std::atomic<std::int64_t> m_epoch{0};
+  std::vector<std::unique_ptr<WorkerTelemetry>> m_workerTelemetry;
+  alignas(64) std::atomic<std::uint64_t> m_submitted{0};
+  std::atomic<std::uint64_t> m_depthSum{0};
+  std::atomic<std::uint64_t> m_maxDepth{0};
+  std::atomic<std::uint64_t> m_contentionBase{0};
+
+  // Pool and deque index of the calling thread, if it is a worker, and how
+  // many jobs it is running inside one another
+  static thread_local BasicThreadPool* tl_pool;
+  static thread_local std::size_t tl_index;
+  static thread_local int tl_nesting;
 };
 
+// Defined out of class, inline static members need C++17
+template <typename QueuePolicy>
+thread_local BasicThreadPool<QueuePolicy>* BasicThreadPool<QueuePolicy>::tl_pool = nullptr;
+template <typename QueuePolicy>
+thread_local std::size_t BasicThreadPool<QueuePolicy>::tl_index = 0;
+template <typename QueuePolicy>
+thread_local int BasicThreadPool<QueuePolicy>::tl_nesting = 0;
+
+using ThreadPool = BasicThreadPool<>;
+
 namespace DefaultThreadPool
 {
+  namespace detail
+  {
+    // Number of CPUs the process can use: hardware threads, restricted by the
+    // affinity mask and by a cgroup (v1 or v2) CPU quota, as set by container
+    // runtimes
+    inline unsigned availableCPUs(void)
+    {
+      unsigned cpus = std::max(std::thread::hardware_concurrency(), 1u);
+#ifdef __linux__
+      cpu_set_t allowed;
+      CPU_ZERO(&allowed);
+      if(sched_getaffinity(0, sizeof(allowed), &allowed) == 0)
+	{
+	  cpus = std::min(cpus, static_cast<unsigned>(std::max(CPU_COUNT(&allowed), 1)));
+	}
+
+      double quota = -1., period = -1.;
+      std::ifstream cpuMax{"/sys/fs/cgroup/cpu.max"};
+      std::string quotaStr;
+      if(cpuMax >> quotaStr >> period)
+	{
+	  quota = (quotaStr == "max") ? -1. : std::atof(quotaStr.c_str());
+	}
+      else
+	{
+	  std::ifstream cfsQuota{"/sys/fs/cgroup/cpu/cpu.cfs_quota_us"};
+	  std::ifstream cfsPeriod{"/sys/fs/cgroup/cpu/cpu.cfs_period_us"};
+	  if(!(cfsQuota >> quota) || !(cfsPeriod >> period))
+	    {
+	      quota = -1.;
+	    }
+	}
+      if((quota > 0.) && (period > 0.))
+	{
+	  cpus = std::min(cpus, static_cast<unsigned>(std::max(std::ceil(quota/period), 1.)));
+	}
+#endif
+      return cpus;
+    }
+
+    // Pool size used when none has been set: PROTO_NUM_THREADS if given,
+    // otherwise one less than the available CPUs, but at least one
+    inline std::uint32_t defaultNumThreads(void)
+    {
+      if(const char* env = std::getenv("PROTO_NUM_THREADS"))
+	{
+	  const int n = std::atoi(env);
+	  if(n > 0)
+	    {
+	      return static_cast<std::uint32_t>(n);
+	    }
+	}
+      return std::max(availableCPUs(), 2u) - 1u;
+    }
+
+    inline bool defaultPinThreads(void)
+    {
+      const char* env = std::getenv("PROTO_PIN_THREADS");
+      return (env != nullptr) && (std::atoi(env) != 0);
+    }
+
+    struct PoolState
+    {
+      std::mutex m_mutex;
+      std::shared_ptr<ThreadPool> m_pool;
+      std::uint32_t m_numThreads = 0;
+      bool m_pin = defaultPinThreads();
+      bool m_telemetry = false;
+    };
+
+    inline PoolState& poolState(void)
+    {
+      static PoolState state;
+#ifdef __linux__
+      // A forked child has none of the parent's worker threads. It gets a
+      // fresh pool on first use; the parent's is leaked, not destroyed, as
+      // its threads cannot be joined from the child.
+      static std::once_flag atfork;
+      std::call_once(atfork, []()
+		     {
+		       pthread_atfork([]() { poolState().m_mutex.lock(); },
+				      []() { poolState().m_mutex.unlock(); },
+				      []()
+				      {
+					PoolState& st = poolState();
+					new std::shared_ptr<ThreadPool>(std::move(st.m_pool));
+					st.m_mutex.unlock();
+				      });
+		     });
+#endif
+      return state;
+    }
+
+    inline std::shared_ptr<ThreadPool> replacePool(std::shared_ptr<ThreadPool> pool)
+    {
+      PoolState& st = poolState();
+      std::lock_guard<std::mutex> lock{st.m_mutex};
+      if(st.m_pool && st.m_pool->isWorkerThread())
+	{
+	  throw std::logic_error("the default thread pool cannot be replaced from one of its own jobs");
+	}
+      std::swap(st.m_pool, pool);
+      return pool;
+    }
+  }
+
+  /**
+   * The default thread pool, created on first use with set_num_threads() threads,
+   * or detail::defaultNumThreads() if that was never called. Holding the returned
+   * pointer keeps the pool alive across set_num_threads() and shutdown().
+   * Initialization is thread-safe, and submit() only touches the locked work
+   * queues, so jobs may be submitted from several threads at once (e.g. python
+   * threads calling the solvers without the GIL).
+   */
+  inline std::shared_ptr<ThreadPool> sharedThreadPool(void)
+  {
+    detail::PoolState& st = detail::poolState();
+    std::lock_guard<std::mutex> lock{st.m_mutex};
+    if(!st.m_pool)
+      {
+	st.m_pool = std::make_shared<ThreadPool>(st.m_numThreads ? st.m_numThreads : detail::defaultNumThreads());
+	if(st.m_pin)
+	  {
+	    st.m_pool->pinWorkers();
+	  }
+	st.m_pool->setTelemetry(st.m_telemetry);
+      }
+    return st.m_pool;
+  }
+
   /**
-   * Get the default thread pool for the application.
-   * This pool is created with std::thread::hardware_concurrency() - 1 threads.
+   * Get the default thread pool for the application. The reference is only valid
+   * until the next set_num_threads() or shutdown(), use sharedThreadPool() to
+   * hold on to it.
    */
   inline ThreadPool& getThreadPool(void)
   {
-    static ThreadPool defaultPool;
-    return defaultPool;
+    return *sharedThreadPool();
+  }
+
+  /**
+   * Replace the default pool with one of numThreads workers, 0 restores the
+   * default size. Jobs already queued on the old pool still run; this waits
+   * for them unless something else holds the old pool.
+   */
+  inline void set_num_threads(std::uint32_t numThreads)
+  {
+    detail::PoolState& st = detail::poolState();
+    {
+      std::lock_guard<std::mutex> lock{st.m_mutex};
+      st.m_numThreads = numThreads;
+    }
+    auto pool = std::make_shared<ThreadPool>(numThreads ? numThreads : detail::defaultNumThreads());
+    if(st.m_pin)
+      {
+	pool->pinWorkers();
+      }
+    pool->setTelemetry(st.m_telemetry);
+    detail::replacePool(std::move(pool));
+  }
+
+  inline std::size_t get_num_threads(void)
+  {
+    return sharedThreadPool()->size();
+  }
+
+  /**
+   * Pin the workers of the current and future default pools to CPUs, or stop
+   * doing so for future pools. Returns false if pinning is not supported.
+   */
+  inline bool set_thread_affinity(bool pin)
+  {
+    detail::PoolState& st = detail::poolState();
+    {
+      std::lock_guard<std::mutex> lock{st.m_mutex};
+      st.m_pin = pin;
+    }
+    return pin ? sharedThreadPool()->pinWorkers() : true;
+  }
+
+  /**
+   * Finish queued jobs and stop the workers of the default pool. A new pool is
+   * created on next use.
+   */
+  inline void shutdown(void)
+  {
+    detail::replacePool(nullptr);
+  }
+
+  /**
+   * Turn telemetry on or off for the current and future default pools.
+   */
+  inline void set_telemetry(bool enabled)
+  {
+    detail::PoolState& st = detail::poolState();
+    {
+      std::lock_guard<std::mutex> lock{st.m_mutex};
+      st.m_telemetry = enabled;
+    }
+    sharedThreadPool()->setTelemetry(enabled);
+  }
+
+  /**
+   * Telemetry of the current default pool, see ThreadPoolStats.
+   */
+  inline ThreadPoolStats telemetry_stats(void)
+  {
+    return sharedThreadPool()->stats();
+  }
+
+  inline void reset_telemetry(void)
+  {
+    sharedThreadPool()->resetStats();
   }
 
   /**
@@ -225,7 +985,25 @@ namespace DefaultThreadPool
   template<typename Func, typename... Args>
   inline auto submitJob(Func&& func, Args&&... args) -> ThreadPool::TaskFuture<typename std::result_of<Func(Args...)>::type>
   {
-    return getThreadPool().submit(std::forward<Func>(func), std::forward<Args>(args)...);
+    return sharedThreadPool()->submit(std::forward<Func>(func), std::forward<Args>(args)...);
+  }
+
+  /**
+   * parallel_for on the default thread pool.
+   */
+  template <typename Index, typename Func>
+  inline void parallel_for(Index begin, Index end, Index grain, Func&& fn, const CancellationToken* token = nullptr)
+  {
+    sharedThreadPool()->parallel_for(begin, end, grain, std::forward<Func>(fn), token);
+  }
+
+  /**
+   * parallel_reduce on the default thread pool.
+   */
+  template <typename Index, typename T, typename Map, typename Combine>
+  inline T parallel_reduce(Index begin, Index end, T init, Map&& map, Combine&& combine, Index grain = 0, const CancellationToken* token = nullptr)
+  {
+    return sharedThreadPool()->parallel_reduce(begin, end, std::move(init), std::forward<Map>(map), std::forward<Combine>(combine), grain, token);
   }
 }
 
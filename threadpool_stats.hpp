@@ -0,0 +1,40 @@
+#ifndef __THREADPOOL_STATS_HPP__
+#define __THREADPOOL_STATS_HPP__
+
+#include <vector>
+
+//
+// Snapshot of thread pool telemetry since it was last reset (or
+// enabled). Times are in seconds. Wait time runs from submit to the start
+// of the job, run time from start to finish. Queue depth is the number
+// of jobs queued but not yet started, sampled at each submit. Busy ratio
+// is the fraction of the elapsed time a worker spent running jobs.
+//
+// The trace_* vectors hold the most recent jobs run by each worker,
+// grouped by worker, with timestamps relative to the reset.
+//
+
+struct ThreadPoolStats {
+  bool enabled;
+  double elapsed;
+  long long tasks_submitted;
+  long long tasks_completed;
+  long long steals;
+  long long lock_contentions;
+  long long queue_depth;
+  long long max_queue_depth;
+  double mean_queue_depth;
+  double total_wait_time;
+  double max_wait_time;
+  double total_run_time;
+  double max_run_time;
+  std::vector<double> worker_busy_ratio;
+  std::vector<long long> worker_tasks;
+  std::vector<long long> worker_steals;
+  std::vector<int> trace_worker;
+  std::vector<double> trace_enqueue;
+  std::vector<double> trace_start;
+  std::vector<double> trace_finish;
+};
+
+#endif
@@ -3,17 +3,33 @@
 
 #include <atomic>
 #include <condition_variable>
+#include <cstddef>
+#include <cstdint>
+#include <deque>
+#include <memory>
 #include <mutex>
 #include <queue>
+#include <thread>
 #include <utility>
 
 
+// Storage policies for ThreadsafeQueue. LockingQueuePolicy is an
+// unbounded std::queue behind a mutex; LockFreeQueuePolicy is a bounded
+// ring buffer where push and pop are lock-free, push blocks while the
+// queue is full and waitPop sleeps while it is empty.
+//
+// contentions() counts lock acquisitions that had to wait (failed CAS
+// attempts for the lock-free queue); it is always on, as it costs nothing
+// unless the queue is actually contended.
+struct LockingQueuePolicy {};
+struct LockFreeQueuePolicy {};
+
 //
 // Modified version of
 // http://roar11.com/2016/01/a-platform-independent-thread-pool-using-c14/
 //
  
-template<typename T>
+template<typename T, typename Policy=LockingQueuePolicy>
 class ThreadsafeQueue {
 
 public:
@@ -23,7 +39,8 @@ public:
   bool waitPop(T&);
   void push(T);
   bool empty() const;
-  bool size() const;
+  std::size_t size() const;
+  std::uint64_t contentions() const;
   void clear();
   void invalidate();
   bool isValid() const;
@@ -31,9 +48,92 @@ public:
 private:
   std::atomic_bool m_valid{true};
   mutable std::mutex m_mutex;
+  mutable std::atomic<std::uint64_t> m_contentions{0};
   std::queue<T> m_queue;
   std::condition_variable m_condition;
 
+  std::unique_lock<std::mutex> lock_() const;
+
+};
+
+//
+// Bounded multi-producer multi-consumer ring buffer after D. Vyukov. Each
+// cell carries a sequence number telling producers and consumers whether
+// it is free or filled for the current lap, so the fast paths are a CAS
+// on the enqueue or dequeue position. Capacity is rounded up to a power
+// of 2.
+//
+
+template<typename T>
+class ThreadsafeQueue<T, LockFreeQueuePolicy> {
+
+public:
+  explicit ThreadsafeQueue(std::size_t capacity=4096);
+  ~ThreadsafeQueue();
+
+  bool tryPush(T&);
+  bool tryPop(T&);
+  bool waitPop(T&);
+  void push(T);
+  bool empty() const;
+  std::size_t size() const;
+  std::size_t capacity() const;
+  std::uint64_t contentions() const;
+  void clear();
+  void invalidate();
+  bool isValid() const;
+
+private:
+  struct Cell {
+    std::atomic<std::size_t> m_sequence;
+    T m_data;
+  };
+
+  static constexpr std::size_t cacheLine = 64;
+
+  std::size_t m_mask;
+  std::unique_ptr<Cell[]> m_buffer;
+  alignas(cacheLine) std::atomic<std::size_t> m_enqueuePos{0};
+  alignas(cacheLine) std::atomic<std::size_t> m_dequeuePos{0};
+  std::atomic<std::uint64_t> m_contentions{0};
+
+  // Only used to sleep when empty (consumers) or full (producers)
+  alignas(cacheLine) std::atomic_bool m_valid{true};
+  std::atomic<int> m_waitingConsumers{0};
+  std::atomic<int> m_waitingProducers{0};
+  mutable std::mutex m_mutex;
+  std::condition_variable m_notEmpty;
+  std::condition_variable m_notFull;
+
+  template<typename Pred>
+  void sleepUntil_(std::condition_variable&, std::atomic<int>&, Pred);
+  void wake_(std::condition_variable&, std::atomic<int>&);
+};
+
+//
+// Per-worker deque for a work-stealing pool. The owning thread pushes
+// and pops at the back (LIFO, cache-warm), other threads steal from the
+// front. Each deque has its own lock, so contention is limited to the
+// owner and the occasional thief.
+//
+
+template<typename T>
+class WorkStealingQueue {
+
+public:
+  void push(T);
+  bool tryPop(T&);
+  bool trySteal(T&);
+  bool empty() const;
+  std::uint64_t contentions() const;
+
+private:
+  mutable std::mutex m_mutex;
+  mutable std::atomic<std::uint64_t> m_contentions{0};
+  std::deque<T> m_queue;
+
+  std::unique_lock<std::mutex> lock_() const;
+
 };
 
 #include "threadsafequeue_impl.hpp"
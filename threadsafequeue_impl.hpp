@@ -1,15 +1,17 @@
 #ifndef __THREADSAFEQUEUE_IMPL_HPP__
 #define __THREADSAFEQUEUE_IMPL_HPP__
 
-template<typename T>
-ThreadsafeQueue<T>::~ThreadsafeQueue() {
+#include <algorithm>
+
+template<typename T, typename Policy>
+ThreadsafeQueue<T, Policy>::~ThreadsafeQueue() {
   invalidate();
 }
 
-template<typename T>
+template<typename T, typename Policy>
 bool
-ThreadsafeQueue<T>::tryPop(T& out) {
-  std::lock_guard<std::mutex> lock{m_mutex};
+ThreadsafeQueue<T, Policy>::tryPop(T& out) {
+  auto lock = lock_();
   if(m_queue.empty() || !m_valid)
     {
       return false;
@@ -19,10 +21,10 @@ ThreadsafeQueue<T>::tryPop(T& out) {
   return true;
 }
 
-template<typename T>
+template<typename T, typename Policy>
 bool
-ThreadsafeQueue<T>::waitPop(T& out) {
-  std::unique_lock<std::mutex> lock{m_mutex};
+ThreadsafeQueue<T, Policy>::waitPop(T& out) {
+  auto lock = lock_();
   m_condition.wait(lock, [this]()
 		   {
 		     return !m_queue.empty() || !m_valid;
@@ -40,31 +42,37 @@ ThreadsafeQueue<T>::waitPop(T& out) {
     return true;
 }
 
-template<typename T>
+template<typename T, typename Policy>
 void
-ThreadsafeQueue<T>::push(T value) {
-  std::lock_guard<std::mutex> lock{m_mutex};
+ThreadsafeQueue<T, Policy>::push(T value) {
+  auto lock = lock_();
   m_queue.push(std::move(value));
   m_condition.notify_one();
 }
 
-template<typename T>
-bool
-ThreadsafeQueue<T>::size(void) const {
+template<typename T, typename Policy>
+std::size_t
+ThreadsafeQueue<T, Policy>::size(void) const {
   std::lock_guard<std::mutex> lock{m_mutex};
   return m_queue.size();
 }
 
-template<typename T>
+template<typename T, typename Policy>
+std::uint64_t
+ThreadsafeQueue<T, Policy>::contentions(void) const {
+  return m_contentions.load(std::memory_order_relaxed);
+}
+
+template<typename T, typename Policy>
 bool
-ThreadsafeQueue<T>::empty(void) const {
+ThreadsafeQueue<T, Policy>::empty(void) const {
   std::lock_guard<std::mutex> lock{m_mutex};
   return m_queue.empty();
 }
 
-template<typename T>
+template<typename T, typename Policy>
 void
-ThreadsafeQueue<T>::clear(void) {
+ThreadsafeQueue<T, Policy>::clear(void) {
   std::lock_guard<std::mutex> lock{m_mutex};
   while(!m_queue.empty())
     {
@@ -73,19 +81,268 @@ ThreadsafeQueue<T>::clear(void) {
   m_condition.notify_all();
 }
 
-template<typename T>
+template<typename T, typename Policy>
 void
-ThreadsafeQueue<T>::invalidate(void) {
+ThreadsafeQueue<T, Policy>::invalidate(void) {
   std::lock_guard<std::mutex> lock{m_mutex};
   m_valid = false;
   m_condition.notify_all();
 }
 
-template<typename T>
+template<typename T, typename Policy>
 bool
-ThreadsafeQueue<T>::isValid(void) const {
+ThreadsafeQueue<T, Policy>::isValid(void) const {
   std::lock_guard<std::mutex> lock{m_mutex};
   return m_valid;
 }
 
+template<typename T, typename Policy>
+std::unique_lock<std::mutex>
+ThreadsafeQueue<T, Policy>::lock_(void) const {
+  std::unique_lock<std::mutex> lock{m_mutex, std::try_to_lock};
+  if(!lock.owns_lock())
+    {
+      m_contentions.fetch_add(1, std::memory_order_relaxed);
+      lock.lock();
+    }
+  return lock;
+}
+
+template<typename T>
+ThreadsafeQueue<T, LockFreeQueuePolicy>::ThreadsafeQueue(std::size_t capacity) {
+  std::size_t size = 2;
+  while (size < capacity)
+    size <<= 1;
+  m_mask = size - 1;
+  m_buffer.reset(new Cell[size]);
+  for (std::size_t i=0; i<size; ++i)
+    m_buffer[i].m_sequence.store(i, std::memory_order_relaxed);
+}
+
+template<typename T>
+ThreadsafeQueue<T, LockFreeQueuePolicy>::~ThreadsafeQueue() {
+  invalidate();
+}
+
+template<typename T>
+bool
+ThreadsafeQueue<T, LockFreeQueuePolicy>::tryPush(T& value) {
+  // Moves from value only on success
+  Cell *cell;
+  std::size_t pos = m_enqueuePos.load(std::memory_order_relaxed);
+  for (;;) {
+    cell = &m_buffer[pos & m_mask];
+    std::size_t seq = cell->m_sequence.load(std::memory_order_acquire);
+    std::intptr_t dif = static_cast<std::intptr_t>(seq) - static_cast<std::intptr_t>(pos);
+    if (dif == 0) {
+      if (m_enqueuePos.compare_exchange_weak(pos, pos+1, std::memory_order_relaxed))
+	break;
+      m_contentions.fetch_add(1, std::memory_order_relaxed);
+    }
+    else if (dif < 0) {
+      return false;
+    }
+    else {
+      pos = m_enqueuePos.load(std::memory_order_relaxed);
+    }
+  }
+  cell->m_data = std::move(value);
+  cell->m_sequence.store(pos+1, std::memory_order_release);
+  wake_(m_notEmpty, m_waitingConsumers);
+  return true;
+}
+
+template<typename T>
+bool
+ThreadsafeQueue<T, LockFreeQueuePolicy>::tryPop(T& out) {
+  if (!m_valid)
+    return false;
+
+  Cell *cell;
+  std::size_t pos = m_dequeuePos.load(std::memory_order_relaxed);
+  for (;;) {
+    cell = &m_buffer[pos & m_mask];
+    std::size_t seq = cell->m_sequence.load(std::memory_order_acquire);
+    std::intptr_t dif = static_cast<std::intptr_t>(seq) - static_cast<std::intptr_t>(pos+1);
+    if (dif == 0) {
+      if (m_dequeuePos.compare_exchange_weak(pos, pos+1, std::memory_order_relaxed))
+	break;
+      m_contentions.fetch_add(1, std::memory_order_relaxed);
+    }
+    else if (dif < 0) {
+      return false;
+    }
+    else {
+      pos = m_dequeuePos.load(std::memory_order_relaxed);
+    }
+  }
+  out = std::move(cell->m_data);
+  cell->m_sequence.store(pos+m_mask+1, std::memory_order_release);
+  wake_(m_notFull, m_waitingProducers);
+  return true;
+}
+
+template<typename T>
+bool
+ThreadsafeQueue<T, LockFreeQueuePolicy>::waitPop(T& out) {
+  while (!tryPop(out)) {
+    if (!m_valid)
+      return false;
+    sleepUntil_(m_notEmpty, m_waitingConsumers, [this]() { return !empty() || !m_valid; });
+  }
+  return true;
+}
+
+template<typename T>
+void
+ThreadsafeQueue<T, LockFreeQueuePolicy>::push(T value) {
+  // Backpressure: block while full. Dropped if the queue is invalidated
+  // in the meantime.
+  while (!tryPush(value)) {
+    if (!m_valid)
+      return;
+    sleepUntil_(m_notFull, m_waitingProducers, [this]() { return (size() <= m_mask) || !m_valid; });
+  }
+}
+
+template<typename T>
+std::size_t
+ThreadsafeQueue<T, LockFreeQueuePolicy>::size(void) const {
+  // Exact when quiescent, a snapshot otherwise
+  std::size_t dequeuePos = m_dequeuePos.load(std::memory_order_acquire);
+  std::size_t enqueuePos = m_enqueuePos.load(std::memory_order_acquire);
+  return (enqueuePos > dequeuePos) ? std::min(enqueuePos - dequeuePos, m_mask + 1) : 0;
+}
+
+template<typename T>
+std::size_t
+ThreadsafeQueue<T, LockFreeQueuePolicy>::capacity(void) const {
+  return m_mask + 1;
+}
+
+template<typename T>
+std::uint64_t
+ThreadsafeQueue<T, LockFreeQueuePolicy>::contentions(void) const {
+  return m_contentions.load(std::memory_order_relaxed);
+}
+
+template<typename T>
+bool
+ThreadsafeQueue<T, LockFreeQueuePolicy>::empty(void) const {
+  return size() == 0;
+}
+
+template<typename T>
+void
+ThreadsafeQueue<T, LockFreeQueuePolicy>::clear(void) {
+  T value;
+  while (tryPop(value))
+    ;
+}
+
+template<typename T>
+void
+ThreadsafeQueue<T, LockFreeQueuePolicy>::invalidate(void) {
+  {
+    std::lock_guard<std::mutex> lock{m_mutex};
+    m_valid = false;
+  }
+  m_notEmpty.notify_all();
+  m_notFull.notify_all();
+}
+
+template<typename T>
+bool
+ThreadsafeQueue<T, LockFreeQueuePolicy>::isValid(void) const {
+  return m_valid;
+}
+
+template<typename T>
+template<typename Pred>
+void
+ThreadsafeQueue<T, LockFreeQueuePolicy>::sleepUntil_(std::condition_variable& cond, std::atomic<int>& waiting, Pred pred) {
+  // Spin briefly before sleeping; the waiter count is published before the
+  // predicate is checked, pairing with the fence in wake_()
+  for (int i=0; i<64; ++i) {
+    if (pred())
+      return;
+    std::this_thread::yield();
+  }
+  std::unique_lock<std::mutex> lock{m_mutex};
+  waiting.fetch_add(1);
+  std::atomic_thread_fence(std::memory_order_seq_cst);
+  cond.wait(lock, pred);
+  waiting.fetch_sub(1);
+}
+
+template<typename T>
+void
+ThreadsafeQueue<T, LockFreeQueuePolicy>::wake_(std::condition_variable& cond, std::atomic<int>& waiting) {
+  std::atomic_thread_fence(std::memory_order_seq_cst);
+  if (waiting.load(std::memory_order_relaxed) > 0) {
+    // Taking the lock orders this with a waiter between its predicate
+    // check and going to sleep
+    std::lock_guard<std::mutex> lock{m_mutex};
+    cond.notify_all();
+  }
+}
+
+template<typename T>
+void
+WorkStealingQueue<T>::push(T value) {
+  auto lock = lock_();
+  m_queue.push_back(std::move(value));
+}
+
+template<typename T>
+bool
+WorkStealingQueue<T>::tryPop(T& out) {
+  auto lock = lock_();
+  if(m_queue.empty())
+    {
+      return false;
+    }
+  out = std::move(m_queue.back());
+  m_queue.pop_back();
+  return true;
+}
+
+template<typename T>
+bool
+WorkStealingQueue<T>::trySteal(T& out) {
+  auto lock = lock_();
+  if(m_queue.empty())
+    {
+      return false;
+    }
+  out = std::move(m_queue.front());
+  m_queue.pop_front();
+  return true;
+}
+
+template<typename T>
+bool
+WorkStealingQueue<T>::empty(void) const {
+  std::lock_guard<std::mutex> lock{m_mutex};
+  return m_queue.empty();
+}
+
+template<typename T>
+std::uint64_t
+WorkStealingQueue<T>::contentions(void) const {
+  return m_contentions.load(std::memory_order_relaxed);
+}
+
+template<typename T>
+std::unique_lock<std::mutex>
+WorkStealingQueue<T>::lock_(void) const {
+  std::unique_lock<std::mutex> lock{m_mutex, std::try_to_lock};
+  if(!lock.owns_lock())
+    {
+      m_contentions.fetch_add(1, std::memory_order_relaxed);
+      lock.lock();
+    }
+  return lock;
+}
+
 #endif
@@ -8,7 +8,6 @@ import numpy as np
 from sklearn import metrics
 from sklearn.linear_model import LinearRegression, LogisticRegression
 import theano
-import theano.tensor as T
 
 
 #########################
@@ -166,8 +165,9 @@ def oos_summary(clf, X_train, y_train, X_test, y_test, learning_rate=1.,
     
     clf_cb.fit(X0, y0)
     
-    x = T.dmatrix('x')
-    _loss = theano.function([x], clf.loss_without_regularization(x))
+    # Unregularized training loss of the model, in sample
+    def _loss(y_hat, y=np.ravel(y0)):
+        return clf.loss_function.value(np.ravel(y_hat), y)
     
     y_hat_clf = np.asarray(theano.function([], clf.predict())())
     y_hat_ols = reg.predict(X0).reshape(-1,1)
@@ -195,7 +195,11 @@ def oos_summary(clf, X_train, y_train, X_test, y_test, learning_rate=1.,
     X0 = X_test
     y0 = y_test.reshape(-1,1)
     
-    y_hat_clf = theano.function([], clf.predict_from_input(X0))()
+    try:
+        y_hat_clf = clf.predict_batch(X0)
+    except TypeError:
+        # Only sklearn tree distillers compile, predict the others in Theano
+        y_hat_clf = np.asarray(theano.function([], clf.predict_from_input(X0))())
     y_hat_ols = reg.predict(X0).reshape(-1,1)
     y_hat_lr = logreg.predict(X0).reshape(-1,1)
     y_hat_cb = clf_cb.predict(X0).reshape(-1,1)